@@ -0,0 +1,196 @@
+"""
+Бенчмарк анализатора на синтетических выгрузках (benchmarks/synthetic.py) нескольких размеров.
+
+Замеряются время и пиковая память (tracemalloc):
+- разбор CSV (pandas и pyarrow по схеме выгрузки) и prepare_data (обычный и компактный режимы), создание CallQualityAnalyzer;
+- каждый метод get_* / plot_* / test_* (без обязательных аргументов) на уже созданном анализаторе;
+- четыре блока приложения (те же расчёты и графики, что в app.py, через блоки report.py) на новом анализаторе.
+
+Время — минимум и медиана по --repeat запускам, память — отдельный запуск под tracemalloc
+(чтобы трассировка не искажала время). Результаты сохраняются в JSON; --compare old.json
+печатает отношение времени к прошлому прогону.
+
+    python benchmarks/analyzer_bench.py --rows 10000 100000 -o bench.json
+    python benchmarks/analyzer_bench.py --rows 10000 100000 -o new.json --compare bench.json
+"""
+import argparse
+import gc
+import inspect
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+BENCH_DIR = Path(__file__).resolve().parent
+PACKAGE_DIR = BENCH_DIR.parent / "call_quality_analyzer"
+sys.path.append(str(PACKAGE_DIR))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from analyzer import CallQualityAnalyzer  # noqa: E402
+from data_preparation import prepare_data  # noqa: E402
+from file_cache import read_export  # noqa: E402
+from synthetic import generate_export  # noqa: E402
+
+PREFIXES = ("get_", "plot_", "test_")
+
+
+def analyzer_methods():
+    """Методы get_* / plot_* / test_*, которые вызываются без аргументов."""
+    names = []
+    for name, func in inspect.getmembers(CallQualityAnalyzer, inspect.isfunction):
+        if not name.startswith(PREFIXES):
+            continue
+        params = list(inspect.signature(func).parameters.values())[1:]
+        if all(p.default is not p.empty or p.kind in (p.VAR_POSITIONAL, p.VAR_KEYWORD) for p in params):
+            names.append(name)
+    return names
+
+
+def _close(result):
+    """Фигуры закрываются сразу, чтобы память не копилась между замерами."""
+    if hasattr(result, "savefig"):
+        import matplotlib.pyplot as plt
+
+        plt.close(result)
+
+
+def measure(func, repeat=3, memory=True):
+    """(секунды по запускам, пик памяти в МБ или None)."""
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        _close(func())
+        seconds.append(time.perf_counter() - start)
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            _close(func())
+            peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        finally:
+            tracemalloc.stop()
+    return seconds, peak
+
+
+def bench_scale(rows, args):
+    """Все замеры для одного размера выгрузки."""
+    df = generate_export(rows, branches=args.branches, criteria=args.criteria, seed=args.seed)
+    csv = df.to_csv(index=False).encode()
+    raw = pd.read_csv(io.BytesIO(csv))
+    prepared = prepare_data(raw, compact=True)
+    results = []
+
+    def record(kind, stage, func, repeat=args.repeat):
+        seconds, peak = measure(func, repeat, memory=not args.no_memory)
+        results.append({
+            "rows": rows, "kind": kind, "stage": stage,
+            "seconds_min": min(seconds), "seconds_median": statistics.median(seconds),
+            "peak_mb": None if peak is None else round(peak, 2),
+        })
+        print(f"  {kind:<8} {stage:<45} {min(seconds):9.4f} s"
+              + ("" if peak is None else f"  {peak:9.1f} MB"), flush=True)
+
+    record("load", "read_csv", lambda: pd.read_csv(io.BytesIO(csv)))
+    record("load", "read_export (pyarrow, схема)", lambda: read_export(csv, "export.csv"))
+    typed = read_export(csv, "export.csv")
+    record("load", "prepare_data(compact, схема)", lambda: prepare_data(typed, compact=True))
+    record("load", "prepare_data", lambda: prepare_data(raw))
+    record("load", "prepare_data(compact)", lambda: prepare_data(raw, compact=True))
+    record("load", "CallQualityAnalyzer", lambda: CallQualityAnalyzer(prepared, compact=True, prepared=True))
+
+    analyzer = CallQualityAnalyzer(prepared, compact=True, prepared=True)
+    for name in analyzer_methods():
+        if args.no_figures and name.startswith("plot_"):
+            continue
+        # первый вызов заполняет кэши анализатора (кубы по периодам, матрицу критериев) — он тоже учитывается
+        record("method", name, lambda name=name: getattr(analyzer, name)())
+
+    if not args.no_blocks:
+        import report
+
+        options = {"format": "csv", "jobs": 1, "figures": not args.no_figures, "dpi": 100,
+                   "min_pairs": 10, "alpha": 0.05, "backend": "pandas"}
+        with tempfile.TemporaryDirectory() as tmp:
+            for block in report.REPORT_BLOCKS:
+                # новый анализатор на каждый запуск: блок считается с нуля, как после загрузки файла
+                record("block", block, lambda block=block: report._run_block(
+                    block, Path(tmp), options, CallQualityAnalyzer(prepared, compact=True, prepared=True)
+                ), repeat=max(1, args.repeat // 2))
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results, params, old_path):
+    """Отношение времени (новое / старое) для совпадающих замеров."""
+    old_payload = json.loads(Path(old_path).read_text(encoding="utf-8"))
+    old = {(r["rows"], r["kind"], r["stage"]): r for r in old_payload["results"]}
+    print(f"\nСравнение с {old_path} (медиана, новое / старое):")
+    changed = [k for k, v in params.items() if k != "rows" and old_payload.get("params", {}).get(k) != v]
+    if changed:
+        print(f"  ВНИМАНИЕ: параметры прогонов различаются ({', '.join(changed)}), сравнение может быть некорректным")
+    for r in results:
+        prev = old.get((r["rows"], r["kind"], r["stage"]))
+        if prev and prev["seconds_median"] > 0:
+            ratio = r["seconds_median"] / prev["seconds_median"]
+            print(f"  {r['rows']:>9} {r['kind']:<8} {r['stage']:<45} {ratio:6.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк CallQualityAnalyzer на синтетических данных")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000], help="размеры выгрузок (строк)")
+    parser.add_argument("--branches", type=int, default=30)
+    parser.add_argument("--criteria", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="запусков на замер (время — минимум и медиана)")
+    parser.add_argument("--no-memory", action="store_true", help="без замера памяти (tracemalloc)")
+    parser.add_argument("--no-figures", action="store_true", help="без plot_* и графиков в блоках")
+    parser.add_argument("--no-blocks", action="store_true", help="без блоков приложения")
+    parser.add_argument("-o", "--out", default="benchmark.json", help="файл результатов JSON")
+    parser.add_argument("--compare", default=None, help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args(argv)
+
+    results = []
+    for rows in args.rows:
+        print(f"\n{rows} строк")
+        results.extend(bench_scale(rows, args))
+
+    params = {k: v for k, v in vars(args).items() if k not in ("out", "compare")}
+    payload = {"environment": environment(), "params": params, "results": results}
+    Path(args.out).write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\nРезультаты: {args.out}")
+    if args.compare:
+        compare(results, params, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Совпадение таблиц CallQualityAnalyzer на разных движках (pandas / DuckDB / Polars) и время расчёта.
+
+Выгрузки (CSV, XLSX или Parquet) переводятся в Parquet (--parts — на сколько файлов делить
+каждую выгрузку), затем для каждого движка строится анализатор CallQualityAnalyzer.from_parquet
+и все сводные таблицы сравниваются с результатом pandas. При расхождении код возврата 1.
+Недоступные движки (пакет не установлен) пропускаются.
+
+    python benchmarks/backend_equivalence.py выгрузка.csv --parts 4
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PACKAGE_DIR = Path(__file__).resolve().parent.parent / "call_quality_analyzer"
+sys.path.append(str(PACKAGE_DIR))
+
+import pandas as pd  # noqa: E402
+
+from analyzer import CallQualityAnalyzer  # noqa: E402
+from backends import BACKENDS, available_backends  # noqa: E402
+from file_cache import read_export  # noqa: E402
+
+
+def tables(a: CallQualityAnalyzer) -> dict:
+    """
+    Все сводные таблицы анализатора, которые строятся из агрегатов (таблицы по строкам оценок —
+    корреляции и сравнения критериев — движками Parquet не строятся).
+    """
+    out = {
+        "all_score": a.get_all_score_by_branch(),
+        "call_count": a.get_call_count(),
+        "avg_all": a.get_avg_score_by_branch(),
+        "avg_call": a.get_avg_score_by_branch_call(),
+        "avg_badge": a.get_avg_score_by_branch_badge(),
+        "avg_full": a.get_full_avg_score_by_branch(),
+        "histogram": a.get_score_histogram(),
+    }
+    for name, df_in in (("all", a.df), ("call", a.df_call), ("badge", a.df_badge)):
+        for freq in ("D", "W", "M"):
+            out[f"period_{freq}_{name}"] = a.get_avg_score_by_period(df_in, freq)
+        out[f"criteria_{name}"] = a.get_avg_score_criteria(df_in)
+    out["impact_all"] = a.get_criteria_impact()
+    out["impact_call"] = a.get_criteria_impact(
+        a.df_call, avg_score_by_branch=a.get_avg_score_by_branch_call(), count_col="count_call"
+    )
+    out["hierarchy"] = a.get_hierarchy()
+    out["facet_groups"] = a.get_facet_groups()
+    out["avg_ci"] = a.get_avg_score_ci()
+    out["avg_ci_criteria"] = a.get_avg_score_ci(by_criteria=True)
+    out["drift"] = a.get_drift_alerts(only_flagged=False)
+    out["drift_criteria"] = a.get_drift_alerts(by_criteria=True, only_flagged=False)
+    # свёртки по организации — те же агрегаты по другому группировщику
+    grouper = "organization_name"
+    out["all_score_org"] = a.get_all_score_by_branch(grouper)
+    out["call_count_org"] = a.get_call_count(grouper)
+    out["avg_full_org"] = a.get_full_avg_score_by_branch(grouper)
+    out["period_W_org"] = a.get_avg_score_by_period(freq="W", grouper=grouper)
+    out["criteria_org"] = a.get_avg_score_criteria(grouper=grouper)
+    out["histogram_org"] = a.get_score_histogram(grouper=grouper)
+    return out
+
+
+def to_parquet(paths, out_dir: Path, parts: int):
+    """Выгрузки -> Parquet-файлы (каждая делится на parts частей по строкам)."""
+    files = []
+    for path in map(Path, paths):
+        if path.suffix == ".parquet":
+            files.append(path)
+            continue
+        df = read_export(path.read_bytes(), path.name)
+        step = -(-len(df) // parts) or 1
+        for i, start in enumerate(range(0, max(len(df), 1), step)):
+            target = out_dir / f"{path.stem}-{i}.parquet"
+            df.iloc[start:start + step].to_parquet(target, index=False)
+            files.append(target)
+    return files
+
+
+def compare(expected: dict, actual: dict):
+    """Список (таблица, описание расхождения)."""
+    diffs = []
+    for name, df in expected.items():
+        try:
+            pd.testing.assert_frame_equal(
+                df.reset_index(), actual[name].reset_index(),
+                check_dtype=False, check_index_type=False, check_column_type=False,
+            )
+        except AssertionError as e:
+            diffs.append((name, str(e).splitlines()[0]))
+    return diffs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сравнение движков CallQualityAnalyzer")
+    parser.add_argument("files", nargs="+", help="выгрузки .csv / .xlsx / .parquet")
+    parser.add_argument("--parts", type=int, default=1, help="на сколько Parquet-файлов делить выгрузку")
+    parser.add_argument("--backends", nargs="*", default=list(BACKENDS), help="движки для сравнения с pandas")
+    args = parser.parse_args(argv)
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        files = to_parquet(args.files, Path(tmp), max(args.parts, 1))
+        print(f"Parquet-файлов: {len(files)}")
+        expected = None
+        for backend in ["pandas"] + args.backends:
+            if backend not in available_backends():
+                print(f"{backend:<8} пропущен (пакет не установлен)")
+                continue
+            start = time.perf_counter()
+            a = CallQualityAnalyzer.from_parquet(files, backend=backend)
+            result = tables(a)
+            seconds = time.perf_counter() - start
+            if expected is None:
+                expected = result
+                print(f"{backend:<8} {seconds:8.2f} s  (эталон)")
+                continue
+            diffs = compare(expected, result)
+            status = "совпадает" if not diffs else f"РАСХОЖДЕНИЙ: {len(diffs)}"
+            print(f"{backend:<8} {seconds:8.2f} s  {status}")
+            for name, message in diffs:
+                print(f"         {name}: {message}")
+            failed = failed or bool(diffs)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+Время импорта модулей call_quality_analyzer (по данным python -X importtime).
+
+Сценарии:
+- tables  — import analyzer (только таблицы, без графиков и тестов);
+- full    — то же + visualizations и scipy (как при первом построении графиков/тестов).
+
+Для сценария tables проверяется, что тяжёлые зависимости не загружаются,
+и (опционально) что время не превышает --max-ms; при нарушении код возврата 1.
+
+    python benchmarks/import_time.py --repeat 5 --max-ms 1500
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+PACKAGE_DIR = Path(__file__).resolve().parent.parent / "call_quality_analyzer"
+
+SCENARIOS = {
+    "tables": "import analyzer",
+    "full": "import analyzer, visualizations, scipy.special",
+}
+# не должны загружаться при импорте для таблиц
+HEAVY_MODULES = ["streamlit", "matplotlib", "seaborn", "scipy", "duckdb", "polars"]
+
+
+def parse_importtime(stderr: str):
+    """Строки importtime -> список (модуль, self мкс, cumulative мкс, уровень вложенности)."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def measure(code: str):
+    """Один запуск в чистом интерпретаторе: (суммарное время импорта, мс; строки importtime)."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=PACKAGE_DIR, capture_output=True, text=True, check=True,
+    )
+    rows = parse_importtime(proc.stderr)
+    # модули верхнего уровня вложенности — то, что импортировано непосредственно кодом
+    total_us = sum(cumulative for _, _, cumulative, depth in rows if depth == 1)
+    return total_us / 1000, rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк времени импорта call_quality_analyzer")
+    parser.add_argument("--repeat", type=int, default=5, help="число запусков на сценарий (берётся медиана)")
+    parser.add_argument("--max-ms", type=float, default=None, help="порог для сценария tables, мс")
+    parser.add_argument("--top", type=int, default=10, help="сколько самых медленных модулей показать")
+    args = parser.parse_args(argv)
+
+    failed = False
+    medians = {}
+    for scenario, code in SCENARIOS.items():
+        runs = [measure(code) for _ in range(args.repeat)]
+        medians[scenario] = statistics.median(ms for ms, _ in runs)
+        rows = runs[-1][1]
+        print(f"{scenario:<7} {medians[scenario]:8.1f} мс  ({code})")
+        for name, self_us, _, _ in sorted(rows, key=lambda r: -r[1])[:args.top]:
+            print(f"        {self_us / 1000:8.1f} мс  {name}")
+
+        if scenario == "tables":
+            loaded = {name.split(".")[0] for name, *_ in rows}
+            heavy = [m for m in HEAVY_MODULES if m in loaded]
+            if heavy:
+                print(f"ОШИБКА: при импорте для таблиц загружены {', '.join(heavy)}")
+                failed = True
+            if args.max_ms is not None and medians[scenario] > args.max_ms:
+                print(f"ОШИБКА: импорт для таблиц {medians[scenario]:.1f} мс > {args.max_ms} мс")
+                failed = True
+
+    print(f"\ntables / full: {medians['tables'] / medians['full']:.0%}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+Синтетические выгрузки в формате базы (как SQL-запрос из README): по строке на оценку критерия звонка.
+
+- филиалы распределены по организациям, размеры филиалов неравные (логнормальные веса);
+- у каждого звонка — тип (REGULAR / AUDIO_BADGE), время создания и подмножество критериев;
+- оценка 0..10: уровень филиала + сдвиг критерия + шум; часть оценок — 0 (не оценено),
+  такие строки отбрасывает prepare_data.
+Результат полностью определяется seed.
+
+    python benchmarks/synthetic.py 1000000 -o export.csv --branches 300
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ["call_id", "created_at", "call_type", "branch_name", "organization_name", "score", "criteria_name"]
+# критерии из выгрузок (в том числе те, что используются в статистических тестах)
+CRITERIA = [
+    "Профессиональная этика",
+    "Активное слушание",
+    "Работа с возражениями",
+    "Качество презентации продукта",
+    "Приветствие",
+    "Выявление потребностей",
+    "Завершение разговора",
+]
+
+
+def criteria_names(n):
+    return CRITERIA[:n] + [f"Критерий {i + 1}" for i in range(len(CRITERIA), n)]
+
+
+def generate_export(rows=100_000, branches=30, organizations=5, criteria=5,
+                    start="2025-09-01", end="2025-12-01", badge_share=0.3,
+                    criteria_share=0.85, zero_share=0.03, seed=0) -> pd.DataFrame:
+    """
+    Выгрузка из rows строк со столбцами COLUMNS.
+    created_at — равномерно в [start, end), строкой "%Y-%m-%d %H:%M:%S", как в CSV из базы.
+    """
+    rng = np.random.default_rng(seed)
+    names = criteria_names(criteria)
+    per_call = max(criteria * criteria_share, 1)
+    # с запасом: число критериев у звонка случайно, лишние строки отрезаются
+    n_calls = int(np.ceil(rows / per_call * 1.05)) + 10
+
+    # филиалы: организация, вес (доля звонков) и уровень качества
+    branch_org = np.arange(branches) % max(organizations, 1)
+    weights = rng.lognormal(0, 1, branches)
+    branch_level = rng.normal(7, 1, branches)
+    criteria_shift = rng.normal(0, 0.7, criteria)
+
+    call_branch = rng.choice(branches, n_calls, p=weights / weights.sum())
+    call_badge = rng.random(n_calls) < badge_share
+    t0, t1 = pd.Timestamp(start), pd.Timestamp(end)
+    call_time = t0 + pd.to_timedelta(rng.integers(0, int((t1 - t0).total_seconds()), n_calls), unit="s")
+
+    # звонок × критерий: каждый критерий присутствует с вероятностью criteria_share
+    present = rng.random((n_calls, criteria)) < criteria_share
+    call_idx, crit_idx = np.nonzero(present)
+    call_idx, crit_idx = call_idx[:rows], crit_idx[:rows]
+    n = len(call_idx)
+
+    branch = call_branch[call_idx]
+    score = np.rint(branch_level[branch] + criteria_shift[crit_idx] + rng.normal(0, 1.5, n))
+    score = np.clip(score, 1, 10).astype("int64")
+    score[rng.random(n) < zero_share] = 0
+
+    branch_names = np.array([f"Филиал {i + 1}" for i in range(branches)], dtype=object)
+    org_names = np.array([f"Организация {i + 1}" for i in range(max(organizations, 1))], dtype=object)
+    df = pd.DataFrame({
+        "call_id": 100_000 + call_idx,
+        "created_at": pd.Series(call_time.strftime("%Y-%m-%d %H:%M:%S")).to_numpy()[call_idx],
+        "call_type": np.where(call_badge[call_idx], "AUDIO_BADGE", "REGULAR"),
+        "branch_name": branch_names[branch],
+        "organization_name": org_names[branch_org[branch]],
+        "score": score,
+        "criteria_name": np.array(names, dtype=object)[crit_idx],
+    })
+    return df[COLUMNS]
+
+
+def save_export(df: pd.DataFrame, path):
+    """Сохранение в формате по расширению: .csv, .xlsx или .parquet."""
+    path = Path(path)
+    if path.suffix == ".parquet":
+        df.to_parquet(path, index=False)
+    elif path.suffix == ".xlsx":
+        df.to_excel(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Синтетическая выгрузка звонков")
+    parser.add_argument("rows", type=int, help="число строк (оценок критериев)")
+    parser.add_argument("-o", "--out", default="synthetic.csv", help="файл .csv / .xlsx / .parquet")
+    parser.add_argument("--branches", type=int, default=30)
+    parser.add_argument("--organizations", type=int, default=5)
+    parser.add_argument("--criteria", type=int, default=5)
+    parser.add_argument("--start", default="2025-09-01")
+    parser.add_argument("--end", default="2025-12-01")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    df = generate_export(args.rows, branches=args.branches, organizations=args.organizations,
+                         criteria=args.criteria, start=args.start, end=args.end, seed=args.seed)
+    print(f"{len(df)} строк -> {save_export(df, args.out)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,24 @@
+import os
+import threading
+
+import numpy as np
 import pandas as pd
-import streamlit as st
-from scipy.stats import wilcoxon
-
-from data_preparation import prepare_data
-from visualizations import (
-    plot_score_distributions,
-    plot_avg_bar,
-    plot_weekly_trends,
-    plot_weekly_grid,
-    plot_heatmap,
+
+from backends import get_backend
+from data_preparation import parse_datetime, prepare_data, iter_prepared_chunks
+from stat_tests import (
+    adjust_pvalues, bootstrap_mean_ci, ci_ranks, compare_criteria_pairs, correlation_from_stats, correlation_stats,
 )
+from lazy_imports import lazy_module
+from monitoring import DriftMonitor
+from instrumentation import instrument_methods
+
+# графики (matplotlib/seaborn) загружаются только при первом построении фигуры
+visualizations = lazy_module("visualizations")
 
 
+# замер публичных методов (выключен по умолчанию, см. instrumentation)
+@instrument_methods(("get_", "plot_", "test_", "compare_", "from_", "append", "save_state", "load_state"))
 class CallQualityAnalyzer:
     """
     Класс-обёртка, возвращает все сводные таблицы и фигуры, 
@@ -19,42 +26,376 @@ class CallQualityAnalyzer:
     """
     # Минимальный набор обязательных столбцов
     REQUIRED_BASE = ["call_id", "call_type", "branch_name", "organization_name", "score"]
+    # Статистики куба (остальные столбцы куба — измерения)
+    CUBE_STATS = ["n", "score_sum", "score_sq_sum", "n_calls"]
+    HIST_STATS = ["count"]
+    # календарные периоды: код -> (подпись оси, «…ая динамика», «…ой динамики»)
+    PERIODS = {
+        "D": ("День", "Дневная", "дневной"),
+        "W": ("Неделя", "Недельная", "недельной"),
+        "M": ("Месяц", "Месячная", "месячной"),
+    }
+    # уровни иерархии (grouper): итог -> организация -> филиал. Куб филиалов хранит и organization_name,
+    # верхние уровни сворачиваются из его статистик без повторного прохода по строкам
+    LEVELS = {
+        "total": "Итого",
+        "organization_name": "Организация",
+        "organization_branch_name": "Филиал",
+    }
+    TOTAL_LABEL = "Все филиалы"
+    # порядок фасетов (филиалов) в постраничных сетках графиков: код -> подпись
+    FACET_SORTS = {
+        "score_desc": "Средняя оценка ↓",
+        "score_asc": "Средняя оценка ↑",
+        "count_desc": "Число оценок ↓",
+        "name": "Название",
+    }
+    # политики для повторных оценок одного критерия в звонке (матрица звонок × критерий):
+    # среднее, первая / последняя по порядку строк, ошибка
+    DUPLICATE_POLICIES = ("mean", "first", "last", "error")
+    # ключ оценки для поиска повторов между выгрузками (как в combine_prepared)
+    SCORE_KEYS = ["call_id", "criteria_name"]
 
-    def __init__(self, df: pd.DataFrame):
+    def __init__(self, df: pd.DataFrame, compact: bool = False, prepared: bool = False):
         """
         Инициализация: сначала сохраняем raw, подготавливаем данные,
         затем вычисляем df_call/df_badge, call_badge_count и доступные блоки.
+        compact=True — компактное представление (category-метки, целочисленный score), см. prepare_data.
+        prepared=True — df уже прошёл prepare_data (например, загружен из кэша на диске).
         """
-        # сохраняем "сырые" данные (на случай потребности)
-        self.raw = df.copy()
+        # сохраняем ссылку на "сырые" данные (без копии: prepare_data исходный df не изменяет)
+        self.raw = df
+        # строки доступны целиком (в потоковом режиме — только агрегаты)
+        self.streamed = False
+        self.compact = compact
+        # движок агрегатов по файлам на диске (None — расчёт в pandas по self.df)
+        self.backend = None
 
         # подготавливаем (создаёт organization_branch_name, фильтрует score==0, парсит created_at)
-        self.df = prepare_data(self.raw)
+        self.df = df if prepared else prepare_data(self.raw, compact=compact)
 
         # разделение по типам (безопасно — если нет колонки, получаем пустой DF)
         if "call_type" in self.df.columns:
-            self.df_call = self.df[self.df["call_type"] == "REGULAR"].copy()
-            self.df_badge = self.df[self.df["call_type"] == "AUDIO_BADGE"].copy()
+            self._partition_by_type()
         else:
+            self.type_ranges = {}
             self.df_call = pd.DataFrame()
             self.df_badge = pd.DataFrame()
 
+        # единый проход по строкам: таблицы достаточных статистик,
+        # из которых затем строятся все сводные таблицы
+        self._cubes = {}
+        self._call_cubes = {}
+        self._hists = {}
+        self._key_sets = None
+        self._pair_data = {}
+        # детекторы сдвигов (сохраняются между append, см. get_drift_monitor)
+        self._monitors = {}
+        # ленивые агрегаты строятся под блокировкой: таблицы приложения считаются в фоновых потоках
+        self._lock = threading.RLock()
+        self._finalize()
+
+    def _partition_by_type(self):
+        """
+        Одна стабильная сортировка по call_type (только если данные ещё не отсортированы),
+        после чего каждый тип — непрерывный диапазон строк.
+        df_call / df_badge — iloc-срезы этого диапазона (без копирования данных).
+        """
+        codes, types = pd.factorize(self.df["call_type"], sort=True)
+        if len(codes) > 1 and (np.diff(codes) < 0).any():
+            order = np.argsort(codes, kind="stable")
+            self.df = self.df.take(order)
+            codes = codes[order]
+        bounds = np.searchsorted(codes, np.arange(len(types) + 1))
+        self.type_ranges = {t: (int(bounds[i]), int(bounds[i + 1])) for i, t in enumerate(types)}
+        self.df_call = self.df.iloc[slice(*self.type_ranges.get("REGULAR", (0, 0)))]
+        self.df_badge = self.df.iloc[slice(*self.type_ranges.get("AUDIO_BADGE", (0, 0)))]
+
+    def _finalize(self):
+        """Общая часть инициализации: кубы, счётчики звонков и доступные блоки."""
+        self.cube = self._get_cube()
+        self.call_cube = self._get_call_cube()
+        # свёртки куба по неделям/месяцам (строятся при первом запросе)
+        self._period_cubes = {}
+
         # вычисляем таблицу с count по call_id (нужно для блока с вкладом критериев)
         self.call_badge_count = self._compute_call_badge_count()
 
         # когда self.df существует, можно корректно определить доступные блоки
         self.available_blocks = self._detect_available_blocks()
 
+    @classmethod
+    def _empty_state(cls, compact=False):
+        """Анализатор без строк: только агрегаты (потоковый и инкрементальный режимы)."""
+        self = cls.__new__(cls)
+        self.raw = None
+        self.streamed = True
+        self.compact = compact
+        self.backend = None
+        self.type_ranges = {}
+        self._set_schema(pd.DataFrame())
+        self._cubes = {}
+        self._call_cubes = {}
+        self._hists = {}
+        self._key_sets = {}
+        self._pair_data = {}
+        self._monitors = {}
+        self._lock = threading.RLock()
+        return self
+
+    @classmethod
+    def from_csv_chunks(cls, source, chunksize=200_000, grouper="organization_branch_name", compact=False, **read_kwargs):
+        """
+        Потоковый режим для больших CSV: файл читается порциями по chunksize строк,
+        к каждой порции применяется prepare_data, и порция сразу сворачивается в куб
+        (так же, как новая выгрузка в append).
+        Строки не сохраняются: df/df_call/df_badge содержат только схему (0 строк),
+        таблицы строятся из агрегатов, графики распределений — из гистограмм оценок,
+        которые также накапливаются по порциям. Статистические тесты в этом режиме
+        недоступны (им нужны строки).
+
+        Память: куб — O(число групп); для точного подсчёта уникальных call_id
+        хранятся 64-битные хэши ключей (звонок и звонок × критерий).
+        """
+        self = cls._empty_state(compact)
+        for chunk in iter_prepared_chunks(source, chunksize=chunksize, compact=compact, **read_kwargs):
+            self._fold_prepared(chunk, grouper)
+        self._finalize()
+        return self
+
+    @classmethod
+    def from_parquet(cls, paths, backend="pandas", compact=True, **backend_options):
+        """
+        Анализ выгрузок в Parquet-файлах (исходная схема выгрузки, как в CSV).
+        - backend="pandas" (по умолчанию): файлы читаются в память, обычный построчный режим;
+        - backend="duckdb" / "polars": группировки выполняет встроенный движок прямо по файлам,
+          в памяти только агрегаты (как в потоковом режиме), поэтому объём данных не ограничен памятью.
+          Все сводные таблицы совпадают с расчётом в pandas; статистические тесты недоступны
+          (им нужны строки). Кубы для других grouper тоже считаются движком при первом запросе.
+        """
+        if isinstance(paths, (str, os.PathLike)):
+            paths = [paths]
+        if backend == "pandas":
+            return cls(pd.concat([pd.read_parquet(p) for p in paths], ignore_index=True), compact=compact)
+        self = cls._empty_state(compact)
+        self.backend = get_backend(backend, paths, **backend_options)
+        self._set_schema(self.backend.schema(compact))
+        # множества ключей звонков строятся движком только при append/save_state
+        self._key_sets = None
+        self._finalize()
+        return self
+
+    def _set_schema(self, df):
+        """Только схема столбцов (0 строк); df_call/df_badge — отдельные объекты, как срезы в построчном режиме."""
+        self.df = df.iloc[0:0]
+        self.df_call = df.iloc[0:0]
+        self.df_badge = df.iloc[0:0]
+
+    # инкрементальный режим: агрегаты + множества ключей уникальных звонков,
+    # новые выгрузки добавляются без пересчёта истории
+    STATE_VERSION = 5
+
+    def _fold_prepared(self, df, grouper="organization_branch_name", drop_known=False):
+        """
+        Добавляет подготовленные строки df к агрегатам: куб, гистограммы, число уникальных звонков.
+        n_calls увеличивается только на звонки, которых ещё нет в множествах ключей,
+        поэтому результат совпадает с полным пересчётом. Стоимость — O(размер df + размер куба).
+        drop_known=True — оценки (call_id, criteria_name), уже учтённые в агрегатах, пропускаются
+        (новая выгрузка пересекается по периоду с историей). Возвращает число пропущенных строк.
+        """
+        if self.df.columns.empty:
+            self._set_schema(df)
+        if df.empty or grouper not in df.columns:
+            return 0
+        known = self._known_scores(df)
+        dropped = int(known.sum()) if drop_known else 0
+        if dropped:
+            df = df[~known]
+            if df.empty:
+                return dropped
+        cube = self._cubes.get(grouper)
+        piece = self._build_cube(df, grouper)
+        if cube is not None and not cube.empty and set(cube.columns) != set(piece.columns):
+            raise ValueError(
+                "Столбцы новой выгрузки не совпадают с сохранённым состоянием: "
+                f"{sorted(map(str, piece.columns))} вместо {sorted(map(str, cube.columns))}"
+            )
+        if "call_id" in df.columns:
+            # уникальные звонки в разрезе критериев: только ранее не встречавшиеся ключи
+            keys = [c for c in piece.columns if c not in self.CUBE_STATS]
+            frame = pd.DataFrame(self._cube_keys(df, grouper))
+            frame["call_id"] = df["call_id"]
+            new = self._new_keys(frame, "criteria_calls")
+            counts = new.groupby(keys, dropna=False, observed=True).size().rename("n_calls").reset_index()
+            piece = piece.drop(columns="n_calls").merge(counts, on=keys, how="left")
+            piece["n_calls"] = piece["n_calls"].fillna(0).astype("int64")
+
+            call_piece = self._count_calls(self._new_keys(self._call_keys(df, grouper), "calls"))
+            call_cube = self._call_cubes.get(grouper)
+            self._call_cubes[grouper] = (
+                call_piece if call_cube is None or call_cube.empty
+                else self._fold_cube(call_cube, call_piece, ["n_calls"])
+            )
+        self._cubes[grouper] = piece if cube is None or cube.empty else self._fold_cube(cube, piece)
+        hist = self._hists.get(grouper)
+        piece = self._build_hist(df, grouper)
+        self._hists[grouper] = piece if hist is None or hist.empty else self._fold_cube(hist, piece, self.HIST_STATS)
+        return dropped
+
+    def _new_keys(self, frame, name):
+        """
+        Оставляет в frame (измерения + call_id) только ключи, которых нет в множестве name,
+        и добавляет их туда. Множество — отсортированный массив 64-битных хэшей ключей:
+        поиск — searchsorted по новым ключам, вставка — слияние без пересортировки истории.
+        """
+        frame = self._plain_keys(frame[frame["call_id"].notna()].drop_duplicates())
+        return frame[~self._merge_hashes(frame, name)]
+
+    def _merge_hashes(self, frame, name):
+        """
+        Маска строк frame, ключи которых уже есть в множестве name; ключи остальных добавляются в него.
+        Множество — отсортированный массив 64-битных хэшей (поиск — searchsorted, вставка — слияние).
+        """
+        hashes = pd.util.hash_pandas_object(self._hashable_keys(frame), index=False).to_numpy()
+        known = self._key_sets.get(name, np.empty(0, dtype="uint64"))
+        pos = np.searchsorted(known, hashes)
+        seen = np.zeros(len(hashes), dtype=bool)
+        inside = pos < len(known)
+        seen[inside] = known[pos[inside]] == hashes[inside]
+        added = np.unique(hashes[~seen])
+        self._key_sets[name] = np.insert(known, np.searchsorted(known, added), added)
+        return seen
+
+    def _known_scores(self, df):
+        """
+        Маска строк df, чьи оценки (call_id, criteria_name) уже учтены в агрегатах (множество scores);
+        ключи остальных добавляются. Повторы внутри df не отмечаются — как в combine_prepared.
+        Без call_id повторы не ищутся, без criteria_name ключ — только call_id.
+        """
+        keys = [k for k in self.SCORE_KEYS if k in df.columns]
+        if not keys or keys[0] != "call_id" or df.empty:
+            return np.zeros(len(df), dtype=bool)
+        return self._merge_hashes(self._plain_keys(df[keys].copy()), "scores")
+
+    @staticmethod
+    def _hashable_keys(frame):
+        """
+        Единое представление ключей для хэширования независимо от источника:
+        даты — в наносекундах, целочисленные call_id из float-столбца (пропуски в файле) — как int64.
+        """
+        frame = frame.copy(deep=False)
+        for col in frame.columns:
+            if pd.api.types.is_datetime64_any_dtype(frame[col]):
+                frame[col] = frame[col].astype("datetime64[ns]")
+        call_id = frame["call_id"]
+        if pd.api.types.is_float_dtype(call_id) and (call_id % 1 == 0).all():
+            frame["call_id"] = call_id.astype("int64")
+        return frame
+
+    def _ensure_key_sets(self, grouper="organization_branch_name"):
+        """Множества ключей для анализатора, построенного по строкам (один проход по истории)."""
+        if self._key_sets is not None:
+            return
+        self._key_sets = {}
+        if self.backend is not None:
+            for name, criteria in (("criteria_calls", True), ("calls", False)):
+                keys = self.backend.keys(grouper, criteria)
+                if not keys.empty:
+                    self._new_keys(keys, name)
+                    if criteria:
+                        self._known_scores(keys)
+        elif not self.df.empty and {"call_id", grouper}.issubset(self.df.columns):
+            frame = pd.DataFrame(self._cube_keys(self.df, grouper))
+            frame["call_id"] = self.df["call_id"]
+            self._new_keys(frame, "criteria_calls")
+            self._new_keys(self._call_keys(self.df, grouper), "calls")
+            self._known_scores(self.df)
+
+    def append(self, df_new: pd.DataFrame, grouper="organization_branch_name"):
+        """
+        Добавляет новую выгрузку к агрегатам, история не пересчитывается.
+        Выгрузка может пересекаться по периоду с историей: оценки (call_id, criteria_name), уже учтённые
+        в агрегатах, пропускаются (их число — в appended_duplicates), повторы внутри df_new сохраняются.
+        При расхождении оценок в повторе остаётся ранее добавленная — как в combine_prepared / --merge
+        (берётся первый файл), поэтому сводные таблицы совпадают с полным пересчётом по тем же выгрузкам.
+        Анализатор переходит в режим агрегатов: построчные данные не хранятся (как в потоковом режиме).
+        """
+        self._ensure_key_sets(grouper)
+        # агрегаты по истории строятся до того, как строки будут отброшены
+        cube, call_cube, hist = self._get_cube(grouper), self._get_call_cube(grouper), self._get_hist(grouper)
+        self._cubes, self._call_cubes, self._hists = {grouper: cube}, {grouper: call_cube}, {grouper: hist}
+        self.raw = None
+        self.streamed = True
+        self.backend = None
+        self.type_ranges = {}
+        self._set_schema(self.df)
+        self._pair_data = {}
+        self.appended_duplicates = self._fold_prepared(prepare_data(df_new, compact=self.compact), grouper,
+                                                       drop_known=True)
+        self._finalize()
+        return self
+
+    def save_state(self, path, grouper="organization_branch_name"):
+        """
+        Сохраняет агрегатное состояние (кубы, гистограммы, множества ключей звонков, схему столбцов)
+        в файл; затем его можно загрузить load_state и дополнять через append.
+        """
+        self._ensure_key_sets(grouper)
+        state = {
+            "version": self.STATE_VERSION,
+            "grouper": grouper,
+            "compact": self.compact,
+            "schema": self.df.iloc[0:0],
+            "cube": self._get_cube(grouper),
+            "call_cube": self._get_call_cube(grouper),
+            "hist": self._get_hist(grouper),
+            "key_sets": self._key_sets,
+            "monitors": self._monitors,
+        }
+        pd.to_pickle(state, path)
+        return path
+
+    @classmethod
+    def load_state(cls, path):
+        """Загружает состояние, сохранённое save_state."""
+        state = pd.read_pickle(path)
+        if state.get("version") != cls.STATE_VERSION:
+            raise ValueError(f"Неподдерживаемая версия состояния: {state.get('version')}")
+        self = cls._empty_state(state["compact"])
+        grouper = state["grouper"]
+        self._set_schema(state["schema"])
+        self._cubes[grouper] = state["cube"]
+        self._call_cubes[grouper] = state["call_cube"]
+        self._hists[grouper] = state["hist"]
+        self._key_sets = state["key_sets"]
+        self._monitors = state.get("monitors", {})
+        self._finalize()
+        return self
+
+    @classmethod
+    def _fold_cube(cls, cube, piece, stats=None):
+        """Сворачивает два куба в один (статистики аддитивны)."""
+        stats = cls.CUBE_STATS if stats is None else stats
+        keys = [c for c in cube.columns if c not in stats]
+        merged = pd.concat([cube, piece], ignore_index=True)
+        return merged.groupby(keys, dropna=False, observed=True).sum().reset_index()
+
     def _detect_available_blocks(self):
+        cols = self.df.columns if hasattr(self, "df") and self.df is not None else []
+        return self.detect_available_blocks(cols)
+
+    @classmethod
+    def detect_available_blocks(cls, columns):
         """
         Проверяет наличие необходимых столбцов.
         Блоки 1-2 требуют базовый набор,
         блок 3 — базовый + created_at,
         блок 4 — базовый + criteria_name.
+        Нужны только названия столбцов, поэтому блоки известны до подготовки данных.
         """
-        cols = set(self.df.columns) if hasattr(self, "df") and self.df is not None else set()
+        cols = set(columns)
 
-        base_ok = all(c in cols for c in self.REQUIRED_BASE)
+        base_ok = all(c in cols for c in cls.REQUIRED_BASE)
         date_ok = "created_at" in cols
         criteria_ok = "criteria_name" in cols
 
@@ -65,21 +406,276 @@ class CallQualityAnalyzer:
                 }
  
       
+    # таблицы достаточных статистик (куб)
+    @staticmethod
+    def _period_start(days, freq="D"):
+        """
+        Начало календарного периода для каждой даты (векторно, NaT сохраняется):
+        D — день, W — понедельник ISO-недели, M — первое число месяца.
+        """
+        days = pd.to_datetime(days, errors="coerce").dt.floor("D")
+        if freq == "W":
+            return days - pd.to_timedelta(days.dt.weekday, unit="D")
+        if freq == "M":
+            return days - pd.to_timedelta(days.dt.day - 1, unit="D")
+        if freq != "D":
+            raise ValueError(f"Неизвестный период: {freq}")
+        return days
+
+    @staticmethod
+    def period_labels(starts, freq="W"):
+        """Подписи периодов по их началу: 2025-09-15 (день), 2025-W38 (ISO-неделя), 2025-09 (месяц)."""
+        starts = pd.DatetimeIndex(starts)
+        if freq == "W":
+            iso = starts.isocalendar()
+            return list(iso["year"].astype(str) + "-W" + iso["week"].astype(str).str.zfill(2))
+        return list(starts.strftime("%Y-%m-%d" if freq == "D" else "%Y-%m"))
+
+    def _cube_keys(self, df, grouper):
+        """
+        Измерения куба, доступные в df: grouper, organization_name (для филиалов), call_type, criteria_name, day.
+        День — абсолютная календарная дата: недели и месяцы сворачиваются из дней,
+        ключи не зависят от состава выборки и не сдвигаются при добавлении данных.
+        Организация однозначно определяется филиалом, поэтому куб от неё не растёт,
+        а уровни «организация» и «итого» сворачиваются из куба филиалов.
+        """
+        keys = {grouper: df[grouper]}
+        for col in self._level_dims(df.columns, grouper) + ["call_type", "criteria_name"]:
+            if col in df.columns:
+                keys[col] = df[col]
+        if "created_at" in df.columns:
+            keys["day"] = self._period_start(df["created_at"], "D")
+        return keys
+
+    def _build_cube(self, df, grouper="organization_branch_name"):
+        """
+        Один проход по строкам: для каждой ячейки (grouper, call_type, criteria_name, day)
+        считает count, sum, сумму квадратов оценок и число уникальных call_id.
+        Пустые значения измерений сохраняются, чтобы минимумы/итоги совпадали с расчётом по строкам.
+        """
+        if df.empty or grouper not in df.columns or "score" not in df.columns:
+            return pd.DataFrame()
+        keys = self._cube_keys(df, grouper)
+        score = df["score"].astype("float64")
+        frame = pd.DataFrame(keys)
+        frame["score"] = score
+        frame["score_sq"] = score * score
+        aggs = {
+            "n": ("score", "size"),
+            "score_sum": ("score", "sum"),
+            "score_sq_sum": ("score_sq", "sum"),
+        }
+        if "call_id" in df.columns:
+            frame["call_id"] = df["call_id"]
+            aggs["n_calls"] = ("call_id", "nunique")
+        return self._plain_keys(frame.groupby(list(keys), dropna=False, observed=True).agg(**aggs).reset_index())
+
+    def _build_call_cube(self, df, grouper="organization_branch_name"):
+        """
+        Число уникальных call_id в разрезе (grouper, call_type, day).
+        Звонок относится к одному типу и одной дате, поэтому такие счётчики аддитивны
+        (в отличие от n_calls по критериям в основном кубе).
+        """
+        if df.empty or grouper not in df.columns or "call_id" not in df.columns:
+            return pd.DataFrame()
+        return self._count_calls(self._call_keys(df, grouper))
+
+    def _call_keys(self, df, grouper="organization_branch_name"):
+        """Пары (grouper, call_type, day) — call_id для подсчёта уникальных звонков."""
+        keys = self._cube_keys(df, grouper)
+        keys.pop("criteria_name", None)
+        frame = pd.DataFrame(keys)
+        frame["call_id"] = df["call_id"]
+        return frame
+
+    @classmethod
+    def _count_calls(cls, frame):
+        keys = [c for c in frame.columns if c != "call_id"]
+        return cls._plain_keys(
+            frame.groupby(keys, dropna=False, observed=True)["call_id"]
+            .nunique()
+            .rename("n_calls")
+            .reset_index()
+        )
+
+    @staticmethod
+    def _plain_keys(cube):
+        """
+        Категориальные измерения куба (компактный режим) переводятся в тип их значений:
+        куб маленький, а итоговые таблицы остаются такими же, как без compact.
+        """
+        for col in cube.columns:
+            if isinstance(cube[col].dtype, pd.CategoricalDtype):
+                cube[col] = cube[col].astype(cube[col].cat.categories.dtype)
+        return cube
+
+    def _build_hist(self, df, grouper="organization_branch_name"):
+        """
+        Гистограммы оценок: число оценок каждого значения score в разрезе
+        (grouper, organization_name, call_type, criteria_name), см. _cube_keys.
+        Один проход по строкам: коды измерений сводятся в номер ячейки и считаются через bincount.
+        Филиалы, типы и критерии идут в порядке первого появления в df, значения score — по возрастанию.
+        """
+        if df.empty or grouper not in df.columns or "score" not in df.columns:
+            return pd.DataFrame()
+        keys = dict.fromkeys([grouper, *self._level_dims(df.columns, grouper), "call_type", "criteria_name"], False)
+        keys["score"] = True
+        keys = {col: pd.factorize(df[col], sort=sort, use_na_sentinel=False) for col, sort in keys.items() if col in df.columns}
+        shape = tuple(len(uniques) for _, uniques in keys.values())
+        cell = np.ravel_multi_index(tuple(codes for codes, _ in keys.values()), shape)
+        counts = np.bincount(cell, minlength=int(np.prod(shape)))
+        filled = np.flatnonzero(counts)
+        hist = pd.DataFrame({
+            col: uniques.take(codes) for (col, (_, uniques)), codes in zip(keys.items(), np.unravel_index(filled, shape))
+        })
+        hist["count"] = counts[filled]
+        return self._plain_keys(hist)
+
+    @staticmethod
+    def _level_dims(columns, grouper):
+        """Измерения верхних уровней иерархии, которые хранятся в кубе уровня grouper."""
+        if grouper == "organization_branch_name" and "organization_name" in columns:
+            return ["organization_name"]
+        return []
+
+    def _is_rollup(self, grouper):
+        """grouper — верхний уровень иерархии, который сворачивается из куба филиалов."""
+        return grouper == "total" or (
+            grouper == "organization_name" and "organization_branch_name" in self.df.columns
+        )
+
+    def _roll_up_level(self, cube, grouper):
+        """
+        Куб (гистограммы, счётчики звонков) уровня grouper из куба филиалов: статистики
+        суммируются по филиалам. Звонок относится к одному филиалу, поэтому n_calls тоже аддитивен.
+        """
+        if cube.empty or (grouper != "total" and grouper not in cube.columns):
+            return pd.DataFrame()
+        stats = [c for c in cube.columns if c in self.CUBE_STATS + self.HIST_STATS]
+        keys = [c for c in cube.columns if c not in stats and c not in ("organization_branch_name", "organization_name")]
+        if grouper == "total":
+            cube = cube.assign(total=self.TOTAL_LABEL)
+        return cube.groupby([grouper] + keys, dropna=False, observed=True)[stats].sum().reset_index()
+
+    def _get_hist(self, grouper="organization_branch_name"):
+        with self._lock:
+            if grouper not in self._hists:
+                if self._is_rollup(grouper):
+                    self._hists[grouper] = self._roll_up_level(self._get_hist(), grouper)
+                else:
+                    self._hists[grouper] = (
+                        self._build_hist(self.df, grouper) if self.backend is None else self.backend.hist(grouper)
+                    )
+            return self._hists[grouper]
+
+    def _get_cube(self, grouper="organization_branch_name"):
+        with self._lock:
+            if grouper not in self._cubes:
+                if self._is_rollup(grouper):
+                    self._cubes[grouper] = self._roll_up_level(self._get_cube(), grouper)
+                else:
+                    self._cubes[grouper] = (
+                        self._build_cube(self.df, grouper) if self.backend is None else self.backend.cube(grouper)
+                    )
+            return self._cubes[grouper]
+
+    def _roll_up(self, cube, freq):
+        """
+        Свёртка куба из дней в периоды freq (столбец period вместо day).
+        Звонок относится к одному дню, поэтому n_calls тоже суммируется точно.
+        """
+        if cube.empty or "day" not in cube.columns:
+            return cube.iloc[0:0]
+        if freq == "D":
+            return cube.rename(columns={"day": "period"})
+        keys = [c for c in cube.columns if c not in self.CUBE_STATS and c != "day"] + ["period"]
+        stats = [c for c in self.CUBE_STATS if c in cube.columns]
+        rolled = cube.assign(period=self._period_start(cube["day"], freq))
+        return rolled.groupby(keys, dropna=False, observed=True)[stats].sum().reset_index()
+
+    def _get_period_cube(self, grouper="organization_branch_name", freq="W"):
+        """Куб по периодам freq: считается один раз из дневного куба (не из строк)."""
+        with self._lock:
+            if (grouper, freq) not in self._period_cubes:
+                self._period_cubes[(grouper, freq)] = self._roll_up(self._get_cube(grouper), freq)
+            return self._period_cubes[(grouper, freq)]
+
+    def _get_call_cube(self, grouper="organization_branch_name"):
+        with self._lock:
+            if grouper not in self._call_cubes:
+                if self._is_rollup(grouper):
+                    self._call_cubes[grouper] = self._roll_up_level(self._get_call_cube(), grouper)
+                else:
+                    self._call_cubes[grouper] = (
+                        self._build_call_cube(self.df, grouper) if self.backend is None else self.backend.call_cube(grouper)
+                    )
+            return self._call_cubes[grouper]
+
+    @staticmethod
+    def _slice_type(cube, call_type=None):
+        """Срез куба по call_type (None — все типы)."""
+        if call_type is None or cube.empty:
+            return cube
+        if "call_type" not in cube.columns:
+            return cube.iloc[0:0]
+        return cube[cube["call_type"] == call_type]
+
+    def _cube_for(self, df_in, grouper="organization_branch_name", freq=None):
+        """
+        Куб для df_in: для self.df / self.df_call / self.df_badge берётся срез готового куба,
+        для произвольного датафрейма куб строится заново.
+        freq — куб по календарным периодам (D/W/M) вместо дневного.
+        """
+        cube = self._get_cube(grouper) if freq is None else self._get_period_cube(grouper, freq)
+        if df_in is None or df_in is self.df:
+            return cube
+        if df_in is self.df_call:
+            return self._slice_type(cube, "REGULAR")
+        if df_in is self.df_badge:
+            return self._slice_type(cube, "AUDIO_BADGE")
+        if self._is_rollup(grouper):
+            cube = self._roll_up_level(self._build_cube(df_in), grouper)
+        else:
+            cube = self._build_cube(df_in, grouper)
+        return cube if freq is None else self._roll_up(cube, freq)
+
+    def _hist_for(self, df_in, grouper="organization_branch_name"):
+        """Гистограммы для df_in (по аналогии с _cube_for)."""
+        if df_in is None or df_in is self.df:
+            return self._get_hist(grouper)
+        if df_in is self.df_call:
+            return self._slice_type(self._get_hist(grouper), "REGULAR")
+        if df_in is self.df_badge:
+            return self._slice_type(self._get_hist(grouper), "AUDIO_BADGE")
+        if self._is_rollup(grouper):
+            return self._roll_up_level(self._build_hist(df_in), grouper)
+        return self._build_hist(df_in, grouper)
+
+    @staticmethod
+    def _cube_mean(cube, by):
+        """Средняя оценка по измерениям by из sum/count."""
+        stats = cube.groupby(by, observed=True)[["n", "score_sum"]].sum()
+        return (stats["score_sum"] / stats["n"]).rename("score")
+
+    def _avg_score_from_cube(self, cube, grouper="organization_branch_name"):
+        if cube.empty:
+            return pd.DataFrame()
+        avg = self._cube_mean(cube, grouper).round(1).reset_index().rename(columns={"score": "avg_score"})
+        return avg.sort_values(by="avg_score", ascending=False).reset_index(drop=True)
+
     # вспомогательное: call/badge counts (по уникальным call_id)
     def _compute_call_badge_count(self, grouper="organization_branch_name"):
-        if self.df.empty or grouper not in self.df.columns:
+        call_cube = self._get_call_cube(grouper)
+        if call_cube.empty:
             return pd.DataFrame()
-        df_call = self.df[self.df["call_type"] == "REGULAR"]
-        df_badge = self.df[self.df["call_type"] == "AUDIO_BADGE"]
-
-        df_all = self.df.pivot_table(index=grouper, values="call_id", aggfunc="nunique").reset_index()
-        df_all.columns = [grouper, "count_all_type_call"]
 
-        df_call_count = df_call.pivot_table(index=grouper, values="call_id", aggfunc="nunique").reset_index()
-        df_call_count.columns = [grouper, "count_call"]
+        def _nunique(call_type, name):
+            sub = self._slice_type(call_cube, call_type)
+            return sub.groupby(grouper, observed=True)["n_calls"].sum().reset_index(name=name)
 
-        df_badge_count = df_badge.pivot_table(index=grouper, values="call_id", aggfunc="nunique").reset_index()
-        df_badge_count.columns = [grouper, "count_audio_badge"]
+        df_all = _nunique(None, "count_all_type_call")
+        df_call_count = _nunique("REGULAR", "count_call")
+        df_badge_count = _nunique("AUDIO_BADGE", "count_audio_badge")
 
         merged = df_all.merge(df_call_count, on=grouper, how="outer").merge(df_badge_count, on=grouper, how="outer")
         merged = merged.fillna(0)
@@ -93,19 +689,18 @@ class CallQualityAnalyzer:
     # возвращаем counts таблицу: count_all_score, count_call_score, count_audio_badge_score
 
     def get_all_score_by_branch(self, grouper="organization_branch_name"):
-        if self.df.empty or grouper not in self.df.columns:
+        # количества оценок на всей выборке и для подвыборок — из куба
+        cube = self._get_cube(grouper)
+        if cube.empty:
             return pd.DataFrame()
-        # value_counts на всей выборке и для подвыборок
-        df_all = self.df[grouper].value_counts().reset_index()
-        df_all.columns = [grouper, "count_all_score"]
 
-        df_call = self.df_call[grouper].value_counts().reset_index() if not self.df_call.empty else pd.DataFrame(columns=[grouper, "count_call_score"])
-        if not df_call.empty:
-            df_call.columns = [grouper, "count_call_score"]
+        def _counts(call_type, name):
+            sub = self._slice_type(cube, call_type)
+            return sub.groupby(grouper, observed=True)["n"].sum().reset_index(name=name)
 
-        df_badge = self.df_badge[grouper].value_counts().reset_index() if not self.df_badge.empty else pd.DataFrame(columns=[grouper, "count_audio_badge_score"])
-        if not df_badge.empty:
-            df_badge.columns = [grouper, "count_audio_badge_score"]
+        df_all = _counts(None, "count_all_score")
+        df_call = _counts("REGULAR", "count_call_score")
+        df_badge = _counts("AUDIO_BADGE", "count_audio_badge_score")
 
         merged = df_all.merge(df_call, on=grouper, how="outer").merge(df_badge, on=grouper, how="outer").fillna(0)
         merged[["count_call_score", "count_audio_badge_score"]] = merged[["count_call_score", "count_audio_badge_score"]].astype("int64")
@@ -116,71 +711,178 @@ class CallQualityAnalyzer:
     def get_call_count(self, grouper="organization_branch_name"):
         return self._compute_call_badge_count(grouper=grouper)
 
+    def get_hierarchy(self):
+        """
+        Иерархия организация -> филиал (organization_name, organization_branch_name) из куба филиалов:
+        для перехода между уровнями (фильтр готовых таблиц по филиалам организации) без пересчёта.
+        """
+        cube = self._get_cube()
+        if cube.empty or "organization_name" not in cube.columns:
+            return pd.DataFrame()
+        pairs = cube[["organization_name", "organization_branch_name"]].drop_duplicates()
+        return pairs.sort_values(["organization_name", "organization_branch_name"]).reset_index(drop=True)
+
+    def get_score_histogram(self, df_in=None, grouper="organization_branch_name"):
+        """
+        Гистограмма оценок по филиалам: (grouper, score, count).
+        Из неё строятся графики распределений (среднее, медиана и KDE считаются по частотам).
+        """
+        hist = self._hist_for(df_in, grouper)
+        if hist.empty:
+            return pd.DataFrame()
+        hist = hist.groupby([grouper, "score"], observed=True, sort=False)["count"].sum().reset_index()
+        # филиалы — в порядке первого появления, оценки внутри филиала — по возрастанию
+        order = pd.factorize(hist[grouper], use_na_sentinel=False)[0]
+        return hist.iloc[np.lexsort((hist["score"].to_numpy(), order))].reset_index(drop=True)
+
+    def get_facet_groups(self, df_in=None, sort="score_desc", search=None, top_k=None,
+                         grouper="organization_branch_name"):
+        """
+        Филиалы для постраничных сеток графиков (распределения, динамика по филиалам):
+        (grouper, avg_score, n_scores) в порядке sort (см. FACET_SORTS), только с подстрокой
+        search в названии (без учёта регистра), не больше top_k первых после сортировки.
+        Считается по кубу, без обращения к строкам.
+        """
+        cube = self._cube_for(df_in, grouper)
+        if cube.empty:
+            return pd.DataFrame()
+        stats = cube.groupby(grouper, observed=True)[["n", "score_sum"]].sum()
+        stats = stats[stats["n"] > 0]
+        groups = pd.DataFrame({
+            grouper: stats.index.to_numpy(dtype=object),
+            "avg_score": (stats["score_sum"] / stats["n"]).round(2).to_numpy(),
+            "n_scores": stats["n"].to_numpy(),
+        })
+        if search:
+            groups = groups[groups[grouper].astype(str).str.contains(search, case=False, regex=False)]
+        # при равенстве — по названию, чтобы страницы не менялись от запуска к запуску
+        by, ascending = {
+            "score_desc": (["avg_score", grouper], [False, True]),
+            "score_asc": (["avg_score", grouper], [True, True]),
+            "count_desc": (["n_scores", grouper], [False, True]),
+            "name": ([grouper], [True]),
+        }[sort]
+        groups = groups.sort_values(by, ascending=ascending, kind="mergesort")
+        if top_k:
+            groups = groups.head(top_k)
+        return groups.reset_index(drop=True)
+
+    @staticmethod
+    def facet_page(groups, page=0, page_size=12, grouper="organization_branch_name"):
+        """Названия филиалов страницы page (с нуля) из таблицы get_facet_groups."""
+        if groups.empty:
+            return ()
+        return tuple(groups[grouper].iloc[page * page_size:(page + 1) * page_size])
+
     # plot distributions (возвращают фигуру)
-    # три варианта: по всей выборке, только звонки, только бейджи
+    # три варианта: по всей выборке, только звонки, только бейджи;
+    # groups — только эти филиалы (страница сетки, см. get_facet_groups / facet_page)
     
-    def plot_distributions_all(self):
-        return plot_score_distributions(self.df, title="Распределение оценок: все типы")
+    def plot_distributions_all(self, groups=None, grouper="organization_branch_name"):
+        return self._draw("plot_distributions_all", groups, grouper)
 
-    def plot_distributions_call(self):
-        return plot_score_distributions(self.df_call, title="Распределение оценок: звонки (REGULAR)")
+    def plot_distributions_call(self, groups=None, grouper="organization_branch_name"):
+        return self._draw("plot_distributions_call", groups, grouper)
 
-    def plot_distributions_badge(self):
-        return plot_score_distributions(self.df_badge, title="Распределение оценок: аудиобейджи (AUDIO_BADGE)")
+    def plot_distributions_badge(self, groups=None, grouper="organization_branch_name"):
+        return self._draw("plot_distributions_badge", groups, grouper)
 
     # 2. Средние оценки по филиалам (all / call / badge)
     
-    def get_avg_score_by_branch(self):
-        if self.df.empty:
-            return pd.DataFrame()
-        avg = self.df.pivot_table(index="organization_branch_name", values="score", aggfunc="mean").round(1).reset_index().rename(columns={"score": "avg_score"})
-        return avg.sort_values(by="avg_score", ascending=False).reset_index(drop=True)
+    # grouper — уровень иерархии (см. LEVELS): филиалы, организации или итог по всем филиалам
 
-    def get_avg_score_by_branch_call(self):
-        if self.df_call.empty:
-            return pd.DataFrame()
-        avg = self.df_call.pivot_table(index="organization_branch_name", values="score", aggfunc="mean").round(1).reset_index().rename(columns={"score": "avg_score"})
-        return avg.sort_values(by="avg_score", ascending=False).reset_index(drop=True)
+    def get_avg_score_by_branch(self, grouper="organization_branch_name"):
+        return self._avg_score_from_cube(self._get_cube(grouper), grouper)
 
-    def get_avg_score_by_branch_badge(self):
-        if self.df_badge.empty:
-            return pd.DataFrame()
-        avg = self.df_badge.pivot_table(index="organization_branch_name", values="score", aggfunc="mean").round(1).reset_index().rename(columns={"score": "avg_score"})
-        return avg.sort_values(by="avg_score", ascending=False).reset_index(drop=True)
+    def get_avg_score_by_branch_call(self, grouper="organization_branch_name"):
+        return self._avg_score_from_cube(self._slice_type(self._get_cube(grouper), "REGULAR"), grouper)
+
+    def get_avg_score_by_branch_badge(self, grouper="organization_branch_name"):
+        return self._avg_score_from_cube(self._slice_type(self._get_cube(grouper), "AUDIO_BADGE"), grouper)
 
-    def plot_avg_score(self):
-        return plot_avg_bar(self.get_avg_score_by_branch(), title="Средняя оценка филиалов (все типы)")
+    def plot_avg_score(self, groups=None, grouper="organization_branch_name"):
+        return self._draw("plot_avg_score", groups, grouper)
 
-    def plot_avg_score_call(self):
-        return plot_avg_bar(self.get_avg_score_by_branch_call(), title="Средняя оценка филиалов — звонки")
+    def plot_avg_score_call(self, groups=None, grouper="organization_branch_name"):
+        return self._draw("plot_avg_score_call", groups, grouper)
 
-    def plot_avg_score_badge(self):
-        return plot_avg_bar(self.get_avg_score_by_branch_badge(), title="Средняя оценка филиалов — аудиобейджи")
+    def plot_avg_score_badge(self, groups=None, grouper="organization_branch_name"):
+        return self._draw("plot_avg_score_badge", groups, grouper)
+
+    def get_avg_score_ci(self, df_in=None, by_criteria=False, n_boot=1000, level=0.95, min_scores=10, seed=0,
+                         grouper="organization_branch_name"):
+        """
+        Средняя оценка с бутстреп-интервалом (уровень level) для каждого филиала
+        (by_criteria=True — для каждой пары филиал × критерий) и рейтинг с учётом неопределённости.
+        Тип коммуникации задаётся как обычно: df_in = self.df_call / self.df_badge.
+
+        Интервалы считаются по гистограммам оценок ячеек (stat_tests.bootstrap_mean_ci),
+        результат воспроизводим при том же seed. Рейтинг (внутри критерия при by_criteria):
+        rank — по нижней границе интервала, так что маленький филиал с высоким средним
+        за счёт шума не попадает наверх; rank_best / rank_worst — диапазон мест, совместимый
+        с интервалами (у неразличимых филиалов диапазоны перекрываются).
+        У ячеек меньше чем с min_scores оценками интервал не считается (на нескольких оценках
+        бутстреп даёт интервал нулевой ширины): они идут в конце рейтинга без диапазона мест.
+        """
+        hist = self._hist_for(df_in, grouper)
+        cells = [grouper] + (["criteria_name"] if by_criteria else [])
+        if hist.empty or not set(cells).issubset(hist.columns):
+            return pd.DataFrame()
+        table = hist.groupby(cells + ["score"], observed=True)["count"].sum().unstack("score", fill_value=0)
+        values = table.columns.to_numpy(dtype="float64")
+        counts = table.to_numpy()
+        n = counts.sum(axis=1)
+        result = table.index.to_frame(index=False)
+        result["avg_score"] = counts @ values / n
+        result["ci_low"] = np.nan
+        result["ci_high"] = np.nan
+        result["n_scores"] = n
+        enough = n >= min_scores
+        _, low, high = bootstrap_mean_ci(counts[enough], values, n_boot=n_boot, level=level, seed=seed)
+        result.loc[enough, "ci_low"] = low
+        result.loc[enough, "ci_high"] = high
+
+        parts = []
+        for _, part in (result.groupby("criteria_name", dropna=False, sort=False) if by_criteria else [(None, result)]):
+            part = part.sort_values(["ci_low", "avg_score"], ascending=False, na_position="last", kind="mergesort")
+            ranked = part["ci_low"].notna().to_numpy()
+            best, worst = ci_ranks(part["ci_low"][ranked], part["ci_high"][ranked])
+            part = part.assign(rank=np.arange(1, len(part) + 1), rank_best=pd.NA, rank_worst=pd.NA)
+            part.loc[ranked, "rank_best"] = best
+            part.loc[ranked, "rank_worst"] = worst
+            parts.append(part)
+        result = pd.concat(parts)
+        if by_criteria:
+            result = result.sort_values(["criteria_name", "rank"], kind="mergesort")
+        result[["rank_best", "rank_worst"]] = result[["rank_best", "rank_worst"]].astype("Int64")
+        result[["avg_score", "ci_low", "ci_high"]] = result[["avg_score", "ci_low", "ci_high"]].round(2)
+        return result[cells + ["avg_score", "ci_low", "ci_high", "n_scores", "rank", "rank_best", "rank_worst"]].reset_index(drop=True)
 
     def get_full_avg_score_by_branch(self, grouper="organization_branch_name"):
         """
         Объединённая сводная по звонкам и бейджам (по аналогии с ноутбуком).
         Возвращаем таблицу со столбцами avg_score_call, avg_score_badge.
         """
-        avg_call = self.get_avg_score_by_branch_call().rename(columns={"avg_score": "avg_score_call"})
-        avg_badge = self.get_avg_score_by_branch_badge().rename(columns={"avg_score": "avg_score_badge"})
+        avg_call = self.get_avg_score_by_branch_call(grouper).rename(columns={"avg_score": "avg_score_call"})
+        avg_badge = self.get_avg_score_by_branch_badge(grouper).rename(columns={"avg_score": "avg_score_badge"})
         # outer merge по поля (если пустые — вернём то, что есть)
         merged = pd.merge(avg_call, avg_badge, on=grouper, how="outer")
         # если нужно — можно добавить avg_all из get_avg_score_by_branch
-        avg_all = self.get_avg_score_by_branch().rename(columns={"avg_score": "avg_score_all"})
+        avg_all = self.get_avg_score_by_branch(grouper).rename(columns={"avg_score": "avg_score_all"})
         merged = avg_all.merge(merged, on=grouper, how="outer")
         # сортировка по полю avg_score_all (если есть)
         if "avg_score_all" in merged.columns:
             merged = merged.sort_values(by="avg_score_all", ascending=False).reset_index(drop=True)
         return merged
 
-    # 3. Недельная динамика
+    # 3. Динамика по календарным периодам (день / ISO-неделя / месяц)
     
     def add_week_from_start(self, df_in, date_col="created_at"):
-        df = df_in.copy()
+        df = df_in.copy(deep=False)
         if date_col not in df.columns:
             return df
-        df[date_col] = pd.to_datetime(df[date_col], errors="coerce").dt.floor("D")
+        # после prepare_data столбец уже datetime и повторно не разбирается
+        df[date_col] = parse_datetime(df[date_col]).dt.floor("D")
         start_date = df[date_col].min()
         if pd.isna(start_date):
             return df
@@ -188,89 +890,214 @@ class CallQualityAnalyzer:
         df["week_from_start"] = ((df[date_col] - start_week_date).dt.days // 7) + 1
         return df
 
-    def get_avg_score_by_week(self, df_in=None):
+    def get_avg_score_by_period(self, df_in=None, freq="W", grouper="organization_branch_name"):
         """
-        Возвращает сводную таблицу: строки — филиалы, колонки — week_1, week_2, ...
+        Возвращает сводную таблицу: строки — филиалы, колонки — календарные периоды
+        в хронологическом порядке (2025-W38, 2025-W39, ... для недель; 2025-09 для месяцев;
+        2025-09-15 для дней). Периоды абсолютные: у df_call и df_badge одни и те же даты
+        попадают в одинаковые столбцы.
         По умолчанию берёт полный df, можно передать df_call или df_badge.
+        grouper — уровень строк: филиалы, организации или итог (см. LEVELS).
         """
-        if df_in is None:
-            df_in = self.df
-        if df_in.empty or "created_at" not in df_in.columns:
+        cube = self._cube_for(df_in, grouper, freq)
+        if cube.empty or "period" not in cube.columns or cube["period"].isna().all():
             return pd.DataFrame()
-        df2 = self.add_week_from_start(df_in, date_col="created_at")
-        pivot = df2.pivot_table(index="organization_branch_name", columns="week_from_start", values="score",     aggfunc="mean").round(1).dropna(how="all").sort_values(by=1, ascending=False)
+        pivot = self._cube_mean(cube, [grouper, "period"]).unstack()
+        pivot = pivot.round(1).dropna(how="all")
         if pivot.empty:
             return pd.DataFrame()
-        # reset & rename columns to week_1, week_2...
-        pivot = pivot.reset_index()
-        new_cols = ["organization_branch_name"] + [f"week_{int(c)}" for c in pivot.columns[1:]]
-        pivot.columns = new_cols
-        return pivot
+        pivot = pivot.sort_values(by=pivot.columns[0], ascending=False)
+        pivot.columns = self.period_labels(pivot.columns, freq)
+        return pivot.reset_index()
+
+    def get_avg_score_by_week(self, df_in=None, grouper="organization_branch_name"):
+        """Недельная динамика: столбцы — ISO-недели (см. get_avg_score_by_period)."""
+        return self.get_avg_score_by_period(df_in, "W", grouper)
+
+    def get_avg_score_by_month(self, df_in=None, grouper="organization_branch_name"):
+        """Месячная динамика: столбцы — месяцы (см. get_avg_score_by_period)."""
+        return self.get_avg_score_by_period(df_in, "M", grouper)
+
+    # Мониторинг сдвигов средней оценки
+    def get_drift_monitor(self, freq="W", by_criteria=False, call_type=None, grouper="organization_branch_name",
+                          **params):
+        """
+        Детекторы EWMA/CUSUM (monitoring.DriftMonitor) для рядов grouper [× criteria_name] по периодам freq.
+        Монитор хранится в анализаторе (и в save_state): при повторном вызове, в том числе после append,
+        в него подаются только периоды начиная с последнего обработанного, история не пересчитывается.
+        Более ранние периоды из новых выгрузок (запоздавшие оценки) монитором не учитываются.
+        params — параметры детекторов (lam, L, k, h, warmup, min_scores).
+        """
+        key = (grouper, freq, by_criteria, call_type, tuple(sorted(params.items())))
+        series = [grouper] + (["criteria_name"] if by_criteria else [])
+        with self._lock:
+            monitor = self._monitors.get(key) or DriftMonitor(**params)
+            cube = self._slice_type(self._get_period_cube(grouper, freq), call_type)
+            if not cube.empty and {"period", *series}.issubset(cube.columns):
+                cube = cube.dropna(subset=["period", *series])
+                if monitor.last_period is not None:
+                    cube = cube[cube["period"] >= monitor.last_period]
+                cube = cube.astype({c: object for c in series})
+                stats = cube.groupby(["period", *series])[["n", "score_sum", "score_sq_sum"]].sum()
+                for period, part in stats.groupby(level="period", sort=True):
+                    monitor.update(period, part.droplevel("period"))
+            self._monitors[key] = monitor
+            return monitor
+
+    def get_drift_alerts(self, freq="W", by_criteria=False, call_type=None, grouper="organization_branch_name",
+                         only_flagged=True, **params):
+        """
+        Ранжированный список рядов (филиалы или филиал × критерий) с сигналом детектора сдвига:
+        status — «Снижение» / «Рост», severity — отношение статистики EWMA/CUSUM к порогу (≥ 1 — сигнал).
+        period, avg_score, baseline — последний период ряда, его средняя и средняя истории до него.
+        call_type — REGULAR / AUDIO_BADGE (None — все типы), params — см. get_drift_monitor.
+        """
+        alerts = self.get_drift_monitor(freq, by_criteria, call_type, grouper, **params).alerts(only_flagged)
+        if alerts.empty:
+            return pd.DataFrame()
+        alerts = alerts[alerts["period"].notna()].reset_index(drop=True)
+        if alerts.empty:
+            return pd.DataFrame()
+        alerts["period"] = self.period_labels(alerts["period"], freq)
+        alerts.insert(0, "rank", np.arange(1, len(alerts) + 1))
+        return alerts
 
-    def plot_weekly_all(self):
-        return plot_weekly_trends(self.get_avg_score_by_week(self.df), title="Недельная динамика — все типы")
+    def plot_weekly_all(self, freq="W", groups=None, grouper="organization_branch_name"):
+        return self._draw("plot_weekly_all", freq, groups, grouper)
 
-    def plot_weekly_call(self):
-        return plot_weekly_trends(self.get_avg_score_by_week(self.df_call), title="Недельная динамика — звонки (REGULAR)")
+    def plot_weekly_call(self, freq="W", groups=None, grouper="organization_branch_name"):
+        return self._draw("plot_weekly_call", freq, groups, grouper)
 
-    def plot_weekly_badge(self):
-        return plot_weekly_trends(self.get_avg_score_by_week(self.df_badge), title="Недельная динамика — аудиобейджи (AUDIO_BADGE)")
+    def plot_weekly_badge(self, freq="W", groups=None, grouper="organization_branch_name"):
+        return self._draw("plot_weekly_badge", freq, groups, grouper)
 
-    def plot_weekly_grid_all(self):
-        return plot_weekly_grid(self.get_avg_score_by_week(self.df), group_col="organization_branch_name", title="Графики недельной динамики — все типы")
+    def plot_weekly_grid_all(self, freq="W", groups=None, grouper="organization_branch_name"):
+        return self._draw("plot_weekly_grid_all", freq, groups, grouper)
 
-    def plot_weekly_grid_call(self):
-        return plot_weekly_grid(self.get_avg_score_by_week(self.df_call), group_col="organization_branch_name", title="Графики недельной динамики — звонки")
+    def plot_weekly_grid_call(self, freq="W", groups=None, grouper="organization_branch_name"):
+        return self._draw("plot_weekly_grid_call", freq, groups, grouper)
 
-    def plot_weekly_grid_badge(self):
-        return plot_weekly_grid(self.get_avg_score_by_week(self.df_badge), group_col="organization_branch_name", title="Графики недельной динамики — аудиобейджи")
+    def plot_weekly_grid_badge(self, freq="W", groups=None, grouper="organization_branch_name"):
+        return self._draw("plot_weekly_grid_badge", freq, groups, grouper)
 
     # 4. По критериям: pivot и impact
     
-    def get_avg_score_criteria(self, df_in=None):
-        if df_in is None:
-            df_in = self.df
-        if df_in.empty or "criteria_name" not in df_in.columns:
+    def get_avg_score_criteria(self, df_in=None, grouper="organization_branch_name"):
+        cube = self._cube_for(df_in, grouper)
+        if cube.empty or "criteria_name" not in cube.columns:
             return pd.DataFrame()
-        pivot = df_in.pivot_table(index="organization_branch_name", columns="criteria_name", values="score", aggfunc="mean").round(1).reset_index()
+        pivot = self._cube_mean(cube, [grouper, "criteria_name"]).unstack().round(1).reset_index()
         pivot.columns.name = None
         return pivot
 
-    def get_criteria_impact(self, df_in=None, avg_score_criteria=None, avg_score_by_branch=None, count_col="count_all_type_call"):
+    def get_criteria_impact(self, df_in=None, avg_score_criteria=None, avg_score_by_branch=None, count_col="count_all_type_call",
+                            grouper="organization_branch_name"):
         """
         Возвращает скорректированный вклад критериев (criteria_corr_impact),
         как в исходном ноутбуке.
         Если некоторые аргументы не переданы, они будут рассчитаны из self.
+        grouper — уровень строк (см. LEVELS); переданные таблицы должны быть того же уровня.
         """
         if df_in is None:
             df_in = self.df
         if avg_score_criteria is None:
-            avg_score_criteria = self.get_avg_score_criteria(df_in)
+            avg_score_criteria = self.get_avg_score_criteria(df_in, grouper)
         if avg_score_criteria.empty:
             return pd.DataFrame()
         if avg_score_by_branch is None:
-            avg_score_by_branch = self.get_avg_score_by_branch()
+            avg_score_by_branch = self.get_avg_score_by_branch(grouper)
 
         # соединяем
-        merged = avg_score_criteria.merge(avg_score_by_branch, on="organization_branch_name").set_index("organization_branch_name")
+        merged = avg_score_criteria.merge(avg_score_by_branch, on=grouper).set_index(grouper)
         # impact = avg_by_crit / avg_overall
         criteria_impact = merged.div(merged["avg_score"], axis=0).drop(columns="avg_score").round(2)
 
         # counts by criteria
-        score_count = df_in.pivot_table(index="organization_branch_name", columns="criteria_name", values="score", aggfunc="count").reset_index()
+        score_count = (
+            self._cube_for(df_in, grouper)
+            .groupby([grouper, "criteria_name"], observed=True)["n"]
+            .sum()
+            .unstack()
+            .reset_index()
+        )
         # merge call_badge_count to get denominator
-        counts_merge = score_count.merge(self.call_badge_count[["organization_branch_name", count_col]], on="organization_branch_name", how="left").set_index("organization_branch_name")
+        call_counts = self.call_badge_count if grouper == "organization_branch_name" else self.get_call_count(grouper)
+        counts_merge = score_count.merge(call_counts[[grouper, count_col]], on=grouper, how="left").set_index(grouper)
         criteria_share = counts_merge.div(counts_merge[count_col], axis=0).fillna(0).drop(columns=count_col)
 
         criteria_corr_impact = (1 + criteria_share * (criteria_impact - 1)).fillna(0).round(2)
         return criteria_corr_impact
 
     def plot_criteria_heatmap(self, df_heat=None):
-        if df_heat is None:
-            df_heat = self.get_criteria_impact()
-        if df_heat is None or df_heat.empty:
-            return plt.figure()
-        return plot_heatmap(df_heat, title="Относительный вклад критериев в общую оценку филиала")
+        return self._draw("plot_criteria_heatmap", df_heat)
+
+    # параметры графиков отдельно от отрисовки: по ним фигуры можно строить в другом процессе
+    def figure_spec(self, method_name, *args):
+        """
+        Описание графика метода plot_*: (функция из visualizations, входная таблица, параметры).
+        """
+        # подписи уровня иерархии в заголовках графиков
+        of_level = {"organization_branch_name": "филиалов", "organization_name": "организаций", "total": "по всем филиалам"}
+
+        def page(data, groups, grouper="organization_branch_name"):
+            """
+            Строки только филиалов страницы groups: в процесс отрисовки уходит
+            и рисуется одна страница, стоимость зависит от размера страницы, а не числа филиалов.
+            """
+            if groups is None or data.empty:
+                return data, {}
+            groups = tuple(groups)
+            return data[data[grouper].isin(groups)], {"groups": groups}
+
+        def distributions(df_in, groups, grouper, title):
+            hist = self.get_score_histogram(df_in, grouper)
+            kwargs = {"group_col": grouper, "title": title}
+            if groups is not None and not hist.empty:
+                # одинаковая ось оценок на всех страницах
+                kwargs["xlim"] = (float(hist["score"].min()), float(hist["score"].max()))
+            hist, page_kwargs = page(hist, groups, grouper)
+            return ("plot_score_distributions", hist, {**kwargs, **page_kwargs})
+
+        def averages(method, groups, grouper, subject):
+            data, _ = page(getattr(self, method)(grouper), groups, grouper)
+            return ("plot_avg_bar", data, {"x": grouper, "xlabel": self.LEVELS.get(grouper, grouper),
+                                           "title": f"Средняя оценка {of_level.get(grouper, '')} {subject}"})
+
+        def trend(df_in, freq, subject, grid=False, groups=None, grouper="organization_branch_name"):
+            axis, name, name_gen = self.PERIODS[freq]
+            data, page_kwargs = page(self.get_avg_score_by_period(df_in, freq, grouper), groups, grouper)
+            if grid:
+                title = f"Графики {name_gen} динамики — {subject}"
+                return ("plot_weekly_grid", data,
+                        {"group_col": grouper, "title": title, "xlabel": axis, **page_kwargs})
+            return ("plot_weekly_trends", data,
+                    {"group_col": grouper, "title": f"{name} динамика — {subject}", "xlabel": axis})
+
+        B = "organization_branch_name"
+        specs = {
+            "plot_distributions_all": lambda groups=None, grouper=B: distributions(self.df, groups, grouper, "Распределение оценок: все типы"),
+            "plot_distributions_call": lambda groups=None, grouper=B: distributions(self.df_call, groups, grouper, "Распределение оценок: звонки (REGULAR)"),
+            "plot_distributions_badge": lambda groups=None, grouper=B: distributions(self.df_badge, groups, grouper, "Распределение оценок: аудиобейджи (AUDIO_BADGE)"),
+            "plot_avg_score": lambda groups=None, grouper=B: averages("get_avg_score_by_branch", groups, grouper, "(все типы)"),
+            "plot_avg_score_call": lambda groups=None, grouper=B: averages("get_avg_score_by_branch_call", groups, grouper, "— звонки"),
+            "plot_avg_score_badge": lambda groups=None, grouper=B: averages("get_avg_score_by_branch_badge", groups, grouper, "— аудиобейджи"),
+            "plot_weekly_all": lambda freq="W", groups=None, grouper=B: trend(self.df, freq, "все типы", False, groups, grouper),
+            "plot_weekly_call": lambda freq="W", groups=None, grouper=B: trend(self.df_call, freq, "звонки (REGULAR)", False, groups, grouper),
+            "plot_weekly_badge": lambda freq="W", groups=None, grouper=B: trend(self.df_badge, freq, "аудиобейджи (AUDIO_BADGE)", False, groups, grouper),
+            "plot_weekly_grid_all": lambda freq="W", groups=None, grouper=B: trend(self.df, freq, "все типы", True, groups, grouper),
+            "plot_weekly_grid_call": lambda freq="W", groups=None, grouper=B: trend(self.df_call, freq, "звонки", True, groups, grouper),
+            "plot_weekly_grid_badge": lambda freq="W", groups=None, grouper=B: trend(self.df_badge, freq, "аудиобейджи", True, groups, grouper),
+            "plot_criteria_heatmap": lambda df_heat=None: (
+                "plot_heatmap",
+                self.get_criteria_impact() if df_heat is None else df_heat,
+                {"title": "Относительный вклад критериев в общую оценку филиала"},
+            ),
+        }
+        return specs[method_name](*args)
+
+    def _draw(self, method_name, *args):
+        func_name, data, kwargs = self.figure_spec(method_name, *args)
+        return getattr(visualizations, func_name)(data, **kwargs)
     
     # вспомогательные функции для статистических тестов
     def _count_scores_per_branch(self, df_calls, criteria_list):
@@ -279,7 +1106,7 @@ class CallQualityAnalyzer:
         """
         counts = (
             df_calls[df_calls["criteria_name"].isin(criteria_list)]
-            .groupby(["organization_branch_name", "criteria_name"])["score"]
+            .groupby(["organization_branch_name", "criteria_name"], observed=True)["score"]
             .count()
             .unstack(fill_value=0)
             .to_dict(orient="index")
@@ -295,120 +1122,251 @@ class CallQualityAnalyzer:
                 return False
         return True
 
+    @staticmethod
+    def _score_matrix(call, crit, score, n_calls, n_criteria, duplicates="mean"):
+        """
+        Плотная матрица звонок × критерий (float32, NaN — нет оценки) по целочисленным кодам строк.
+        duplicates — политика для повторных оценок одного критерия в звонке (см. DUPLICATE_POLICIES).
+        Возвращает (матрица, число отброшенных/усреднённых повторов).
+        """
+        if duplicates not in CallQualityAnalyzer.DUPLICATE_POLICIES:
+            raise ValueError(f"Неизвестная политика повторов: {duplicates}")
+        cell = call * n_criteria + crit
+        values = np.full(n_calls * n_criteria, np.nan, dtype="float32")
+        if duplicates == "mean":
+            counts = np.bincount(cell, minlength=len(values))
+            sums = np.bincount(cell, weights=score, minlength=len(values))
+            filled = counts > 0
+            values[filled] = sums[filled] / counts[filled]
+            n_duplicates = int(len(cell) - filled.sum())
+        else:
+            # первое / последнее вхождение ячейки в порядке строк
+            order = slice(None) if duplicates == "first" else slice(None, None, -1)
+            cells, first = np.unique(cell[order], return_index=True)
+            n_duplicates = len(cell) - len(cells)
+            if duplicates == "error" and n_duplicates:
+                raise ValueError(f"Повторные оценки критерия в звонке: {n_duplicates}")
+            values[cells] = score[order][first]
+        return values.reshape(n_calls, n_criteria), n_duplicates
+
+    def _criteria_pair_data(self, duplicates="mean"):
+        """
+        Общая матрица звонок × критерий для парного анализа критериев (строится один раз на анализатор
+        и политику повторов): тесты 1–3, compare_criteria и корреляции критериев.
+        Звонки и критерии кодируются целыми числами (factorize), строки матрицы упорядочены
+        по (филиал, call_id), поэтому каждый филиал — непрерывный диапазон строк.
+        Словарь: values (float32), branch (код филиала строки), branch_labels, call_ids, criteria,
+        суммы/число оценок звонка, число оценок филиал × критерий (для порога min_pairs)
+        и число повторов, схлопнутых по политике duplicates.
+        """
+        with self._lock:
+            if duplicates in self._pair_data:
+                return self._pair_data[duplicates]
+            df = self.df
+            if df.empty or not {"criteria_name", "call_id", "organization_branch_name"}.issubset(df.columns):
+                return None
+            sub = df[df["organization_branch_name"].notna() & df["criteria_name"].notna() & df["call_id"].notna()]
+            branch_codes, branch_labels = pd.factorize(sub["organization_branch_name"], sort=True)
+            call_codes, call_ids = pd.factorize(sub["call_id"], sort=True)
+            crit_codes, criteria = pd.factorize(sub["criteria_name"], sort=True)
+            # строка матрицы — пара (филиал, звонок)
+            rows, row_codes = np.unique(branch_codes.astype("int64") * len(call_ids) + call_codes, return_inverse=True)
+            values, n_duplicates = self._score_matrix(
+                row_codes, crit_codes, sub["score"].to_numpy(dtype="float64"), len(rows), len(criteria), duplicates
+            )
+            branch_labels = np.asarray(branch_labels, dtype=object)
+            criteria = np.asarray(criteria, dtype=object)
+            counts = (
+                self._get_cube().groupby(["organization_branch_name", "criteria_name"], observed=True)["n"].sum()
+                .unstack(fill_value=0)
+                .reindex(index=branch_labels, columns=criteria, fill_value=0)
+            )
+            self._pair_data[duplicates] = {
+                "values": values,
+                "branch": rows // len(call_ids),
+                "branch_labels": branch_labels,
+                "call_ids": np.asarray(call_ids)[rows % len(call_ids)],
+                "criteria": criteria,
+                "row_sum": np.nansum(values, axis=1, dtype="float64"),
+                "row_count": (~np.isnan(values)).sum(axis=1).astype("float64"),
+                "counts": counts.to_numpy(),
+                "duplicates": n_duplicates,
+            }
+            return self._pair_data[duplicates]
+
+    def _compare_pair(self, c1, c2, variant, alternative, min_pairs):
+        """Батч-тест по одной паре критериев для всех филиалов (пустая таблица, если критерия нет)."""
+        data = self._criteria_pair_data()
+        if data is None or c1 not in data["criteria"] or c2 not in data["criteria"]:
+            return pd.DataFrame()
+        criteria = list(data["criteria"])
+        pair = (criteria.index(c1), criteria.index(c2))
+        return compare_criteria_pairs(data, [pair], variant=variant, alternative=alternative, min_pairs=min_pairs)
+
+    @staticmethod
+    def _wilcoxon_results(res, alpha, conclusion_significant):
+        """Таблица результатов теста по филиалам (филиалы по алфавиту)."""
+        if res.empty:
+            return pd.DataFrame()
+        res = res.set_index("group")
+        res = res.loc[sorted(res.index)]
+        return pd.DataFrame({
+            "Филиал": list(res.index),
+            "n_pairs": res["n_pairs"].to_numpy(dtype="int64"),
+            "p-value": np.round(res["p_value"].to_numpy(dtype="float64"), 5),
+            "Вывод": np.where(
+                res["p_value"].to_numpy(dtype="float64") < alpha,
+                conclusion_significant,
+                "Средние оценки по критериям не имеют различий",
+            ),
+        })
+
     # ТЕСТ 1: Проф. этика > Активное слушание
     def test_professional_vs_active_listening(self, min_pairs=10, alpha=0.05):
-        df_calls = self.df.copy()
         criteria_main = "Профессиональная этика"
         criteria_cmp = "Активное слушание"
 
-        results = []
-        counts = self._count_scores_per_branch(df_calls, [criteria_main, criteria_cmp])
-
-        for branch in sorted(df_calls["organization_branch_name"].dropna().unique()):
-            if not self._branch_has_enough_scores(counts, branch, [criteria_main, criteria_cmp], min_pairs):
-                continue
-
-            sub = df_calls[df_calls["organization_branch_name"] == branch]
-            calls = sub.pivot(index="call_id", columns="criteria_name", values="score")
-            if not {criteria_main, criteria_cmp}.issubset(calls.columns):
-                continue
-            
-            common_idx = calls.dropna(subset=[criteria_main, criteria_cmp]).index
-            if len(common_idx) < min_pairs:
-                continue
-
-            x = calls.loc[common_idx, criteria_main]
-            y = calls.loc[common_idx, criteria_cmp]
-            # Тест Вилкоксона
-            stat, p = wilcoxon(x, y, alternative="greater")
-            conclusion = (
-                    "Средняя оценка по критерию 'Профессиональная этика' статистически значимо выше"
-                    if p < alpha else
-                    "Средние оценки по критериям не имеют различий"
-                            )
-            results.append({
-                "Филиал": branch,
-                "n_pairs": len(common_idx),
-                "p-value": round(p, 5),
-                "Вывод": conclusion
-                            })
-        return pd.DataFrame(results)
-
+        # Тест Вилкоксона по парам оценок внутри звонка
+        res = self._compare_pair(criteria_main, criteria_cmp, "paired", "greater", min_pairs)
+        return self._wilcoxon_results(
+            res, alpha, "Средняя оценка по критерию 'Профессиональная этика' статистически значимо выше"
+        )
 
     # ТЕСТ 2: Вклад Проф. этика > Вклад Работа с возражениями
     def test_impact_ethics_vs_objections(self, min_pairs=10, alpha=0.05):
-        df_calls = self.df.copy()
         c1 = "Профессиональная этика"
         c2 = "Работа с возражениями"
 
-        results = []
-        counts = self._count_scores_per_branch(df_calls, [c1, c2])
-
-        for branch in sorted(df_calls["organization_branch_name"].dropna().unique()):
-            if not self._branch_has_enough_scores(counts, branch, [c1, c2], min_pairs):
-                continue
-
-            sub = df_calls[df_calls["organization_branch_name"] == branch]
-            calls_with_both = sub.groupby("call_id")["criteria_name"].apply(lambda x: {c1, c2} <= set(x))
-            calls_with_both = calls_with_both[calls_with_both].index
-            if len(calls_with_both) < min_pairs:
-                continue
-
-            sub_valid = sub[sub["call_id"].isin(calls_with_both)]
-            mean_branch = sub_valid["score"].mean()
-
-            diff1 = (sub_valid[sub_valid["criteria_name"] == c1]["score"] - mean_branch).abs()
-            diff2 = (sub_valid[sub_valid["criteria_name"] == c2]["score"] - mean_branch).abs()
-
-            stat, p = wilcoxon(diff1, diff2, alternative="greater")
-            conclusion = (
-                "Вклад критерия 'Профессиональная этика' статистически значимо выше"
-                if p < alpha else
-                "Средние оценки по критериям не имеют различий"
-                         )
-            results.append({
-                "Филиал": branch,
-                "n_pairs": len(calls_with_both),
-                "p-value": round(p, 5),
-                "Вывод": conclusion
-                           })
-        return pd.DataFrame(results)
+        # отклонения оценок критериев от средней оценки филиала по звонкам, где есть оба критерия
+        res = self._compare_pair(c1, c2, "contribution", "greater", min_pairs)
+        return self._wilcoxon_results(
+            res, alpha, "Вклад критерия 'Профессиональная этика' статистически значимо выше"
+        )
 
     # ТЕСТ 3: Презентация продукта ≠ Работа с возражениями
     def test_presentation_vs_objections(self, min_pairs=10, alpha=0.05):
-        df_calls = self.df.copy()
         c1 = "Качество презентации продукта"
         c2 = "Работа с возражениями"
 
-        results = []
-        counts = self._count_scores_per_branch(df_calls, [c1, c2])
-
-        for branch in sorted(df_calls["organization_branch_name"].dropna().unique()):
-            if not self._branch_has_enough_scores(counts, branch, [c1, c2], min_pairs):
-                continue
-
-            sub = df_calls[df_calls["organization_branch_name"] == branch]
-            calls = sub.pivot(index="call_id", columns="criteria_name", values="score")
-            
-            if not {c1, c2}.issubset(calls.columns):
-                continue
-            
-            common_idx = calls.dropna(subset=[c1, c2]).index
-            if len(common_idx) < min_pairs:
-                continue
-
-            x = calls.loc[common_idx, c1]
-            y = calls.loc[common_idx, c2]
-            stat, p = wilcoxon(x, y, alternative="two-sided")
-            conclusion = (
-                "Различия статистически значимы"
-                if p < alpha else
-                "Средние оценки по критериям не имеют различий"
-            )
-            results.append({
-                "Филиал": branch,
-                "n_pairs": len(common_idx),
-                "p-value": round(p, 5),
-                "Вывод": conclusion
-            })
-        return pd.DataFrame(results)
\ No newline at end of file
+        res = self._compare_pair(c1, c2, "paired", "two-sided", min_pairs)
+        return self._wilcoxon_results(res, alpha, "Различия статистически значимы")
+
+    # Сравнение произвольных пар критериев
+    def compare_criteria(self, c1=None, c2=None, criteria=None, variant="paired", alternative="two-sided",
+                         correction="holm", min_pairs=10, alpha=0.05, n_jobs=None, duplicates="mean"):
+        """
+        Тест Вилкоксона для пары критериев (c1, c2) или для всех пар из criteria
+        (по умолчанию — все критерии) в каждом филиале: филиал × критерий × критерий.
+        - variant: "paired" (оценки пары внутри звонка) или "contribution" (вклад, как в тесте 2);
+        - alternative: "two-sided" — неупорядоченные пары, "greater"/"less" — все упорядоченные пары
+          (гипотеза «критерий 1 выше/ниже критерия 2»);
+        - correction: "holm", "bh" или None — поправка по всем выполненным сравнениям;
+        - n_jobs > 1 — пары считаются в пуле процессов;
+        - duplicates — политика для повторных оценок критерия в звонке (см. DUPLICATE_POLICIES).
+        """
+        data = self._criteria_pair_data(duplicates)
+        if data is None:
+            return pd.DataFrame()
+        all_criteria = list(data["criteria"])
+        if c1 is not None and c2 is not None:
+            selected = [c1, c2]
+        else:
+            selected = list(criteria) if criteria is not None else all_criteria
+        idx = [all_criteria.index(c) for c in selected if c in all_criteria]
+        if c1 is not None and c2 is not None:
+            pairs = [tuple(idx)] if len(idx) == 2 else []
+        elif alternative == "two-sided":
+            pairs = [(i, j) for k, i in enumerate(idx) for j in idx[k + 1:]]
+        else:
+            pairs = [(i, j) for i in idx for j in idx if i != j]
+
+        res = compare_criteria_pairs(data, pairs, variant=variant, alternative=alternative,
+                                     min_pairs=min_pairs, n_jobs=n_jobs)
+        if res.empty:
+            return pd.DataFrame()
+        rank = {c: k for k, c in enumerate(all_criteria)}
+        res = res.assign(
+            _r1=res["criterion_1"].map(rank), _r2=res["criterion_2"].map(rank), _g=res["group"].astype(str)
+        ).sort_values(["_r1", "_r2", "_g"]).reset_index(drop=True)
+        p_adj = adjust_pvalues(res["p_value"].to_numpy(), correction)
+        significant = {
+            "two-sided": "Различия статистически значимы",
+            "greater": "Критерий 1 статистически значимо выше",
+            "less": "Критерий 1 статистически значимо ниже",
+        }[alternative]
+        return pd.DataFrame({
+            "Филиал": res["group"],
+            "Критерий 1": res["criterion_1"],
+            "Критерий 2": res["criterion_2"],
+            "n_pairs": res["n_pairs"].astype("int64"),
+            "statistic": res["statistic"],
+            "p-value": res["p_value"].round(5),
+            "p-value (скорр.)": np.round(p_adj, 5),
+            "Вывод": np.where(p_adj < alpha, significant, "Средние оценки по критериям не имеют различий"),
+        })
+
+    @staticmethod
+    def get_criteria_pvalue_matrix(comparison, branch, value="p-value (скорр.)"):
+        """Матрица критерий × критерий для одного филиала из результата compare_criteria."""
+        if comparison is None or comparison.empty:
+            return pd.DataFrame()
+        sub = comparison[comparison["Филиал"] == branch]
+        matrix = sub.pivot(index="Критерий 1", columns="Критерий 2", values=value)
+        matrix.index.name, matrix.columns.name = None, None
+        return matrix
+
+    # Корреляции критериев
+    def get_criteria_correlation(self, grouper="organization_branch_name", criteria=None, min_pairs=10,
+                                 duplicates="mean"):
+        """
+        Попарные корреляции Пирсона оценок критериев внутри звонка: группа × критерий × критерий
+        (по звонкам, где есть обе оценки; пары с числом звонков < min_pairs отбрасываются).
+        Достаточные статистики считаются по филиалам из общей матрицы звонок × критерий,
+        уровни organization_name и total — их суммы (без повторного прохода по строкам).
+        """
+        data = self._criteria_pair_data(duplicates)
+        if data is None:
+            return pd.DataFrame()
+        stats = correlation_stats(data["values"], data["branch"], len(data["branch_labels"]))
+        if grouper == "total":
+            groups, stats = np.array([self.TOTAL_LABEL], dtype=object), stats.sum(axis=0, keepdims=True)
+        elif grouper == "organization_name":
+            hierarchy = self.get_hierarchy()
+            if hierarchy.empty:
+                return pd.DataFrame()
+            org_of = dict(zip(hierarchy["organization_branch_name"], hierarchy["organization_name"]))
+            codes, groups = pd.factorize(pd.Series(data["branch_labels"]).map(org_of), sort=True)
+            pooled = np.zeros((len(groups),) + stats.shape[1:])
+            np.add.at(pooled, codes[codes >= 0], stats[codes >= 0])
+            groups, stats = np.asarray(groups, dtype=object), pooled
+        else:
+            groups = data["branch_labels"]
+        n, r = correlation_from_stats(stats)
+
+        all_criteria = list(data["criteria"])
+        idx = np.array([all_criteria.index(c) for c in (criteria or all_criteria) if c in all_criteria], dtype="int64")
+        i, j = np.triu_indices(len(idx), k=1)
+        i, j = idx[i], idx[j]
+        g = np.repeat(np.arange(len(groups)), len(i))
+        i, j = np.tile(i, len(groups)), np.tile(j, len(groups))
+        keep = n[g, i, j] >= min_pairs
+        g, i, j = g[keep], i[keep], j[keep]
+        return pd.DataFrame({
+            grouper: groups[g],
+            "Критерий 1": data["criteria"][i],
+            "Критерий 2": data["criteria"][j],
+            "n_pairs": n[g, i, j],
+            "r": np.round(r[g, i, j], 4),
+        })
+
+    @staticmethod
+    def get_criteria_correlation_matrix(correlation, group):
+        """Симметричная матрица критерий × критерий для одной группы из результата get_criteria_correlation."""
+        if correlation is None or correlation.empty:
+            return pd.DataFrame()
+        sub = correlation[correlation.iloc[:, 0] == group]
+        criteria = list(dict.fromkeys(list(sub["Критерий 1"]) + list(sub["Критерий 2"])))
+        matrix = sub.pivot(index="Критерий 1", columns="Критерий 2", values="r").reindex(index=criteria, columns=criteria)
+        values = matrix.combine_first(matrix.T).reindex(index=criteria, columns=criteria).to_numpy(copy=True)
+        np.fill_diagonal(values, 1.0)
+        return pd.DataFrame(values, index=criteria, columns=criteria)
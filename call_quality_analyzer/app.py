@@ -1,212 +1,591 @@
 import os, sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+import io
+
+import json
+from concurrent.futures import FIRST_COMPLETED, wait
+
 import streamlit as st
 import pandas as pd
+import instrumentation
 from analyzer import CallQualityAnalyzer
+from background import BackgroundTasks, chain
+from cache import ResultCache, fingerprint
+from file_cache import DEFAULT_CACHE_DIR, PreparedFileCache, load_exports, read_export
+from instrumentation import span
+from rendering import FigureRenderer
+
+# бюджет памяти кэша результатов (анализатор, таблицы, фигуры)
+CACHE_BUDGET_MB = 512
+# кэш подготовленных выгрузок на диске (Arrow/Feather, нужен pyarrow)
+FILE_CACHE_DIR = DEFAULT_CACHE_DIR
+FILE_CACHE_MB = 2048
+# отрисовка графиков в PNG: число процессов, кэш PNG, разрешение (как у st.pyplot)
+RENDER_WORKERS = min(4, os.cpu_count() or 1)
+RENDER_CACHE_MB = 256
+RENDER_DPI = 200
+# разбор нескольких загруженных файлов: число процессов
+PARSE_WORKERS = min(4, os.cpu_count() or 1)
+# фоновый расчёт таблиц: число потоков (блоки выводятся по мере готовности, а не по порядку)
+BACKGROUND_WORKERS = 2
+# период опроса фоновых задач, с: между опросами скрипт обновляет статус и может быть
+# прерван перезапуском (изменением виджета), не дожидаясь долгого расчёта
+WAIT_POLL_S = 0.25
+# замер времени/строк/памяти: файл JSON lines для сбора логов (None — только панель в боковой колонке)
+PROFILE_LOG = os.environ.get("CQA_PROFILE_LOG")
 
 st.set_page_config(page_title="Call Quality Analyzer", layout="wide")
 st.title("📞 Анализ качества звонков по филиалам")
 
-uploaded_file = st.file_uploader("Загрузите файл в формате CSV или Excel", type=["csv", "xlsx"])
 
-if not uploaded_file:
+@st.cache_resource
+def get_result_cache():
+    # один кэш на процесс: переживает перезапуски скрипта при изменении виджетов
+    return ResultCache(max_bytes=CACHE_BUDGET_MB * 1024 ** 2)
+
+
+@st.cache_resource
+def get_renderer():
+    return FigureRenderer(max_workers=RENDER_WORKERS, max_bytes=RENDER_CACHE_MB * 1024 ** 2, dpi=RENDER_DPI)
+
+
+@st.cache_resource
+def get_background_tasks():
+    # задачи переживают перезапуск скрипта: новый запуск получает уже идущий расчёт, а не начинает заново
+    return BackgroundTasks(get_result_cache(), max_workers=BACKGROUND_WORKERS)
+
+
+cache = get_result_cache()
+renderer = get_renderer()
+tasks = get_background_tasks()
+file_cache = PreparedFileCache(FILE_CACHE_DIR, max_bytes=FILE_CACHE_MB * 1024 ** 2)
+
+# панель производительности: переключатели в начале, результаты замера — в конце запуска.
+# Замер включается на процесс целиком (для всех сессий), пока включён хотя бы в одной.
+perf_panel = st.sidebar.expander("⏱ Производительность")
+profile = perf_panel.checkbox("Замер времени и строк", value=instrumentation.enabled(), key="profile")
+profile_memory = perf_panel.checkbox("Пик памяти (замедляет расчёты)", key="profile_memory", disabled=not profile)
+instrumentation.configure(profile, memory=profile and profile_memory, log_path=PROFILE_LOG)
+profile_mark = instrumentation.mark()
+
+uploaded_files = st.file_uploader("Загрузите файлы в формате CSV или Excel (можно несколько, например недельные выгрузки за квартал)",
+                                  type=["csv", "xlsx"], accept_multiple_files=True)
+
+if not uploaded_files:
     st.info("⬆️ Загрузите файл для анализа.")
     st.stop()
 
-# чтение файла
+files = [(f.name, f.getvalue()) for f in uploaded_files]
+# ключ результатов: хэш файла, для нескольких файлов — хэш хэшей в порядке загрузки
+# (при повторах оценок в пересекающихся периодах порядок важен: берётся первый файл)
+file_hashes = [fingerprint(data) for _, data in files]
+file_hash = file_hashes[0] if len(files) == 1 else fingerprint("|".join(file_hashes).encode())
+
+# потоковый режим: CSV читается порциями и сразу сворачивается в агрегаты (только для одного файла)
+streaming = len(files) == 1 and files[0][0].endswith(".csv") and st.checkbox(
+    "Потоковая загрузка большого CSV (только агрегаты: статистические тесты недоступны)"
+)
+data_key = f"{file_hash}:stream" if streaming else file_hash
+
+
+def load_prepared():
+    # подготовленные данные: из кэша на диске, либо чтение файла + prepare_data
+    if len(files) > 1:
+        # файлы разбираются параллельно и объединяются в одну компактную таблицу; в потоках, а не
+        # в процессах: вызов идёт из фонового потока многопоточного процесса Streamlit
+        df, report = load_exports(files, compact=True, required=CallQualityAnalyzer.REQUIRED_BASE,
+                                  max_workers=PARSE_WORKERS, file_cache=file_cache if file_cache.available() else None,
+                                  processes=False)
+        return df, {"raw_rows": int(report["raw_rows"].sum()), "raw_columns": list(df.columns), "files": report}
+    name, data = files[0]
+    if file_cache.available():
+        return file_cache.get_or_prepare(data, name, compact=True, file_hash=file_hash)
+    raw = read_export(data, name)
+    return raw, {"raw_rows": len(raw), "raw_columns": list(raw.columns), "unprepared": True}
+
+
+def build_analyzer():
+    # (анализатор, сведения о чтении): подготовленная таблица отдельно не кэшируется — её держит анализатор
+    if streaming:
+        return CallQualityAnalyzer.from_csv_chunks(io.BytesIO(files[0][1]), compact=True), {}
+    df, meta = load_prepared()
+    return CallQualityAnalyzer(df, compact=True, prepared=not meta.get("unprepared", False)), meta
+
+
+def read_columns():
+    """Столбцы по заголовкам файлов (без чтения строк); файлы без базовых столбцов в анализ не войдут."""
+    headers = [[str(c) for c in read_export(data, name, nrows=0).columns] for name, data in files]
+    valid = [h for h in headers if set(CallQualityAnalyzer.REQUIRED_BASE).issubset(h)] or headers
+    return list(dict.fromkeys(c for h in valid for c in h))
+
+
+# чтение файлов и агрегаты — в фоне сразу после загрузки; столбцы и состав блоков —
+# по заголовкам файлов, поэтому они выводятся сразу, независимо от размера файлов
 try:
-    if uploaded_file.name.endswith(".csv"):
-        df = pd.read_csv(uploaded_file)
-    else:
-        df = pd.read_excel(uploaded_file)
+    analyzing = tasks.submit((data_key, "analyzer"), build_analyzer)
+    columns = cache.get_or_compute((file_hash, "columns"), read_columns)
 except Exception as e:
     st.error(f"Ошибка при чтении файла: {e}")
     st.stop()
-
-st.success(f"Файл загружен — {len(df)} строк")
-analyzer = CallQualityAnalyzer(df)
+load_status = st.empty()
 
 st.markdown("### Доступные столбцы")
-st.dataframe(pd.DataFrame({"columns": df.columns}))
+st.dataframe(pd.DataFrame({"columns": columns}))
 
 st.markdown("---")
 st.header("📍 Обнаруженные доступные блоки анализа")
 
-available_blocks = analyzer.available_blocks
+available_blocks = CallQualityAnalyzer.detect_available_blocks(columns)
 for block, available in available_blocks.items():
     emoji = "✅" if available else "❌"
     st.write(f"{emoji} {block.replace('_', ' ').title()}")
 
-st.markdown("---")
+while not analyzing.done():
+    load_status.info("⏳ Файл читается и сворачивается в агрегаты — блоки появятся по мере готовности")
+    wait([analyzing], timeout=WAIT_POLL_S)
+try:
+    analyzer, meta = analyzing.result()
+    if streaming:
+        n_scores = int(analyzer.cube["n"].sum()) if not analyzer.cube.empty else 0
+        load_status.success(f"Файл обработан потоково — {n_scores} оценок после подготовки")
+    else:
+        if "files" in meta:
+            with load_status.container():
+                report = meta["files"]
+                st.success(f"Загружено файлов: {int((report['status'] == 'ok').sum())} из {len(report)} — "
+                           f"{meta['raw_rows']} строк, повторов из пересекающихся периодов: {int(report['duplicates'].sum())}")
+                st.dataframe(report.rename(columns={
+                    "file": "Файл", "raw_rows": "Строк в файле", "prepared_rows": "После подготовки",
+                    "coerced": "Приведено к пустым", "dropped": "Без оценки / 0 (удалены)",
+                    "duplicates": "Повторы (удалены)", "seconds": "Разбор, с", "status": "Статус",
+                }), hide_index=True)
+        else:
+            load_status.success(f"Файл загружен — {meta['raw_rows']} строк")
+            if meta.get("validation"):
+                # отчёт проверки по объявленной схеме выгрузки (см. EXPORT_SCHEMA в data_preparation)
+                with st.expander("🔎 Проверка данных"):
+                    st.caption("По столбцам выгрузки: пустые значения, значения, не распознанные как число/дата "
+                               "(стали пустыми), нулевые оценки, недопустимые call_type и удалённые строки.")
+                    st.dataframe(pd.DataFrame(meta["validation"]).rename(columns={
+                        "column": "Столбец", "type": "Тип", "missing": "Пустые", "coerced": "Приведено к пустым",
+                        "zero": "Нулевые оценки", "not_allowed": "Недопустимые значения", "dropped": "Удалено строк",
+                    }), hide_index=True)
+except Exception as e:
+    load_status.error(f"Ошибка при чтении файла: {e}")
+    st.stop()
 
-# ------------------ Блок 1: распределение оценок и звонков ------------------
-if available_blocks["Распределение оценок/звонков, средние оценки"]:
-    st.header("1️⃣ Распределение оценок и звонков/аудиобейджей по филиалам")
 
-    st.subheader("Количество оценок (всего / звонки / аудиобейджи) по филиалам")
-    all_score = analyzer.get_all_score_by_branch()
-    st.dataframe(all_score)
+def cached(method_name, *args, **kwargs):
+    """Вызов метода анализатора через кэш (ключ — хэш файла + имя метода + аргументы)."""
+    return cache.call(data_key, analyzer, method_name, *args, **kwargs)
 
-    st.subheader("Количество уникальных call_id (всего / звонки / аудиобейджи) по филиалам")
-    call_count = analyzer.get_call_count()
-    st.dataframe(call_count)
 
-    with st.expander("График распределений — все типы коммуникации"):
-        fig = analyzer.plot_distributions_all()
-        st.pyplot(fig)
+# результаты в работе: Future -> (заполнитель на странице, функция вывода).
+# Скрипт размечает все блоки сразу, а в конце заполняет заполнители в порядке готовности
+pending = {}
 
-    with st.expander("График распределений — звонки (REGULAR)"):
-        fig = analyzer.plot_distributions_call()
-        st.pyplot(fig)
 
-    with st.expander("График распределений — аудиобейджи (AUDIO_BADGE)"):
-        fig = analyzer.plot_distributions_badge()
-        st.pyplot(fig)
-else:
-    st.warning("Для блока распределения оценок и звонков требуются столбцы: 'call_id', 'call_type', 'branch_name', 'organization_name', 'score'")
+def show_result(slot, future, render):
+    try:
+        render(slot, future.result())
+    except Exception as e:
+        slot.error(f"Ошибка расчёта: {e}")
+
+
+def deferred(future, render):
+    """Заполнитель для результата future: выводится сразу, если готов, иначе — по готовности."""
+    slot = st.empty()
+    if future.done():
+        show_result(slot, future, render)
+    else:
+        slot.caption("⏳ Считается…")
+        pending[future] = (slot, render)
+    return future
+
+
+def table(method_name, *args, **kwargs):
+    """Таблица метода анализатора: считается в фоновом потоке (кэш общий с cached)."""
+    return deferred(tasks.call(data_key, analyzer, method_name, *args, **kwargs),
+                    lambda slot, df: slot.dataframe(drill(df)))
+
+
+def figure(method_name, *args):
+    """PNG графика метода plot_* (Future): данные — в фоновом потоке, отрисовка — в пуле процессов, повтор — из кэша по содержимому."""
+    return chain(tasks.run(lambda: analyzer.figure_spec(method_name, *args)), renderer.submit_spec)
+
+
+def show_png(slot, png):
+    slot.image(png, width="stretch")
+
+
+def show_figure(method_name, *args):
+    deferred(figure(method_name, *args), show_png)
+
+
+# сетки графиков по филиалам: страницы, число филиалов на странице
+FACET_PAGE_SIZES = [6, 12, 24, 48]
+
+
+def facet_expander(label, key, method_name, df_in, *args):
+    """
+    Сетка графиков по филиалам постранично: сортировка, поиск, первые K филиалов.
+    Пока раздел свёрнут, ничего не считается и не рисуется; рисуется только открытая страница
+    (страницы кэшируются по содержимому, повторное открытие — из кэша).
+    """
+    expander = st.expander(label, key=key, on_change="rerun")
+    if not expander.open:
+        return
+    with expander:
+        col1, col2, col3, col4 = st.columns(4)
+        sort = col1.selectbox("Сортировка", list(analyzer.FACET_SORTS), format_func=analyzer.FACET_SORTS.get,
+                              key=f"{key}_sort")
+        search = col2.text_input("Поиск филиала", key=f"{key}_search").strip()
+        top_k = col3.number_input("Первые K филиалов (0 — все)", 0, step=10, key=f"{key}_top_k")
+        page_size = col4.selectbox("Филиалов на странице", FACET_PAGE_SIZES, index=1, key=f"{key}_page_size")
+        groups = drill(cached("get_facet_groups", df_in, sort=sort, search=search or None,
+                              top_k=int(top_k) or None, grouper=level))
+        if groups.empty:
+            st.info("Нет филиалов с оценками" + (f" по запросу «{search}»" if search else ""))
+            return
+        n_pages = -(-len(groups) // page_size)
+        page = 1
+        if n_pages > 1:
+            page = st.selectbox(f"Страница (из {n_pages})", range(1, n_pages + 1), key=f"{key}_page")
+        page_groups = analyzer.facet_page(groups, page - 1, page_size, grouper=level)
+        first = (page - 1) * page_size
+        st.caption(f"Филиалы {first + 1}–{first + len(page_groups)} из {len(groups)}")
+        show_figure(method_name, *args, page_groups, level)
+
+
+# уровень детализации (итог -> организация -> филиал) и организация для перехода к её филиалам.
+# Все уровни сворачиваются из куба филиалов, переход фильтрует готовые таблицы — без пересчёта
+level = st.sidebar.radio("Уровень детализации", list(analyzer.LEVELS), format_func=analyzer.LEVELS.get,
+                         index=list(analyzer.LEVELS).index("organization_branch_name"), key="level")
+drill_groups = None
+if level == "organization_branch_name":
+    hierarchy = cached("get_hierarchy")
+    organizations = [] if hierarchy.empty else list(hierarchy["organization_name"].dropna().unique())
+    drill_org = st.sidebar.selectbox("Организация", [None, *organizations], key="drill_org",
+                                     format_func=lambda o: "Все организации" if o is None else o)
+    if drill_org is not None:
+        drill_groups = tuple(hierarchy.loc[hierarchy["organization_name"] == drill_org, "organization_branch_name"])
+
+
+def drill(table):
+    """Строки филиалов выбранной организации (по столбцу или индексу уровня)."""
+    if drill_groups is None or table.empty:
+        return table
+    if level in table.columns:
+        return table[table[level].isin(drill_groups)].reset_index(drop=True)
+    if table.index.name == level:
+        return table[table.index.isin(drill_groups)]
+    return table
+
+
+def criteria_impact(df_in, avg_score_criteria, avg_by_branch_method, count_col):
+    """
+    Вклад критериев и тепловая карта: считаются по готовой таблице средних по критериям (Future).
+    Ожидание внутри пула не блокирует его: таблица средних поставлена в очередь раньше.
+    """
+    def compute():
+        return cached("get_criteria_impact", df_in, avg_score_criteria=avg_score_criteria.result(),
+                      avg_score_by_branch=cached(avg_by_branch_method, grouper=level), count_col=count_col, grouper=level)
+
+    impact = deferred(tasks.run(compute), lambda slot, df: slot.dataframe(drill(df)))
+    deferred(chain(impact, lambda df: renderer.submit_spec(analyzer.figure_spec("plot_criteria_heatmap", drill(df)))),
+             show_png)
+
+
+def show_drift(slot, alerts):
+    alerts = drill(alerts)
+    with slot.container():
+        if alerts.empty:
+            st.success("Сигналов нет: средние оценки в пределах обычных колебаний")
+            return
+        st.dataframe(alerts, hide_index=True)
+        st.download_button("⬇ Скачать сигналы", alerts.to_csv(index=False), "drift_alerts.csv")
+
+
+def show_correlation(slot, correlation):
+    correlation = drill(correlation)
+    with slot.container():
+        if correlation.empty:
+            st.info("Недостаточно звонков с парами оценок")
+            return
+        group = st.selectbox("Матрица корреляций для", sorted(correlation[level].unique()), key="corr_group")
+        st.dataframe(analyzer.get_criteria_correlation_matrix(correlation, group).round(2))
+        st.dataframe(correlation, hide_index=True)
+        st.download_button("⬇ Скачать корреляции", correlation.to_csv(index=False), "criteria_correlation.csv")
+
+
+def show_ci(slot, avg_ci):
+    avg_ci = drill(avg_ci)
+    with slot.container():
+        st.dataframe(avg_ci, hide_index=True)
+        if not avg_ci.empty:
+            st.download_button("⬇ Скачать таблицу", avg_ci.to_csv(index=False), "avg_score_ci.csv")
+
+
+PERIOD_NAMES = {"D": "День", "W": "Неделя", "M": "Месяц"}
+
+st.markdown("---")
+
+# ------------------ Блок 1: распределение оценок и звонков ------------------
+with span("app.block_1_distribution", kind="block"):
+    if available_blocks["Распределение оценок/звонков, средние оценки"]:
+        st.header("1️⃣ Распределение оценок и звонков/аудиобейджей по филиалам")
+
+        st.subheader("Количество оценок (всего / звонки / аудиобейджи) по филиалам")
+        table("get_all_score_by_branch", grouper=level)
+
+        st.subheader("Количество уникальных call_id (всего / звонки / аудиобейджи) по филиалам")
+        table("get_call_count", grouper=level)
+
+        facet_expander("График распределений — все типы коммуникации", "facets_dist_all",
+                       "plot_distributions_all", analyzer.df)
+        facet_expander("График распределений — звонки (REGULAR)", "facets_dist_call",
+                       "plot_distributions_call", analyzer.df_call)
+        facet_expander("График распределений — аудиобейджи (AUDIO_BADGE)", "facets_dist_badge",
+                       "plot_distributions_badge", analyzer.df_badge)
+    else:
+        st.warning("Для блока распределения оценок и звонков требуются столбцы: 'call_id', 'call_type', 'branch_name', 'organization_name', 'score'")
 
 st.markdown("---")
 
 # ------------------ Блок 2: средние оценки ------------------
-if available_blocks["Распределение оценок/звонков, средние оценки"]:
-    st.header("2️⃣ Средние оценки за звонки и аудиобейджи по филиалам")
-
-    st.subheader("Средняя оценка — все типы коммуникации")
-    avg_all = analyzer.get_avg_score_by_branch()
-    st.dataframe(avg_all)
-    fig = analyzer.plot_avg_score()
-    st.pyplot(fig)
-
-    st.subheader("Средняя оценка — звонки (REGULAR)")
-    avg_call = analyzer.get_avg_score_by_branch_call()
-    st.dataframe(avg_call)
-    fig = analyzer.plot_avg_score_call()
-    st.pyplot(fig)
-
-    st.subheader("Средняя оценка — аудиобейджи (AUDIO_BADGE)")
-    avg_badge = analyzer.get_avg_score_by_branch_badge()
-    st.dataframe(avg_badge)
-    fig = analyzer.plot_avg_score_badge()
-    st.pyplot(fig)
-
-    st.subheader("Объединённая сводная таблица средних оценок (call / badge / all)")
-    full_avg = analyzer.get_full_avg_score_by_branch()
-    st.dataframe(full_avg)
-else:
-    st.info("Средние оценки недоступны: отсутствуют базовые столбцы 'call_id', 'call_type', 'branch_name', 'organization_name', 'score'")
+with span("app.block_2_averages", kind="block"):
+    if available_blocks["Распределение оценок/звонков, средние оценки"]:
+        st.header("2️⃣ Средние оценки за звонки и аудиобейджи по филиалам")
+
+        st.subheader("Средняя оценка — все типы коммуникации")
+        table("get_avg_score_by_branch", grouper=level)
+        show_figure("plot_avg_score", drill_groups, level)
+
+        st.subheader("Средняя оценка — звонки (REGULAR)")
+        table("get_avg_score_by_branch_call", grouper=level)
+        show_figure("plot_avg_score_call", drill_groups, level)
+
+        st.subheader("Средняя оценка — аудиобейджи (AUDIO_BADGE)")
+        table("get_avg_score_by_branch_badge", grouper=level)
+        show_figure("plot_avg_score_badge", drill_groups, level)
+
+        st.subheader("Объединённая сводная таблица средних оценок (call / badge / all)")
+        table("get_full_avg_score_by_branch", grouper=level)
+
+        # интервалы считаются, только пока раздел открыт
+        ci_expander = st.expander("📏 Доверительные интервалы и рейтинг филиалов", key="ci", on_change="rerun")
+        if ci_expander.open:
+            with ci_expander:
+                st.caption("Бутстреп-интервалы средней оценки. Место в рейтинге — по нижней границе интервала, "
+                           "диапазон мест — места, совместимые с интервалами: у неразличимых филиалов диапазоны пересекаются.")
+                col1, col2, col3 = st.columns(3)
+                ci_types = {"all": ("Все типы", analyzer.df), "call": ("Звонки (REGULAR)", analyzer.df_call),
+                            "badge": ("Аудиобейджи (AUDIO_BADGE)", analyzer.df_badge)}
+                ci_type = col1.selectbox("Тип коммуникации", list(ci_types), format_func=lambda t: ci_types[t][0], key="ci_type")
+                ci_level = col2.selectbox("Уровень доверия", [0.9, 0.95, 0.99], index=1, format_func="{:.0%}".format, key="ci_level")
+                ci_min_scores = col3.number_input("Минимум оценок для интервала", 2, value=10, key="ci_min_scores")
+                ci_by_criteria = st.checkbox("По критериям (рейтинг внутри каждого критерия)", key="ci_by_criteria",
+                                             disabled=not available_blocks["Анализ критериев оценок"])
+                deferred(tasks.call(data_key, analyzer, "get_avg_score_ci", ci_types[ci_type][1], by_criteria=ci_by_criteria,
+                                    level=ci_level, min_scores=int(ci_min_scores), grouper=level), show_ci)
+    else:
+        st.info("Средние оценки недоступны: отсутствуют базовые столбцы 'call_id', 'call_type', 'branch_name', 'organization_name', 'score'")
 
 st.markdown("---")
 
-# ------------------ Блок 3: недельная динамика ------------------
-if available_blocks["Динамика оценок"]:
-    st.header("3️⃣ Недельная динамика средних оценок")
-
-    st.subheader("Сводная таблица и графики — все типы коммуникации")
-    weekly_all = analyzer.get_avg_score_by_week(analyzer.df)
-    st.dataframe(weekly_all)
-    fig = analyzer.plot_weekly_all()
-    st.pyplot(fig)
-
-    st.subheader("Сводная таблица и графики — звонки")
-    weekly_call = analyzer.get_avg_score_by_week(analyzer.df_call)
-    st.dataframe(weekly_call)
-    fig = analyzer.plot_weekly_call()
-    st.pyplot(fig)
-
-    st.subheader("Сводная таблица и графики — аудиобейджи")
-    weekly_badge = analyzer.get_avg_score_by_week(analyzer.df_badge)
-    st.dataframe(weekly_badge)
-    fig = analyzer.plot_weekly_badge()
-    st.pyplot(fig)
-
-    with st.expander("Сетка графиков динамики по филиалам — все типы коммуникации"):
-        fig = analyzer.plot_weekly_grid_all()
-        st.pyplot(fig)
-    with st.expander("Сетка графиков динамики по филиалам — звонки"):
-        fig = analyzer.plot_weekly_grid_call()
-        st.pyplot(fig)
-    with st.expander("Сетка графиков динамики по филиалам — аудиобейджи"):
-        fig = analyzer.plot_weekly_grid_badge()
-        st.pyplot(fig)
-else:
-    st.info(" Динамика по неделям недоступна, не хватает столбца 'created_at' и/ или базовых столбцов")
+# ------------------ Блок 3: динамика по календарным периодам ------------------
+with span("app.block_3_dynamics", kind="block"):
+    if available_blocks["Динамика оценок"]:
+        st.header("3️⃣ Динамика средних оценок")
+        # периоды календарные (ISO-недели, месяцы, дни), одинаковые для всех типов коммуникации
+        period_freq = st.radio("Период", list(PERIOD_NAMES), format_func=PERIOD_NAMES.get,
+                               index=list(PERIOD_NAMES).index("W"), key="period_freq", horizontal=True)
+
+        st.subheader("Сводная таблица и графики — все типы коммуникации")
+        table("get_avg_score_by_period", analyzer.df, period_freq, grouper=level)
+        show_figure("plot_weekly_all", period_freq, drill_groups, level)
+
+        st.subheader("Сводная таблица и графики — звонки")
+        table("get_avg_score_by_period", analyzer.df_call, period_freq, grouper=level)
+        show_figure("plot_weekly_call", period_freq, drill_groups, level)
+
+        st.subheader("Сводная таблица и графики — аудиобейджи")
+        table("get_avg_score_by_period", analyzer.df_badge, period_freq, grouper=level)
+        show_figure("plot_weekly_badge", period_freq, drill_groups, level)
+
+        facet_expander("Сетка графиков динамики по филиалам — все типы коммуникации", "facets_trend_all",
+                       "plot_weekly_grid_all", analyzer.df, period_freq)
+        facet_expander("Сетка графиков динамики по филиалам — звонки", "facets_trend_call",
+                       "plot_weekly_grid_call", analyzer.df_call, period_freq)
+        facet_expander("Сетка графиков динамики по филиалам — аудиобейджи", "facets_trend_badge",
+                       "plot_weekly_grid_badge", analyzer.df_badge, period_freq)
+
+        # детекторы сдвигов считаются, только пока раздел открыт
+        drift_expander = st.expander("🚨 Сигналы снижения и роста средней оценки", key="drift", on_change="rerun")
+        if drift_expander.open:
+            with drift_expander:
+                st.caption("Детекторы EWMA и CUSUM по периодам: средняя периода сравнивается со средней всей "
+                           "предыдущей истории ряда. Тяжесть ≥ 1 — сигнал, список отсортирован по тяжести.")
+                col1, col2 = st.columns(2)
+                drift_types = {None: "Все типы", "REGULAR": "Звонки (REGULAR)", "AUDIO_BADGE": "Аудиобейджи (AUDIO_BADGE)"}
+                drift_type = col1.selectbox("Тип коммуникации", list(drift_types), format_func=drift_types.get, key="drift_type")
+                drift_by_criteria = col2.checkbox("По критериям", key="drift_by_criteria",
+                                                  disabled=not available_blocks["Анализ критериев оценок"])
+                deferred(tasks.call(data_key, analyzer, "get_drift_alerts", period_freq, by_criteria=drift_by_criteria,
+                                    call_type=drift_type, grouper=level), show_drift)
+    else:
+        st.info(" Динамика по периодам недоступна, не хватает столбца 'created_at' и/ или базовых столбцов")
 
 st.markdown("---")
 
 # ------------------ Блок 4: сравнение по критериям ------------------
-if available_blocks["Анализ критериев оценок"]:
-    st.header("4️⃣ Сравнение оценок филиалов в разрезе по критериям")
-
-    st.subheader("Средняя оценка филиалов по критериям — звонки (REGULAR)")
-    avg_call_criteria = analyzer.get_avg_score_criteria(analyzer.df_call)
-    st.dataframe(avg_call_criteria)
-
-    st.subheader("Относительный вклад критериев — звонки")
-    criteria_impact_call = analyzer.get_criteria_impact(analyzer.df_call, avg_score_criteria=avg_call_criteria, avg_score_by_branch=analyzer.get_avg_score_by_branch_call(), count_col="count_call")
-    st.dataframe(criteria_impact_call)
-    fig = analyzer.plot_criteria_heatmap(criteria_impact_call)
-    st.pyplot(fig)
-
-    with st.expander("📊 Статистические тесты по критериям оценки звонков", expanded=False):
-        min_pairs = st.slider("Минимум оценок по каждому критерию", 10, 30, 10)
-        alpha = st.number_input("Уровень значимости α", 0.01, 0.1, 0.05, step=0.01)
-
-        if st.button("▶ Запустить статистические тесты"):
-            with st.spinner("Выполняется анализ..."):
-                st.subheader("Тест 1: 'Профессиональная этика' > 'Активное слушание'")
-                st.markdown("""
-                            **Гипотеза**: Для каждого филиала средняя оценка по критерию *"Профессиональная этика"* выше средней оценки по критерию *"Активное слушание"*
+with span("app.block_4_criteria", kind="block"):
+    if available_blocks["Анализ критериев оценок"]:
+        st.header("4️⃣ Сравнение оценок филиалов в разрезе по критериям")
+
+        st.subheader("Средняя оценка филиалов по критериям — звонки (REGULAR)")
+        avg_call_criteria = table("get_avg_score_criteria", analyzer.df_call, grouper=level)
+
+        st.subheader("Относительный вклад критериев — звонки")
+        criteria_impact(analyzer.df_call, avg_call_criteria, "get_avg_score_by_branch_call", "count_call")
+
+        with st.expander("📊 Статистические тесты по критериям оценки звонков", expanded=False):
+            if analyzer.streamed:
+                st.info("Статистические тесты требуют построчных данных и недоступны в потоковом режиме")
+            min_pairs = st.slider("Минимум оценок по каждому критерию", 10, 30, 10)
+            alpha = st.number_input("Уровень значимости α", 0.01, 0.1, 0.05, step=0.01)
+
+            if st.button("▶ Запустить статистические тесты", disabled=analyzer.streamed):
+                with st.spinner("Выполняется анализ..."):
+                    st.subheader("Тест 1: 'Профессиональная этика' > 'Активное слушание'")
+                    st.markdown("""
+                                **Гипотеза**: Для каждого филиала средняя оценка по критерию *"Профессиональная этика"* выше средней оценки по критерию *"Активное слушание"*
                             
-                            **Статистические гипотезы**:
+                                **Статистические гипотезы**:
 
-                              - H0: среднее по критерию "Профессиональная этика" <= среднее по критерию "Активное слушание"
+                                  - H0: среднее по критерию "Профессиональная этика" <= среднее по критерию "Активное слушание"
                                 
-                              - H1: среднее по критерию "Профессиональная этика" > среднее по критерию "Активное слушание"
-                            """)
-                df1 = analyzer.test_professional_vs_active_listening(min_pairs=min_pairs, alpha=alpha)
-                st.dataframe(df1)
-                st.download_button("⬇ Скачать результаты (Тест 1)", df1.to_csv(index=False), "test1_results.csv")
-
-                st.subheader("Тест 2: Вклад 'Профессиональная этика' > Вклад 'Работа с возражениями'")
-                st.markdown("""
-                            **Гипотеза**: Для каждого каждого филиала вклад по критерию *"Профессиональная этика"* выше вклада по критерию *"Работа с возражениями"* в общую среднюю оценку по филиалу
+                                  - H1: среднее по критерию "Профессиональная этика" > среднее по критерию "Активное слушание"
+                                """)
+                    df1 = cached("test_professional_vs_active_listening", min_pairs=min_pairs, alpha=alpha)
+                    st.dataframe(df1)
+                    st.download_button("⬇ Скачать результаты (Тест 1)", df1.to_csv(index=False), "test1_results.csv")
+
+                    st.subheader("Тест 2: Вклад 'Профессиональная этика' > Вклад 'Работа с возражениями'")
+                    st.markdown("""
+                                **Гипотеза**: Для каждого каждого филиала вклад по критерию *"Профессиональная этика"* выше вклада по критерию *"Работа с возражениями"* в общую среднюю оценку по филиалу
                             
-                            **Статистические гипотезы**:
+                                **Статистические гипотезы**:
 
-                              - H0: средний вклад критерия "Профессиональная этика" <= средний вклад критерия "Работа с возражениями"
+                                  - H0: средний вклад критерия "Профессиональная этика" <= средний вклад критерия "Работа с возражениями"
                             
-                              - H1: средний вклад критерия "Профессиональная этика" > средний вклад критерия "Работа с возражениями"
-                            """)
-                df2 = analyzer.test_impact_ethics_vs_objections(min_pairs=min_pairs, alpha=alpha)
-                st.dataframe(df2)
-                st.download_button("⬇ Скачать результаты (Тест 2)", df2.to_csv(index=False), "test2_results.csv")
-
-                st.subheader("Тест 3: Презентация продукта ≠ Работа с возражениями")
-                st.markdown("""
-                            **Гипотеза**: Для каждого каждого филиала средняя оценка по критерию *"Качество презентации продукта"* не отличается от средней оценки по критерию *"Работа с возражениями"*
+                                  - H1: средний вклад критерия "Профессиональная этика" > средний вклад критерия "Работа с возражениями"
+                                """)
+                    df2 = cached("test_impact_ethics_vs_objections", min_pairs=min_pairs, alpha=alpha)
+                    st.dataframe(df2)
+                    st.download_button("⬇ Скачать результаты (Тест 2)", df2.to_csv(index=False), "test2_results.csv")
+
+                    st.subheader("Тест 3: Презентация продукта ≠ Работа с возражениями")
+                    st.markdown("""
+                                **Гипотеза**: Для каждого каждого филиала средняя оценка по критерию *"Качество презентации продукта"* не отличается от средней оценки по критерию *"Работа с возражениями"*
                             
-                            **Статистические гипотезы**:
+                                **Статистические гипотезы**:
 
-                              - H0: среднее по критерию "Качество презентации продукта" = среднее по критерию "Работа с возражениями"
+                                  - H0: среднее по критерию "Качество презентации продукта" = среднее по критерию "Работа с возражениями"
                             
-                              - H1: среднее по критерию "Качество презентации продукта" ≠ среднее по критерию "Работа с возражениями"
-                            """)
-                df3 = analyzer.test_presentation_vs_objections(min_pairs=min_pairs, alpha=alpha)
-                st.dataframe(df3)
-                st.download_button("⬇ Скачать результаты (Тест 3)", df3.to_csv(index=False), "test3_results.csv")
-
-    st.subheader("Средняя оценка филиалов по критериям — аудиобейджи (AUDIO_BADGE)")
-    avg_badge_criteria = analyzer.get_avg_score_criteria(analyzer.df_badge)
-    st.dataframe(avg_badge_criteria)
-
-    st.subheader("Относительный вклад критериев — аудиобейджи")
-    criteria_impact_badge = analyzer.get_criteria_impact(analyzer.df_badge, avg_score_criteria=avg_badge_criteria, avg_score_by_branch=analyzer.get_avg_score_by_branch_badge(), count_col="count_audio_badge")
-    st.dataframe(criteria_impact_badge)
-    fig = analyzer.plot_criteria_heatmap(criteria_impact_badge)
-    st.pyplot(fig)
-else:
-    st.info("Сравнение по критериям недоступно, не хватает столбца 'criteria_name' и/ или базовых столбцов")
+                                  - H1: среднее по критерию "Качество презентации продукта" ≠ среднее по критерию "Работа с возражениями"
+                                """)
+                    df3 = cached("test_presentation_vs_objections", min_pairs=min_pairs, alpha=alpha)
+                    st.dataframe(df3)
+                    st.download_button("⬇ Скачать результаты (Тест 3)", df3.to_csv(index=False), "test3_results.csv")
+
+        with st.expander("🧮 Сравнение произвольных пар критериев", expanded=False):
+            if analyzer.streamed:
+                st.info("Сравнение критериев требует построчных данных и недоступно в потоковом режиме")
+            else:
+                all_criteria = sorted(analyzer.df["criteria_name"].dropna().unique())
+                selected_criteria = st.multiselect("Критерии (все пары между выбранными)", all_criteria, default=all_criteria)
+                col1, col2, col3 = st.columns(3)
+                variant = col1.radio("Что сравниваем", ["paired", "contribution"],
+                                     format_func={"paired": "Оценки внутри звонка", "contribution": "Вклад в среднюю оценку"}.get)
+                alternative = col2.selectbox("Альтернатива", ["two-sided", "greater", "less"],
+                                             format_func={"two-sided": "≠", "greater": "Критерий 1 >", "less": "Критерий 1 <"}.get)
+                correction = col3.selectbox("Поправка на множественные сравнения", ["holm", "bh", None],
+                                            format_func=lambda m: {"holm": "Холм", "bh": "Бенджамини–Хохберг"}.get(m, "Без поправки"))
+                cmp_min_pairs = st.slider("Минимум пар оценок в филиале", 5, 30, 10, key="cmp_min_pairs")
+                cmp_alpha = st.number_input("Уровень значимости α", 0.01, 0.1, 0.05, step=0.01, key="cmp_alpha")
+
+                # чекбокс, а не кнопка: выбор филиала для матрицы не сбрасывает результат (он в кэше)
+                if st.checkbox("▶ Сравнить критерии") and len(selected_criteria) >= 2:
+                    with st.spinner("Выполняется сравнение..."):
+                        # пул процессов окупается только на большом числе пар
+                        n_jobs = os.cpu_count() if len(selected_criteria) >= 8 else None
+                        comparison = cached("compare_criteria", criteria=tuple(selected_criteria), variant=variant,
+                                            alternative=alternative, correction=correction,
+                                            min_pairs=cmp_min_pairs, alpha=cmp_alpha, n_jobs=n_jobs)
+                    st.dataframe(comparison)
+                    if not comparison.empty:
+                        st.download_button("⬇ Скачать результаты сравнения", comparison.to_csv(index=False), "criteria_comparison.csv")
+                        branch = st.selectbox("Матрица p-value (скорр.) для филиала", sorted(comparison["Филиал"].unique()))
+                        st.dataframe(analyzer.get_criteria_pvalue_matrix(comparison, branch))
+
+        # корреляции считаются, только пока раздел открыт
+        corr_expander = st.expander("🔗 Корреляции критериев внутри звонка", key="corr", on_change="rerun")
+        if corr_expander.open:
+            with corr_expander:
+                if analyzer.streamed:
+                    st.info("Корреляции критериев требуют построчных данных и недоступны в потоковом режиме")
+                else:
+                    st.caption("Коэффициент Пирсона по звонкам, где оценены оба критерия. "
+                               "Пары с меньшим числом таких звонков не показываются.")
+                    corr_min_pairs = st.slider("Минимум звонков с парой оценок", 5, 50, 10, key="corr_min_pairs")
+                    deferred(tasks.call(data_key, analyzer, "get_criteria_correlation", grouper=level,
+                                        min_pairs=corr_min_pairs), show_correlation)
+
+        st.subheader("Средняя оценка филиалов по критериям — аудиобейджи (AUDIO_BADGE)")
+        avg_badge_criteria = table("get_avg_score_criteria", analyzer.df_badge, grouper=level)
+
+        st.subheader("Относительный вклад критериев — аудиобейджи")
+        criteria_impact(analyzer.df_badge, avg_badge_criteria, "get_avg_score_by_branch_badge", "count_audio_badge")
+    else:
+        st.info("Сравнение по критериям недоступно, не хватает столбца 'criteria_name' и/ или базовых столбцов")
 
 st.markdown("---")
-st.success("Аналитика готова")
\ No newline at end of file
+ready = st.empty()
+
+# заполнители блоков заполняются по мере готовности результатов, в любом порядке
+with span("app.wait_results", kind="block"):
+    while pending:
+        ready.caption(f"⏳ Результатов в работе: {len(pending)}")
+        done, _ = wait(list(pending), timeout=WAIT_POLL_S, return_when=FIRST_COMPLETED)
+        for future in done:
+            slot, render = pending.pop(future)
+            show_result(slot, future, render)
+ready.success("Аналитика готова")
+
+with st.sidebar.expander("Кэш результатов"):
+    st.json(cache.stats())
+    if file_cache.available():
+        st.caption(f"Кэш файлов: {FILE_CACHE_DIR}, {file_cache.size_bytes() / 1024 ** 2:.1f} из {FILE_CACHE_MB} МБ")
+    st.caption("Графики (PNG)")
+    st.json(renderer.stats())
+    st.caption("Фоновые расчёты")
+    st.json(tasks.stats())
+
+with perf_panel:
+    if profile:
+        # графики рисуются в процессах-работниках: их замеры попадают только в файл PROFILE_LOG
+        run_records = instrumentation.records(profile_mark)
+        st.caption(f"Вызовов за этот запуск: {len(run_records)} (из кэша результатов — без вызова)")
+        st.dataframe(instrumentation.summary(run_records), hide_index=True)
+        if profile_memory:
+            st.caption("Пик памяти общий на процесс: у вызовов, шедших одновременно с другими "
+                       "(фоновые расчёты в нескольких потоках), он не записывается.")
+        st.download_button(
+            "⬇ Замеры (JSON lines)",
+            "\n".join(json.dumps(r, ensure_ascii=False, default=str) for r in run_records),
+            "profile.jsonl",
+        )
+        if PROFILE_LOG:
+            st.caption(f"Журнал: {PROFILE_LOG}")
@@ -0,0 +1,309 @@
+import abc
+import importlib.util
+import os
+
+import pandas as pd
+
+from data_preparation import prepare_data
+from lazy_imports import lazy_module
+
+# движки и pyarrow загружаются только при первом запросе
+duckdb = lazy_module("duckdb")
+pl = lazy_module("polars")
+pq = lazy_module("pyarrow.parquet")
+pa = lazy_module("pyarrow")
+
+# смещение номера файла в порядковом номере строки (файл, строка в файле)
+_FILE_SHIFT = 2 ** 40
+
+
+class ParquetBackend(abc.ABC):
+    """
+    Источник агрегатов для CallQualityAnalyzer: выгрузки лежат в Parquet-файлах на диске,
+    группировки выполняет встроенный колоночный движок, в память попадают только результаты —
+    кубы достаточных статистик, счётчики звонков, гистограммы оценок (см. CallQualityAnalyzer._build_*).
+
+    Правила подготовки те же, что в prepare_data: organization_branch_name = "organization_name: branch_name",
+    score приводится к числу, строки с score == 0 / пустым score отбрасываются, created_at — к дате.
+    Результаты совпадают с построчным расчётом в pandas (порядок строк, типы столбцов).
+    """
+
+    name = None
+    module = None
+
+    def __init__(self, paths):
+        if isinstance(paths, (str, os.PathLike)):
+            paths = [paths]
+        self.paths = [str(p) for p in paths]
+        if not self.paths:
+            raise ValueError("Не переданы файлы Parquet")
+        if not self.available():
+            raise ImportError(f"Для движка {self.name} нужен пакет {self.module}: pip install {self.module}")
+        self.columns = list(pa.unify_schemas([pq.read_schema(p) for p in self.paths]).names)
+
+    @classmethod
+    def available(cls) -> bool:
+        return importlib.util.find_spec(cls.module) is not None
+
+    def schema(self, compact=False) -> pd.DataFrame:
+        """Схема подготовленных данных (0 строк): по ней определяются доступные блоки."""
+        schema = pa.unify_schemas([pq.read_schema(p) for p in self.paths])
+        return prepare_data(schema.empty_table().to_pandas(), compact=compact)
+
+    def dims(self, grouper, criteria=True):
+        """Измерения, доступные в файлах (порядок как у CallQualityAnalyzer._cube_keys)."""
+        dims = [grouper]
+        if grouper == "organization_branch_name" and "organization_name" in self.columns:
+            dims.append("organization_name")
+        for col in ("call_type", "criteria_name"):
+            if col in self.columns and (criteria or col != "criteria_name"):
+                dims.append(col)
+        if "created_at" in self.columns:
+            dims.append("day")
+        return dims
+
+    def _has(self, grouper):
+        if grouper == "organization_branch_name":
+            ok = {"organization_name", "branch_name"}.issubset(self.columns)
+        else:
+            ok = grouper in self.columns
+        return ok and "score" in self.columns
+
+    # запросы (реализуются движком): возвращают сырой результат, приводится в _normalize.
+    # Движок без любого из них не создаётся (TypeError при создании, а не посреди запроса)
+    @abc.abstractmethod
+    def _cube(self, grouper, dims, with_calls):
+        """dims, n, score_sum, score_sq_sum и n_calls (если with_calls)."""
+
+    @abc.abstractmethod
+    def _call_cube(self, grouper, dims):
+        """dims (без критерия), n_calls — число уникальных call_id."""
+
+    @abc.abstractmethod
+    def _hist(self, grouper, dims):
+        """dims (без дня), score, count."""
+
+    @abc.abstractmethod
+    def _keys(self, grouper, dims):
+        """Уникальные пары (dims, call_id)."""
+
+    def cube(self, grouper="organization_branch_name") -> pd.DataFrame:
+        """Куб (dims, n, score_sum, score_sq_sum, n_calls) — как CallQualityAnalyzer._build_cube."""
+        if not self._has(grouper):
+            return pd.DataFrame()
+        dims = self.dims(grouper)
+        return self._normalize(self._cube(grouper, dims, "call_id" in self.columns), dims)
+
+    def call_cube(self, grouper="organization_branch_name") -> pd.DataFrame:
+        """Уникальные звонки (dims без критерия, n_calls) — как CallQualityAnalyzer._build_call_cube."""
+        if not self._has(grouper) or "call_id" not in self.columns:
+            return pd.DataFrame()
+        dims = self.dims(grouper, criteria=False)
+        return self._normalize(self._call_cube(grouper, dims), dims)
+
+    def hist(self, grouper="organization_branch_name") -> pd.DataFrame:
+        """
+        Гистограммы (grouper, call_type, criteria_name, score, count) — как CallQualityAnalyzer._build_hist:
+        филиалы, типы и критерии в порядке первого появления в файлах, оценки по возрастанию.
+        """
+        if not self._has(grouper):
+            return pd.DataFrame()
+        dims = [d for d in self.dims(grouper) if d != "day"]
+        hist = self._hist(grouper, dims)
+        if hist.empty:
+            return pd.DataFrame()
+        # в построчном режиме строки упорядочены по call_type (см. _partition_by_type),
+        # поэтому «первое появление» считается после такой же сортировки
+        rank = pd.factorize(hist["call_type"], sort=True)[0] if "call_type" in dims else 0
+        seq = hist.assign(_rank=rank).sort_values(["_rank", "_first"], kind="stable")
+        order = [f"_o{i}" for i in range(len(dims))]
+        for col, name in zip(dims, order):
+            hist.loc[seq.index, name] = pd.factorize(seq[col], use_na_sentinel=False)[0]
+        hist = hist.sort_values(order + ["score"], kind="stable")
+        hist = hist[dims + ["score", "count"]].reset_index(drop=True)
+        hist["count"] = hist["count"].astype("int64")
+        score = hist["score"].astype("float64")
+        hist["score"] = score.astype("int64") if (score % 1 == 0).all() else score
+        return hist
+
+    def keys(self, grouper="organization_branch_name", criteria=True) -> pd.DataFrame:
+        """Уникальные ключи (dims, call_id) — для множеств ключей инкрементального режима."""
+        if not self._has(grouper) or "call_id" not in self.columns:
+            return pd.DataFrame()
+        dims = self.dims(grouper, criteria)
+        return self._normalize(self._keys(grouper, dims), dims)
+
+    @staticmethod
+    def _normalize(frame, dims):
+        """Порядок строк и типы как у groupby в pandas: ключи по возрастанию, пропуски в конце."""
+        frame = frame.sort_values(dims, na_position="last", kind="stable").reset_index(drop=True)
+        for col in frame.columns:
+            if col == "day":
+                frame[col] = pd.to_datetime(frame[col]).astype("datetime64[us]")
+            elif col in ("n", "n_calls"):
+                frame[col] = frame[col].astype("int64")
+            elif col in ("score_sum", "score_sq_sum"):
+                frame[col] = frame[col].astype("float64")
+            elif frame[col].dtype == object and col != "call_id":
+                frame[col] = frame[col].astype("str")
+        return frame
+
+
+class DuckDBBackend(ParquetBackend):
+    """
+    DuckDB: SQL-запросы прямо к Parquet-файлам. Данные читаются потоково по нужным столбцам,
+    при нехватке памяти (memory_limit) промежуточные результаты сбрасываются на диск.
+    """
+
+    name = "duckdb"
+    module = "duckdb"
+
+    def __init__(self, paths, memory_limit=None, threads=None):
+        super().__init__(paths)
+        self.memory_limit = memory_limit
+        self.threads = threads
+        self._con = None
+
+    def __getstate__(self):
+        # соединение не передаётся в другие процессы, там открывается заново
+        return {**self.__dict__, "_con": None}
+
+    def _execute(self, sql):
+        if self._con is None:
+            self._con = duckdb.connect()
+            if self.memory_limit:
+                self._con.execute(f"SET memory_limit = '{self.memory_limit}'")
+            if self.threads:
+                self._con.execute(f"SET threads = {int(self.threads)}")
+        return self._con.execute(sql).df()
+
+    @staticmethod
+    def _ident(name):
+        return '"' + name.replace('"', '""') + '"'
+
+    def _expr(self, name, grouper):
+        if name == grouper and grouper == "organization_branch_name":
+            return "CAST(organization_name AS VARCHAR) || ': ' || CAST(branch_name AS VARCHAR)"
+        if name == "day":
+            return "CAST(date_trunc('day', TRY_CAST(created_at AS TIMESTAMP)) AS TIMESTAMP)"
+        return self._ident(name)
+
+    def _prepared(self, grouper, dims):
+        """Подготовленные строки: измерения, score, call_id и порядковый номер строки."""
+        files = " UNION ALL BY NAME ".join(
+            f"SELECT {i} AS _file, * FROM read_parquet('{p.replace(chr(39), chr(39) * 2)}', file_row_number = true)"
+            for i, p in enumerate(self.paths)
+        )
+        cols = [f"{self._expr(d, grouper)} AS {self._ident(d)}" for d in dims]
+        cols.append("TRY_CAST(score AS DOUBLE) AS score")
+        if "call_id" in self.columns:
+            cols.append("call_id")
+        cols.append(f"_file * {_FILE_SHIFT} + file_row_number AS _row")
+        return (
+            f"SELECT {', '.join(cols)} FROM ({files}) "
+            "WHERE TRY_CAST(score AS DOUBLE) IS NOT NULL AND TRY_CAST(score AS DOUBLE) <> 0"
+        )
+
+    def _query(self, grouper, dims, aggs, by=()):
+        keys = ", ".join(self._ident(d) for d in [*dims, *by])
+        sql = f"SELECT {keys}, {aggs} FROM ({self._prepared(grouper, dims)}) GROUP BY {keys}"
+        return self._execute(sql)
+
+    def _cube(self, grouper, dims, with_calls):
+        aggs = "count(*) AS n, sum(score) AS score_sum, sum(score * score) AS score_sq_sum"
+        if with_calls:
+            aggs += ", count(DISTINCT call_id) AS n_calls"
+        return self._query(grouper, dims, aggs)
+
+    def _call_cube(self, grouper, dims):
+        return self._query(grouper, dims, "count(DISTINCT call_id) AS n_calls")
+
+    def _hist(self, grouper, dims):
+        return self._query(grouper, dims, 'count(*) AS "count", min(_row) AS _first', by=["score"])
+
+    def _keys(self, grouper, dims):
+        keys = ", ".join(self._ident(d) for d in dims)
+        sql = f"SELECT DISTINCT {keys}, call_id FROM ({self._prepared(grouper, dims)}) WHERE call_id IS NOT NULL"
+        return self._execute(sql)
+
+
+class PolarsBackend(ParquetBackend):
+    """Polars (lazy): план запроса по scan_parquet, выполнение потоковым движком."""
+
+    name = "polars"
+    module = "polars"
+
+    def _prepared(self, grouper, dims):
+        frames = [
+            pl.scan_parquet(p).with_row_index("_row").with_columns(
+                (pl.lit(i, pl.Int64) * _FILE_SHIFT + pl.col("_row").cast(pl.Int64)).alias("_row")
+            )
+            for i, p in enumerate(self.paths)
+        ]
+        lf = pl.concat(frames, how="diagonal_relaxed")
+        schema = lf.collect_schema()
+        exprs = []
+        for d in dims:
+            if d == grouper and grouper == "organization_branch_name":
+                expr = pl.concat_str([
+                    pl.col("organization_name").cast(pl.String), pl.lit(": "), pl.col("branch_name").cast(pl.String)
+                ])
+            elif d == "day":
+                created = pl.col("created_at")
+                if schema["created_at"] == pl.String:
+                    created = created.str.to_datetime(strict=False)
+                else:
+                    created = created.cast(pl.Datetime("us"), strict=False)
+                expr = created.dt.truncate("1d")
+            else:
+                expr = pl.col(d)
+            exprs.append(expr.alias(d))
+        exprs.append(pl.col("score").cast(pl.Float64, strict=False).alias("score"))
+        if "call_id" in self.columns:
+            exprs.append(pl.col("call_id"))
+        exprs.append(pl.col("_row"))
+        return lf.select(exprs).filter(pl.col("score").is_not_null() & (pl.col("score") != 0))
+
+    @staticmethod
+    def _collect(lf):
+        try:
+            return lf.collect(engine="streaming").to_pandas()
+        except TypeError:  # старые версии polars
+            return lf.collect(streaming=True).to_pandas()
+
+    def _cube(self, grouper, dims, with_calls):
+        score = pl.col("score")
+        aggs = [pl.len().alias("n"), score.sum().alias("score_sum"), (score * score).sum().alias("score_sq_sum")]
+        if with_calls:
+            aggs.append(pl.col("call_id").drop_nulls().n_unique().alias("n_calls"))
+        return self._collect(self._prepared(grouper, dims).group_by(dims).agg(aggs))
+
+    def _call_cube(self, grouper, dims):
+        agg = pl.col("call_id").drop_nulls().n_unique().alias("n_calls")
+        return self._collect(self._prepared(grouper, dims).group_by(dims).agg(agg))
+
+    def _hist(self, grouper, dims):
+        aggs = [pl.len().alias("count"), pl.col("_row").min().alias("_first")]
+        return self._collect(self._prepared(grouper, dims).group_by(dims + ["score"]).agg(aggs))
+
+    def _keys(self, grouper, dims):
+        lf = self._prepared(grouper, dims).filter(pl.col("call_id").is_not_null())
+        return self._collect(lf.select(dims + ["call_id"]).unique())
+
+
+# движки, работающие с файлами на диске; по умолчанию анализатор считает в pandas (в памяти)
+BACKENDS = {
+    "duckdb": DuckDBBackend,
+    "polars": PolarsBackend,
+}
+
+
+def available_backends():
+    """Движки, доступные в окружении: pandas всегда, остальные — если установлен пакет."""
+    return ["pandas"] + [name for name, backend in BACKENDS.items() if backend.available()]
+
+
+def get_backend(name, paths, **options):
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестный движок: {name} (доступны: {', '.join(['pandas', *BACKENDS])})")
+    return BACKENDS[name](paths, **options)
@@ -0,0 +1,91 @@
+import atexit
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from cache import ResultCache
+
+
+def chain(future: Future, func) -> Future:
+    """
+    Future результата func(future.result()), где func сама возвращает Future
+    (например, подготовка данных графика в потоке -> отрисовка в пуле процессов).
+    Ошибка или отмена любого шага передаётся в итоговый Future.
+    """
+    out = Future()
+
+    def _copy(f):
+        if f.cancelled():
+            out.cancel()
+        elif f.exception() is not None:
+            out.set_exception(f.exception())
+        else:
+            out.set_result(f.result())
+
+    def _next(f):
+        if f.cancelled() or f.exception() is not None:
+            _copy(f)
+            return
+        try:
+            func(f.result()).add_done_callback(_copy)
+        except Exception as e:
+            out.set_exception(e)
+
+    future.add_done_callback(_next)
+    return out
+
+
+class BackgroundTasks:
+    """
+    Фоновый расчёт таблиц в пуле потоков с общим кэшем результатов.
+
+    - анализатор и его агрегаты живут в памяти процесса, поэтому таблицы считаются в потоках
+      (графики по-прежнему рисуются в пуле процессов FigureRenderer);
+    - ключ задачи совпадает с ключом ResultCache.call: готовый результат берётся из кэша,
+      задача в работе не запускается повторно (перезапуск скрипта Streamlit получает тот же Future);
+    - задачи выполняются в порядке постановки, поэтому ранние блоки страницы готовы первыми.
+    """
+
+    def __init__(self, cache: ResultCache, max_workers=2):
+        self.cache = cache
+        self.max_workers = max_workers
+        self._pending = {}  # key -> Future (задачи в работе)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cqa-background")
+        atexit.register(self.shutdown)
+
+    def submit(self, key, func) -> Future:
+        """Результат func() (Future): из кэша, из уже запущенной задачи или новая задача пула."""
+        marker = object()
+        with self._lock:
+            value = self.cache.get(key, marker)
+            if value is not marker:
+                future = Future()
+                future.set_result(value)
+                return future
+            if key in self._pending:
+                return self._pending[key]
+            future = self._pool.submit(func)
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._done(key, f))
+        return future
+
+    def _done(self, key, future):
+        with self._lock:
+            self._pending.pop(key, None)
+            if not future.cancelled() and future.exception() is None:
+                self.cache.put(key, future.result())
+
+    def call(self, data_hash, obj, method_name, *args, **kwargs) -> Future:
+        """Фоновый аналог ResultCache.call: тот же ключ, результат попадает в тот же кэш."""
+        key = self.cache.call_key(data_hash, obj, method_name, *args, **kwargs)
+        return self.submit(key, lambda: getattr(obj, method_name)(*args, **kwargs))
+
+    def run(self, func) -> Future:
+        """Задача без кэширования результата (например, подготовка данных графика)."""
+        return self._pool.submit(func)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "workers": self.max_workers}
@@ -0,0 +1,212 @@
+import hashlib
+import sys
+import threading
+import types
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def fingerprint(data: bytes) -> str:
+    """Хэш содержимого загруженного файла (ключ для всех закэшированных результатов)."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def fingerprint_frame(df: pd.DataFrame) -> str:
+    """Хэш содержимого датафрейма (значения, индекс и названия столбцов)."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(list(df.columns)).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return h.hexdigest()
+
+
+def _buffers(values):
+    """
+    Буферы памяти массива: (адрес, байты). Представления одного буфера (срезы строк, столбцы
+    одного блока DataFrame, срезы Arrow-массивов) дают тот же адрес, поэтому считаются один раз.
+    """
+    if isinstance(values, pd.MultiIndex):
+        for part in list(values.levels) + list(values.codes):
+            yield from _buffers(part)
+        return
+    if isinstance(values, (pd.Index, pd.Series)):
+        values = values.array
+    if isinstance(values, pd.Categorical):
+        yield from _buffers(values.codes)
+        yield from _buffers(values.categories)
+        return
+    chunked = getattr(values, "_pa_array", None)
+    if chunked is not None:
+        for chunk in chunked.chunks:
+            for buf in chunk.buffers():
+                if buf is not None:
+                    yield buf.address, buf.size
+        return
+    if not isinstance(values, np.ndarray):
+        # массивы расширений pandas: даты (_ndarray), nullable-типы (_data + _mask)
+        parts = [getattr(values, a) for a in ("_ndarray", "_data", "_mask") if isinstance(getattr(values, a, None), np.ndarray)]
+        if not parts:
+            yield id(values), int(getattr(values, "nbytes", sys.getsizeof(values)))
+        for part in parts:
+            yield from _buffers(part)
+        return
+    base = values
+    while isinstance(base.base, np.ndarray):
+        base = base.base
+    size = base.nbytes
+    if base.dtype == object:
+        size = int(pd.Series(base.ravel()).memory_usage(deep=True, index=False))
+    yield base.__array_interface__["data"][0], size
+
+
+def _array_size(value, seen) -> int:
+    """Байты ещё не посчитанных буферов DataFrame / Series / Index / массива (seen — адреса посчитанных)."""
+    if isinstance(value, pd.DataFrame):
+        arrays = [value.index] + [value.iloc[:, i] for i in range(value.shape[1])]
+    elif isinstance(value, pd.Series):
+        arrays = [value.index, value]
+    else:
+        arrays = [value]
+    size = 0
+    for array in arrays:
+        for address, nbytes in _buffers(array):
+            if address not in seen:
+                seen.add(address)
+                size += nbytes
+    return size
+
+
+def estimate_size(value, _seen=None) -> int:
+    """
+    Приблизительный размер объекта в байтах:
+    - DataFrame/Series/массивы — по буферам памяти; общие буферы (представления df_call/df_badge,
+      исходная таблица и подготовленная без копии) внутри одного объекта считаются один раз
+    - matplotlib Figure — RGBA-буфер при отрисовке
+    - кортежи, списки и словари (например, (df, meta) подготовленного файла) — сумма по элементам
+    - объекты (например, CallQualityAnalyzer) — сумма по атрибутам, включая словари агрегатов
+    """
+    seen = set() if _seen is None else _seen
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index, np.ndarray, pd.api.extensions.ExtensionArray)):
+        return _array_size(value, seen)
+    if hasattr(value, "get_size_inches") and hasattr(value, "dpi"):
+        w, h = value.get_size_inches()
+        return int(w * value.dpi * h * value.dpi * 4)
+    if isinstance(value, (str, bytes, int, float, bool, type(None))):
+        return sys.getsizeof(value)
+    # контейнеры и объекты — один раз (общие ссылки и циклы)
+    if ("obj", id(value)) in seen:
+        return 0
+    seen.add(("obj", id(value)))
+    if isinstance(value, (tuple, list, set, frozenset)):
+        return sys.getsizeof(value) + sum(estimate_size(v, seen) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k, seen) + estimate_size(v, seen) for k, v in value.items())
+    if hasattr(value, "__dict__") and not isinstance(value, (type, types.ModuleType)) and not callable(value):
+        return sys.getsizeof(value) + sum(estimate_size(v, seen) for v in vars(value).values())
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """
+    LRU-кэш результатов (экземпляры анализатора, таблицы, фигуры) с ограничением по памяти.
+    Ключи строятся из хэша содержимого файла и аргументов метода,
+    поэтому при перезапуске скрипта Streamlit пересчитывается только то, что изменилось.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()  # key -> (value, size)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = estimate_size(value)
+        with self._lock:
+            if key in self._items:
+                self.current_bytes -= self._items.pop(key)[1]
+            # объект больше всего бюджета не кэшируем
+            if size > self.max_bytes:
+                return value
+            self._items[key] = (value, size)
+            self.current_bytes += size
+            self._evict()
+        return value
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self._items:
+            _, (_, size) = self._items.popitem(last=False)
+            self.current_bytes -= size
+            self.evictions += 1
+
+    def get_or_compute(self, key, func):
+        """Возвращает значение из кэша или вычисляет func() и сохраняет результат."""
+        marker = object()
+        value = self.get(key, marker)
+        if value is not marker:
+            return value
+        return self.put(key, func())
+
+    def call(self, data_hash, obj, method_name, *args, **kwargs):
+        """
+        Кэшированный вызов obj.method_name(*args, **kwargs).
+        Ключ: хэш данных + имя метода + аргументы. Датафреймы-атрибуты obj
+        (df, df_call, df_badge) кодируются по имени атрибута, прочие — по содержимому.
+        """
+        key = self.call_key(data_hash, obj, method_name, *args, **kwargs)
+        return self.get_or_compute(key, lambda: getattr(obj, method_name)(*args, **kwargs))
+
+    def call_key(self, data_hash, obj, method_name, *args, **kwargs):
+        """Ключ кэша для вызова obj.method_name(*args, **kwargs), см. call."""
+        return (
+            data_hash,
+            method_name,
+            tuple(self._arg_token(obj, a) for a in args),
+            tuple(sorted((k, self._arg_token(obj, v)) for k, v in kwargs.items())),
+        )
+
+    @staticmethod
+    def _arg_token(obj, arg):
+        if isinstance(arg, pd.DataFrame):
+            for name, value in vars(obj).items():
+                if value is arg:
+                    return f"@{name}"
+            return f"#{fingerprint_frame(arg)}"
+        return arg
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        """Счётчики попаданий/промахов и занятая память."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "evictions": self.evictions,
+            "items": len(self._items),
+            "size_mb": round(self.current_bytes / 1024 ** 2, 2),
+            "budget_mb": round(self.max_bytes / 1024 ** 2, 2),
+        }
@@ -1,26 +1,210 @@
+import warnings
+
+import numpy as np
 import pandas as pd
 
-def prepare_data(df: pd.DataFrame) -> pd.DataFrame:
+from instrumentation import instrumented
+
+# текстовые столбцы-метки, которые в компактном режиме хранятся как category
+LABEL_COLUMNS = ["call_type", "criteria_name", "branch_name", "organization_name"]
+
+# объявленная схема выгрузки: столбец -> тип (id — как есть, label — текстовая метка,
+# number — число, пустые/нечисловые значения -> NaN, datetime — дата по DATE_FORMAT)
+EXPORT_SCHEMA = {
+    "call_id": "id",
+    "created_at": "datetime",
+    "call_type": "label",
+    "branch_name": "label",
+    "organization_name": "label",
+    "score": "number",
+    "criteria_name": "label",
+}
+# формат created_at в выгрузке из базы: разбор без угадывания формата по каждой строке
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# допустимые значения call_type (остальные строки сохраняются, но учитываются в отчёте проверки)
+CALL_TYPES = ("REGULAR", "AUDIO_BADGE")
+# отчёт проверки (prepare_data(..., return_report=True)): по строке на столбец схемы
+VALIDATION_COLUMNS = ["column", "type", "missing", "coerced", "zero", "not_allowed", "dropped"]
+
+
+def parse_datetime(values: pd.Series) -> pd.Series:
+    """
+    Дата по DATE_FORMAT (быстрый путь без угадывания формата); значения в другом формате
+    разбираются с автоопределением, нераспознанные -> NaT. Уже разобранный столбец не трогается.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    parsed = pd.to_datetime(values, format=DATE_FORMAT, errors="coerce")
+    rest = parsed.isna() & values.notna()
+    if not rest.any():
+        return parsed
+    with warnings.catch_warnings():
+        # среди оставшихся обычно мусорные значения: формат по ним не определяется, они станут NaT
+        warnings.simplefilter("ignore", UserWarning)
+        if rest.all():
+            return pd.to_datetime(values, errors="coerce")
+        parsed[rest] = pd.to_datetime(values[rest], errors="coerce")
+    return parsed
+
+
+def _missing_label(dtype):
+    """Чем становится пропуск при astype(str) для исходного типа столбца ("nan" или NaN)."""
+    return pd.Series([np.nan], dtype=dtype).astype(str).iloc[0]
+
+
+def _label_values(cat: pd.Series, missing) -> pd.Series:
+    """
+    Строковые значения категорий + значение пропуска в конце:
+    индексация кодом -1 даёт то же, что astype(str) для пропуска.
+    """
+    values = cat.cat.categories.astype(str).to_numpy(dtype=object)
+    return pd.Series(np.append(values, missing), dtype=object)
+
+
+def _combine_categorical(org: pd.Series, branch: pd.Series, org_missing, branch_missing) -> pd.Categorical:
+    """
+    organization_branch_name из кодов категорий: строки "org: branch"
+    собираются только для уникальных пар, а не для каждой строки.
+    """
+    n_branch = len(branch.cat.categories) + 1
+    pair = (org.cat.codes.to_numpy(dtype="int64") + 1) * n_branch + (branch.cat.codes.to_numpy(dtype="int64") + 1)
+    uniq, inverse = np.unique(pair, return_inverse=True)
+    org_labels = _label_values(org, org_missing).iloc[uniq // n_branch - 1].reset_index(drop=True)
+    branch_labels = _label_values(branch, branch_missing).iloc[uniq % n_branch - 1].reset_index(drop=True)
+    labels = org_labels + ": " + branch_labels
+    # разные пары теоретически могут дать одинаковую строку — сводим их в одну категорию
+    label_codes, categories = pd.factorize(labels)
+    return pd.Categorical.from_codes(label_codes[inverse.ravel()], categories=categories)
+
+
+def drop_unused_categories(df: pd.DataFrame) -> pd.DataFrame:
+    """Удаляет неиспользуемые категории (после фильтрации подвыборки)."""
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].cat.remove_unused_categories()
+    return df
+
+
+@instrumented("prepare_data")
+def prepare_data(df: pd.DataFrame, compact: bool = False, return_report: bool = False):
     """
     Минимальная безопасная подготовка:
-    - копия
+    - поверхностная копия (новые столбцы не меняют исходный df, данные не дублируются)
     - создание organization_branch_name (если есть organization_name и branch_name)
     - удаление score == 0
-    - преобразование created_at в datetime (если есть)
+    - преобразование created_at в datetime по DATE_FORMAT (если есть)
+
+    Каждый столбец разбирается один раз: уже числовой score и уже разобранный created_at
+    (например, прочитанные по схеме в read_export) не преобразуются повторно.
+
+    compact=True — компактное представление: текстовые метки хранятся как category,
+    organization_branch_name собирается из кодов категорий, целочисленный score —
+    в минимальном целом типе (int8 для шкалы 0..10).
+
+    return_report=True — возвращает (df, отчёт проверки): по столбцам схемы EXPORT_SCHEMA
+    число пустых значений, значений, приведённых к NaN/NaT, нулевых оценок, недопустимых
+    call_type и удалённых строк.
     """
-    df = df.copy()
+    df = df.copy(deep=False)
+    report = {col: dict.fromkeys(VALIDATION_COLUMNS[2:], 0) for col in EXPORT_SCHEMA if col in df.columns}
+    for col in report:
+        report[col]["missing"] = int(df[col].isna().sum())
+
+    if compact:
+        missing = {col: _missing_label(df[col].dtype) for col in ("organization_name", "branch_name") if col in df.columns}
+        for col in LABEL_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].astype("category")
+
+    if "call_type" in df.columns:
+        report["call_type"]["not_allowed"] = int((df["call_type"].notna() & ~df["call_type"].isin(CALL_TYPES)).sum())
 
     # Создаём organization_branch_name, если возможно
     if {"organization_name", "branch_name"}.issubset(df.columns):
-        df["organization_branch_name"] = df["organization_name"].astype(str) + ": " + df["branch_name"].astype(str)
+        if compact:
+            df["organization_branch_name"] = _combine_categorical(
+                df["organization_name"], df["branch_name"], missing["organization_name"], missing["branch_name"]
+            )
+        else:
+            df["organization_branch_name"] = df["organization_name"].astype(str) + ": " + df["branch_name"].astype(str)
+
+    # Преобразуем created_at, если есть (до удаления строк: отчёт считается по всем строкам файла)
+    if "created_at" in df.columns:
+        df["created_at"] = parse_datetime(df["created_at"])
+        report["created_at"]["coerced"] = int(df["created_at"].isna().sum()) - report["created_at"]["missing"]
 
     # Преобразуем score в числовой и убираем нули/NaN
     if "score" in df.columns:
-        df["score"] = pd.to_numeric(df["score"], errors="coerce")
-        df = df[df["score"].notna() & (df["score"] != 0)]
+        if not pd.api.types.is_numeric_dtype(df["score"]):
+            df["score"] = pd.to_numeric(df["score"], errors="coerce")
+        nan = df["score"].isna()
+        zero = df["score"] == 0
+        report["score"].update(coerced=int(nan.sum()) - report["score"]["missing"], zero=int(zero.sum()),
+                               dropped=int((nan | zero).sum()))
+        df = df[~nan & ~zero]
+        if compact and (df["score"] % 1 == 0).all():
+            df["score"] = pd.to_numeric(df["score"], downcast="integer")
+
+    if compact:
+        df = drop_unused_categories(df)
+
+    if not return_report:
+        return df
+    rows = [{"column": col, "type": EXPORT_SCHEMA[col], **counts} for col, counts in report.items()]
+    return df, pd.DataFrame(rows, columns=VALIDATION_COLUMNS)
 
-    # Преобразуем created_at, если есть
-    if "created_at" in df.columns:
-        df["created_at"] = pd.to_datetime(df["created_at"], errors="coerce")
 
-    return df
\ No newline at end of file
+def _align_categories(frames):
+    """
+    Общий набор категорий для category-столбцов всех таблиц (коды перекодируются, строки не создаются),
+    иначе pd.concat превращает category с разными категориями в object.
+    """
+    columns = dict.fromkeys(c for f in frames for c in f.columns if isinstance(f[c].dtype, pd.CategoricalDtype))
+    frames = [f.copy(deep=False) for f in frames]
+    for col in columns:
+        parts = [f[col].astype("category") for f in frames if col in f.columns]
+        categories = pd.Index(list(dict.fromkeys(c for part in parts for c in part.cat.categories)))
+        for f in frames:
+            if col in f.columns:
+                f[col] = f[col].astype("category").cat.set_categories(categories)
+            else:
+                f[col] = pd.Categorical.from_codes(np.full(len(f), -1), categories=categories)
+    return frames
+
+
+def combine_prepared(frames, keys=("call_id", "criteria_name")):
+    """
+    Объединяет подготовленные выгрузки (например, недельные за квартал) в одну таблицу.
+    Оценки, которые повторяются в нескольких файлах (пересекающиеся периоды), берутся
+    из первого файла, где встречаются (по ключу keys; повторы внутри одного файла не трогаются) —
+    так же, как при дополнении агрегатов (CallQualityAnalyzer.append): учтённая оценка не заменяется.
+    Без call_id повторы не ищутся, без criteria_name ключ — только call_id.
+    Возвращает (таблица, число удалённых повторов по каждому файлу).
+    """
+    frames = list(frames)
+    dropped = np.zeros(len(frames), dtype="int64")
+    if not frames:
+        return pd.DataFrame(), dropped
+    file_no = np.repeat(np.arange(len(frames)), [len(f) for f in frames])
+    merged = pd.concat(_align_categories(frames), ignore_index=True)
+    keys = [k for k in keys if k in merged.columns]
+    if len(frames) > 1 and keys and keys[0] == "call_id" and len(merged):
+        first = (
+            pd.Series(file_no)
+            .groupby([merged[k] for k in keys], dropna=False, observed=True, sort=False)
+            .transform("min")
+            .to_numpy()
+        )
+        keep = file_no == first
+        dropped = np.bincount(file_no[~keep], minlength=len(frames))
+        merged = merged[keep].reset_index(drop=True)
+    return drop_unused_categories(merged), dropped
+
+
+def iter_prepared_chunks(source, chunksize=200_000, compact=False, **read_kwargs):
+    """
+    Потоковое чтение CSV порциями по chunksize строк.
+    Каждая порция проходит те же правила, что и prepare_data.
+    """
+    for chunk in pd.read_csv(source, chunksize=chunksize, **read_kwargs):
+        yield prepare_data(chunk, compact=compact)
@@ -0,0 +1,259 @@
+import argparse
+import io
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from cache import fingerprint
+from data_preparation import DATE_FORMAT, EXPORT_SCHEMA, combine_prepared, prepare_data
+from workers import worker_context
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.feather as feather
+except ImportError:  # без pyarrow кэш на диске просто отключается, CSV читает pandas
+    pa = None
+    pa_csv = None
+    feather = None
+
+# версия формата: при изменении правил подготовки старые файлы перестают подходить
+# (2 — в метаданных отчёт проверки данных)
+CACHE_FORMAT_VERSION = 2
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "call_quality_analyzer"
+
+
+def _read_csv_arrow(data: bytes) -> pd.DataFrame:
+    """
+    CSV движком pyarrow (многопоточный разбор) по схеме EXPORT_SCHEMA: метки — строки,
+    created_at — сразу datetime по DATE_FORMAT, остальные типы определяются как в pandas.
+    Если даты в другом формате, created_at читается строкой и разбирается в prepare_data.
+    """
+    column_types = {col: pa.string() for col, kind in EXPORT_SCHEMA.items() if kind == "label"}
+    for parse_dates in (True, False):
+        types = dict(column_types, created_at=pa.timestamp("us") if parse_dates else pa.string())
+        options = pa_csv.ConvertOptions(column_types=types, timestamp_parsers=[DATE_FORMAT], strings_can_be_null=True)
+        try:
+            return pa_csv.read_csv(pa.py_buffer(data), parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+                                   convert_options=options).to_pandas()
+        except pa.ArrowInvalid:
+            if not parse_dates:
+                raise
+
+
+def read_export(data: bytes, name: str, nrows=None) -> pd.DataFrame:
+    """
+    Чтение выгрузки (CSV, XLSX или Parquet) из байтов.
+    nrows — только первые строки (заголовок и превью без чтения всего файла).
+    CSV целиком читается pyarrow по схеме выгрузки (если pyarrow установлен).
+    """
+    if name.endswith(".csv"):
+        if nrows is None and pa_csv is not None:
+            try:
+                return _read_csv_arrow(data)
+            except pa.ArrowInvalid:  # нестандартный CSV — разбор pandas
+                pass
+        return pd.read_csv(io.BytesIO(data), nrows=nrows)
+    if name.endswith(".parquet"):
+        return pd.read_parquet(io.BytesIO(data)).head(nrows)
+    return pd.read_excel(io.BytesIO(data), nrows=nrows)
+
+
+class PreparedFileCache:
+    """
+    Кэш подготовленных выгрузок на диске: каждая загрузка один раз проходит prepare_data
+    и сохраняется в несжатый Arrow/Feather-файл с ключом по хэшу содержимого.
+    Повторные загрузки читают файл через memory mapping (без повторного разбора CSV/XLSX).
+    Размер каталога ограничен max_bytes, при превышении удаляются давно не использованные файлы.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=2 * 1024 ** 3):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def available() -> bool:
+        return pa is not None
+
+    def path_for(self, file_hash: str, compact: bool = True) -> Path:
+        mode = "compact" if compact else "plain"
+        return self.cache_dir / f"{file_hash}-{mode}-v{CACHE_FORMAT_VERSION}.feather"
+
+    def load(self, file_hash: str, compact: bool = True):
+        """Возвращает (подготовленный df, метаданные) или None, если файла нет."""
+        path = self.path_for(file_hash, compact)
+        if not self.available() or not path.exists():
+            return None
+        table = feather.read_table(path, memory_map=True)
+        meta = json.loads((table.schema.metadata or {}).get(b"call_quality_analyzer", b"{}"))
+        os.utime(path)  # отметка использования для LRU
+        return table.to_pandas(), meta
+
+    def store(self, file_hash: str, prepared: pd.DataFrame, meta=None, compact: bool = True) -> Path:
+        """Сохраняет подготовленный df (запись через временный файл), затем освобождает место."""
+        if not self.available():
+            return None
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.path_for(file_hash, compact)
+        table = pa.Table.from_pandas(prepared.reset_index(drop=True), preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[b"call_quality_analyzer"] = json.dumps(meta or {}, ensure_ascii=False).encode()
+        table = table.replace_schema_metadata(metadata)
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        feather.write_feather(table, tmp, compression="uncompressed")
+        os.replace(tmp, path)
+        self.evict(keep=path)
+        return path if path.exists() else None
+
+    def get_or_prepare(self, data: bytes, name: str, compact: bool = True, file_hash=None):
+        """
+        Подготовленный df для загруженного файла: из кэша или через чтение + prepare_data.
+        Метаданные: исходное число строк, столбцы и отчёт проверки данных
+        (для отображения без повторного чтения).
+        """
+        file_hash = file_hash or fingerprint(data)
+        hit = self.load(file_hash, compact)
+        if hit is not None:
+            return hit
+        raw = read_export(data, name)
+        prepared, validation = prepare_data(raw, compact=compact, return_report=True)
+        meta = {"source": name, "raw_rows": len(raw), "raw_columns": [str(c) for c in raw.columns],
+                "validation": validation.to_dict("records")}
+        self.store(file_hash, prepared, meta, compact)
+        return prepared, meta
+
+    def files(self):
+        if not self.cache_dir.exists():
+            return []
+        return sorted(self.cache_dir.glob("*.feather"), key=lambda p: p.stat().st_mtime)
+
+    def size_bytes(self) -> int:
+        return sum(p.stat().st_size for p in self.files())
+
+    def evict(self, keep=None):
+        """Удаляет самые давно использованные файлы, пока каталог больше max_bytes."""
+        files = self.files()
+        total = sum(p.stat().st_size for p in files)
+        for path in files:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            total -= path.stat().st_size
+            path.unlink(missing_ok=True)
+        # файл больше всего лимита не храним
+        if total > self.max_bytes and keep is not None and keep.exists():
+            keep.unlink(missing_ok=True)
+
+
+# выгрузки (имя, байты) в процессе-работнике: передаются один раз при запуске, а не в каждую задачу
+_WORKER_FILES = None
+
+
+def _init_worker(files):
+    global _WORKER_FILES
+    _WORKER_FILES = files
+
+
+def _prepare_file(name, data, compact=True, cache_dir=None, max_bytes=2 * 1024 ** 3):
+    """
+    Чтение и подготовка одного файла (через кэш на диске, если задан cache_dir и есть pyarrow).
+    Ошибка чтения не прерывает остальные файлы: возвращается (None, метаданные с error).
+    """
+    start = time.perf_counter()
+    try:
+        file_cache = PreparedFileCache(cache_dir, max_bytes) if cache_dir is not None else None
+        if file_cache is not None and file_cache.available():
+            prepared, meta = file_cache.get_or_prepare(data, name, compact=compact)
+        else:
+            raw = read_export(data, name)
+            prepared, validation = prepare_data(raw, compact=compact, return_report=True)
+            meta = {"raw_rows": len(raw), "raw_columns": [str(c) for c in raw.columns],
+                    "validation": validation.to_dict("records")}
+    except Exception as e:
+        return None, {"source": name, "error": str(e), "seconds": time.perf_counter() - start}
+    return prepared, dict(meta, source=name, rows=len(prepared), seconds=time.perf_counter() - start)
+
+
+def _prepare_file_worker(i, compact, cache_dir, max_bytes):
+    return _prepare_file(*_WORKER_FILES[i], compact=compact, cache_dir=cache_dir, max_bytes=max_bytes)
+
+
+def load_exports(files, compact=True, required=(), max_workers=None, file_cache=None, processes=True):
+    """
+    Несколько выгрузок (например, недельных за квартал) -> одна подготовленная таблица.
+    files — список (имя, байты). Файлы читаются и готовятся параллельно в пуле процессов
+    (max_workers, по умолчанию — по числу ядер; 1 — в текущем процессе), при заданном file_cache —
+    через кэш на диске. processes=False — в пуле потоков (разбор CSV в pyarrow отпускает GIL):
+    для вызова из многопоточного процесса, например из фоновой задачи приложения Streamlit;
+    пул процессов — для пакетного запуска (report.py). Файлы без столбцов required (например, CallQualityAnalyzer.REQUIRED_BASE)
+    или с ошибкой чтения не входят в результат. Повторы оценок (call_id, criteria_name)
+    из пересекающихся периодов берутся из первого файла, см. combine_prepared.
+
+    Возвращает (таблица, отчёт по файлам: строки в файле, строки после подготовки, значения,
+    приведённые к NaN/NaT, строки без оценки или с нулевой оценкой, удалённые повторы,
+    время разбора в секундах, статус).
+    """
+    files = list(files)
+    cache_dir = file_cache.cache_dir if file_cache is not None and file_cache.available() else None
+    max_bytes = file_cache.max_bytes if file_cache is not None else 2 * 1024 ** 3
+    max_workers = min(len(files), max_workers or os.cpu_count() or 1)
+    if max_workers > 1 and not processes:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cqa-parse") as pool:
+            results = list(pool.map(lambda file: _prepare_file(*file, compact, cache_dir, max_bytes), files))
+    elif max_workers > 1:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=worker_context(),
+                                 initializer=_init_worker, initargs=(files,)) as pool:
+            futures = [pool.submit(_prepare_file_worker, i, compact, cache_dir, max_bytes) for i in range(len(files))]
+            results = [f.result() for f in futures]
+    else:
+        results = [_prepare_file(name, data, compact, cache_dir, max_bytes) for name, data in files]
+
+    frames, rows = [], []
+    for prepared, meta in results:
+        missing = [c for c in required if c not in meta.get("raw_columns", [])]
+        if "error" in meta:
+            status = f"ошибка чтения: {meta['error']}"
+        elif missing:
+            status = "нет столбцов: " + ", ".join(missing)
+        else:
+            status = "ok"
+            frames.append(prepared)
+        validation = meta.get("validation", [])
+        rows.append({"file": meta["source"], "raw_rows": meta.get("raw_rows", 0), "prepared_rows": meta.get("rows", 0),
+                     "coerced": sum(v["coerced"] for v in validation), "dropped": sum(v["dropped"] for v in validation),
+                     "duplicates": 0, "seconds": round(meta["seconds"], 3), "status": status})
+    combined, dropped = combine_prepared(frames)
+    report = pd.DataFrame(rows, columns=["file", "raw_rows", "prepared_rows", "coerced", "dropped", "duplicates",
+                                         "seconds", "status"])
+    report.loc[report["status"] == "ok", "duplicates"] = dropped
+    return combined, report
+
+
+def main(argv=None):
+    """Пакетная конвертация выгрузок в кэш (например, для заполнения кэша за прошлые периоды)."""
+    parser = argparse.ArgumentParser(description="Конвертация выгрузок CSV/XLSX в кэш подготовленных данных (Arrow/Feather)")
+    parser.add_argument("files", nargs="+", help="файлы выгрузок .csv / .xlsx")
+    parser.add_argument("--cache-dir", default=str(DEFAULT_CACHE_DIR), help="каталог кэша")
+    parser.add_argument("--max-mb", type=int, default=2048, help="ограничение размера каталога, МБ")
+    parser.add_argument("--plain", action="store_true", help="без компактного представления (category/int8)")
+    args = parser.parse_args(argv)
+
+    file_cache = PreparedFileCache(args.cache_dir, max_bytes=args.max_mb * 1024 ** 2)
+    if not file_cache.available():
+        parser.error("для кэша требуется pyarrow (pip install pyarrow)")
+    for name in args.files:
+        data = Path(name).read_bytes()
+        prepared, meta = file_cache.get_or_prepare(data, name, compact=not args.plain)
+        print(f"{name}: {meta.get('raw_rows')} строк -> {len(prepared)} после подготовки")
+    print(f"Кэш: {args.cache_dir}, {file_cache.size_bytes() / 1024 ** 2:.1f} МБ")
+
+
+if __name__ == "__main__":
+    main()
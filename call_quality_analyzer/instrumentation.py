@@ -0,0 +1,210 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime
+
+import pandas as pd
+
+# Замер «горячих» функций: время, число строк на входе/выходе, пик памяти (tracemalloc).
+# По умолчанию выключен: обёртка только проверяет флаг и вызывает функцию.
+# Включение из кода — configure(), без изменения кода — переменные окружения:
+#   CQA_PROFILE=1            — замер времени и строк;
+#   CQA_PROFILE_MEMORY=1     — ещё и пик памяти (заметно замедляет расчёты);
+#   CQA_PROFILE_LOG=путь     — записи дописываются в файл JSON lines (по строке на вызов).
+# Пик памяти tracemalloc общий на процесс, поэтому он записывается только для замеров, которые
+# шли одни: если во время замера в другом потоке шёл другой замер (фоновые задачи приложения),
+# peak_mb у обоих пустой.
+
+_enabled = False
+_memory = False
+_log_path = None
+_records = deque(maxlen=10_000)
+_seq = 0  # номер последней записи
+_lock = threading.Lock()
+_local = threading.local()
+_roots = set()  # открытые внешние замеры памяти во всех потоках
+
+
+def configure(enabled=True, memory=False, log_path=None, max_records=None):
+    """Включает/выключает замер. max_records — сколько последних записей хранить в памяти."""
+    global _enabled, _memory, _log_path, _records
+    if max_records is not None and max_records != _records.maxlen:
+        _records = deque(_records, maxlen=max_records)
+    if _memory and not memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _enabled, _memory, _log_path = enabled, memory and enabled, log_path
+    if _memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def records(since=0) -> list:
+    """Записи (словари) с номером больше since: records(mark()) — только записи, сделанные после mark."""
+    with _lock:
+        return [r for r in _records if r["seq"] > since]
+
+
+def mark() -> int:
+    return _seq
+
+
+def summary(rows) -> pd.DataFrame:
+    """Сводка по функциям: число вызовов, суммарное/максимальное время, строки, пик памяти."""
+    if not rows:
+        return pd.DataFrame()
+    df = pd.DataFrame(rows)
+    aggs = {"calls": ("seconds", "size"), "total_s": ("seconds", "sum"), "max_s": ("seconds", "max"),
+            "rows_in": ("rows_in", "max"), "rows_out": ("rows_out", "max")}
+    if df["peak_mb"].notna().any():
+        aggs["peak_mb"] = ("peak_mb", "max")
+    out = df.groupby(["kind", "name"], sort=False).agg(**aggs).reset_index()
+    return out.sort_values("total_s", ascending=False).round(4).reset_index(drop=True)
+
+
+def _rows(obj):
+    if isinstance(obj, pd.DataFrame):
+        return len(obj)
+    df = getattr(obj, "df", None)
+    return len(df) if isinstance(df, pd.DataFrame) else None
+
+
+def _input_rows(args, kwargs):
+    """Строки на входе: первый DataFrame среди аргументов, иначе df объекта (self)."""
+    for value in (*args[1:], *kwargs.values()):
+        if isinstance(value, pd.DataFrame):
+            return len(value)
+    return _rows(args[0]) if args else None
+
+
+def _emit(record):
+    global _seq
+    with _lock:
+        _seq += 1
+        record["seq"] = _seq
+        _records.append(record)
+        path = _log_path
+    if path:
+        # по строке на запись в режиме дозаписи: файл можно писать из нескольких процессов
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+class span:
+    """
+    Замер блока кода: with span("app.block_1", kind="block"): ...
+    Вложенные замеры учитываются во внешних (время и пик памяти включают вложенные вызовы).
+    Пик памяти не записывается, если замер пересёкся по времени с замером в другом потоке.
+    """
+
+    def __init__(self, name, kind="span", rows_in=None):
+        self.name = name
+        self.kind = kind
+        self.rows_in = rows_in
+        self.rows_out = None
+
+    def __enter__(self):
+        if not _enabled:
+            self.active = False
+            return self
+        self.active = True
+        stack = _local.__dict__.setdefault("stack", [])
+        self.depth = len(stack)
+        self.parent = stack[-1].name if stack else None
+        self.memory = _memory and tracemalloc.is_tracing()
+        if self.memory:
+            self.root = stack[0] if stack else self
+            if not stack:
+                # счётчик пика один на процесс: замеры, идущие одновременно в разных потоках,
+                # сбрасывали бы пики друг друга — у всех пересекающихся замеров пик не записывается
+                with _lock:
+                    self.shared = bool(_roots)
+                    for other in _roots:
+                        other.shared = True
+                    _roots.add(self)
+            current, peak = tracemalloc.get_traced_memory()
+            if not self.root.shared:
+                if stack:
+                    # пик внешнего блока до начала вложенного сохраняется, затем счётчик пика сбрасывается
+                    stack[-1].peak = max(stack[-1].peak, peak)
+                tracemalloc.reset_peak()
+            self.start_mem, self.peak = current, current
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.active:
+            return False
+        seconds = time.perf_counter() - self.start
+        stack = _local.stack
+        stack.pop()
+        peak_mb = None
+        if self.memory and tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            if not self.root.shared:
+                peak_mb = round((self.peak - self.start_mem) / 1024 ** 2, 3)
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+        if self.memory and self.root is self:
+            with _lock:
+                _roots.discard(self)
+        _emit({
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            "kind": self.kind,
+            "name": self.name,
+            "seconds": round(seconds, 6),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "peak_mb": peak_mb,
+            "depth": self.depth,
+            "parent": self.parent,
+            "error": None if exc_type is None else exc_type.__name__,
+            "pid": os.getpid(),
+        })
+        return False
+
+
+def instrumented(name=None, kind="function"):
+    """Декоратор: замер каждого вызова функции (строки — по первому DataFrame-аргументу и результату)."""
+    def decorator(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with span(label, kind, _input_rows(args, kwargs)) as s:
+                result = func(*args, **kwargs)
+                s.rows_out = _rows(result) if isinstance(result, pd.DataFrame) else None
+                return result
+        return wrapper
+    return decorator
+
+
+def instrument_methods(prefixes, kind="method"):
+    """
+    Декоратор класса: замер всех методов с именами из prefixes (и __init__),
+    в том числе classmethod/staticmethod.
+    """
+    def decorator(cls):
+        for attr, value in list(vars(cls).items()):
+            if not (attr == "__init__" or attr.startswith(prefixes)):
+                continue
+            label = f"{cls.__name__}.{attr}"
+            if isinstance(value, (classmethod, staticmethod)):
+                setattr(cls, attr, type(value)(instrumented(label, kind)(value.__func__)))
+            elif callable(value):
+                setattr(cls, attr, instrumented(label, kind)(value))
+        return cls
+    return decorator
+
+
+if os.environ.get("CQA_PROFILE") or os.environ.get("CQA_PROFILE_LOG"):
+    configure(True, memory=bool(os.environ.get("CQA_PROFILE_MEMORY")), log_path=os.environ.get("CQA_PROFILE_LOG"))
@@ -0,0 +1,33 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    """
+    Модуль, который импортируется при первом обращении к атрибуту.
+    Тяжёлые зависимости (matplotlib/seaborn, scipy) не загружаются,
+    пока не понадобятся графики или статистические тесты.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "загружен" if self._module is not None else "не загружен"
+        return f"<LazyModule {self._name} ({state})>"
+
+
+def lazy_module(name: str) -> LazyModule:
+    return LazyModule(name)
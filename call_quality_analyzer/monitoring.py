@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+
+
+class DriftMonitor:
+    """
+    Потоковое обнаружение сдвигов средней оценки сразу для многих рядов (филиал или филиал × критерий)
+    детекторами EWMA и двусторонним CUSUM по календарным периодам.
+
+    Оценка периода стандартизуется относительно истории ряда до этого периода:
+    z = (среднее периода − среднее истории) / sqrt(σ² / n + τ²), где σ² — разброс оценок,
+    n — число оценок периода, τ² — разброс средних между периодами сверх выборочного шума.
+    Состояние ряда — несколько накопленных сумм, поэтому новый период обрабатывается за O(1) на ряд,
+    история повторно не просматривается. Повторная подача последнего периода (неполная неделя,
+    дозагрузка) заменяет его вклад: перед обновлением сохраняется состояние до периода.
+
+    - lam — вес нового периода в EWMA, L — ширина границ EWMA в сигмах;
+    - k — допуск CUSUM (в сигмах на период), h — порог CUSUM;
+    - warmup — число периодов истории до начала проверки, min_scores — минимум оценок в периоде.
+    """
+
+    STATE = [
+        "n_hist", "sum_hist", "sq_hist",            # оценки истории: число, сумма, сумма квадратов
+        "periods", "mean_sum", "mean_sq", "inv_n",  # средние периодов истории: число, сумма, сумма квадратов, Σ 1/n
+        "ewma", "cusum_low", "cusum_high",           # статистики детекторов
+        "last_mean", "last_n", "baseline", "z",      # последний проверенный период ряда
+    ]
+
+    def __init__(self, lam=0.3, L=3.0, k=0.5, h=4.0, warmup=4, min_scores=10):
+        if not 0 < lam <= 1:
+            raise ValueError(f"Вес EWMA должен быть в (0, 1]: {lam}")
+        self.lam, self.L, self.k, self.h = lam, L, k, h
+        self.warmup, self.min_scores = warmup, min_scores
+        self.state = None
+        self.seen = None  # последний период с оценками по каждому ряду
+        self.last_period = None
+        self._previous = (None, None, None)  # состояние до последнего периода
+
+    @property
+    def params(self):
+        return {"lam": self.lam, "L": self.L, "k": self.k, "h": self.h,
+                "warmup": self.warmup, "min_scores": self.min_scores}
+
+    @property
+    def ewma_limit(self):
+        """Асимптотическая граница EWMA стандартизованной статистики."""
+        return self.L * np.sqrt(self.lam / (2 - self.lam))
+
+    def update(self, period, stats: pd.DataFrame):
+        """
+        Добавляет период: stats — индекс ряда, столбцы n, score_sum, score_sq_sum.
+        Периоды подаются по возрастанию; тот же период, что и последний, заменяет его.
+        """
+        if self.last_period is not None and period < self.last_period:
+            raise ValueError(f"Период {period} раньше последнего обработанного {self.last_period}")
+        if period == self.last_period:
+            self.state, self.seen, self.last_period = self._previous
+        self._previous = (self.state, self.seen, self.last_period)
+
+        state = self.state
+        if state is None:
+            state = pd.DataFrame(0.0, index=stats.index[0:0], columns=self.STATE)
+        new = stats.index.difference(state.index)
+        if len(new):
+            state = pd.concat([state, pd.DataFrame(0.0, index=new, columns=self.STATE)])
+            state.loc[new, ["baseline", "z", "last_mean"]] = np.nan
+
+        stats = stats[stats["n"] >= self.min_scores]
+        rows = state.index.get_indexer(stats.index)
+        col = {c: state[c].to_numpy(copy=True) for c in self.STATE}
+        n = stats["n"].to_numpy(dtype="float64")
+        total = stats["score_sum"].to_numpy(dtype="float64")
+        mean = total / n
+
+        n_hist, periods = col["n_hist"][rows], col["periods"][rows]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            baseline = col["sum_hist"][rows] / n_hist
+            sigma2 = np.maximum(col["sq_hist"][rows] / n_hist - baseline ** 2, 0)
+            means_avg = col["mean_sum"][rows] / periods
+            means_var = (col["mean_sq"][rows] - periods * means_avg ** 2) / (periods - 1)
+            tau2 = np.maximum(means_var - sigma2 * col["inv_n"][rows] / periods, 0)
+            z = (mean - baseline) / np.sqrt(sigma2 / n + np.where(periods > 1, tau2, 0))
+        # проверка — только после warmup периодов истории и при ненулевом разбросе
+        check = (periods >= self.warmup) & np.isfinite(z)
+        z = np.where(check, z, np.nan)
+        zc = np.where(check, z, 0.0)
+        col["ewma"][rows] = np.where(check, self.lam * zc + (1 - self.lam) * col["ewma"][rows], col["ewma"][rows])
+        col["cusum_low"][rows] = np.where(check, np.maximum(0, col["cusum_low"][rows] - zc - self.k), col["cusum_low"][rows])
+        col["cusum_high"][rows] = np.where(check, np.maximum(0, col["cusum_high"][rows] + zc - self.k), col["cusum_high"][rows])
+        col["baseline"][rows], col["z"][rows] = baseline, z
+        col["last_mean"][rows], col["last_n"][rows] = mean, n
+
+        # период переходит в историю ряда
+        col["n_hist"][rows] += n
+        col["sum_hist"][rows] += total
+        col["sq_hist"][rows] += stats["score_sq_sum"].to_numpy(dtype="float64")
+        col["periods"][rows] += 1
+        col["mean_sum"][rows] += mean
+        col["mean_sq"][rows] += mean ** 2
+        col["inv_n"][rows] += 1 / n
+
+        seen = self.seen.reindex(state.index) if self.seen is not None else pd.Series(pd.NaT, index=state.index)
+        seen.iloc[rows] = period
+        self.state, self.seen = pd.DataFrame(col, index=state.index), seen
+        self.last_period = period
+        return self
+
+    def alerts(self, only_flagged=True) -> pd.DataFrame:
+        """
+        Текущее состояние рядов: статус (снижение / рост / норма) и тяжесть — наибольшее отношение
+        статистики детектора к его порогу (≥ 1 — сигнал). Сортировка по убыванию тяжести.
+        period, avg_score, baseline, z — последний период ряда с оценками и его сравнение с историей.
+        """
+        if self.state is None or self.state.empty:
+            return pd.DataFrame()
+        s = self.state
+        drop = np.maximum(-s["ewma"] / self.ewma_limit, s["cusum_low"] / self.h)
+        rise = np.maximum(s["ewma"] / self.ewma_limit, s["cusum_high"] / self.h)
+        severity = np.maximum(drop, rise)
+        status = np.select([(drop >= 1) & (drop >= rise), rise >= 1], ["Снижение", "Рост"], "Норма")
+        out = pd.DataFrame({
+            "period": self.seen,
+            "avg_score": s["last_mean"].round(2),
+            "baseline": s["baseline"].round(2),
+            "n_scores": s["last_n"].astype("int64"),
+            "periods": s["periods"].astype("int64"),
+            "z": s["z"].round(2),
+            "ewma": s["ewma"].round(2),
+            "cusum_low": s["cusum_low"].round(2),
+            "cusum_high": s["cusum_high"].round(2),
+            "severity": severity.round(2),
+            "status": status,
+        }, index=s.index)
+        if only_flagged:
+            out = out[out["status"] != "Норма"]
+        out = out.sort_values("severity", ascending=False, kind="mergesort")
+        return out.reset_index()
@@ -0,0 +1,128 @@
+import atexit
+import io
+import os
+import threading
+import weakref
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import pandas as pd
+
+from cache import ResultCache, fingerprint_frame
+from workers import worker_context
+
+
+def render_png(func_name, data, kwargs, dpi=100) -> bytes:
+    """
+    Отрисовка функции из visualizations в PNG (backend Agg, без экрана).
+    Фигура закрывается сразу после сохранения — в процессе не копятся открытые фигуры.
+    """
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    import matplotlib.pyplot as plt
+    import visualizations
+
+    fig = getattr(visualizations, func_name)(data, **kwargs)
+    try:
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", dpi=dpi, bbox_inches="tight")
+        return buf.getvalue()
+    finally:
+        plt.close(fig)
+
+
+class FigureRenderer:
+    """
+    Параллельная отрисовка графиков в PNG с кэшем по содержимому.
+
+    - ключ кэша: функция + хэш входной таблицы + параметры графика, одинаковый график
+      не рисуется дважды (в том числе пока он ещё рисуется — повторный запрос получает тот же Future);
+    - max_workers — ограничение числа одновременно рисующих процессов (0 — отрисовка в текущем процессе);
+    - политика закрытия: фигура закрывается сразу после сохранения в PNG, пул процессов
+      пересоздаётся после max_tasks_per_pool графиков (старые процессы завершаются, дорисовав
+      свои задачи), кэш PNG ограничен max_bytes.
+    """
+
+    def __init__(self, max_workers=None, max_bytes=256 * 1024 ** 2, dpi=100, max_tasks_per_pool=100):
+        self.max_workers = min(4, os.cpu_count() or 1) if max_workers is None else max_workers
+        self.dpi = dpi
+        self.max_tasks_per_pool = max_tasks_per_pool
+        self.cache = ResultCache(max_bytes=max_bytes)
+        self._pending = {}  # key -> Future (графики в работе)
+        self._hashes = {}  # id(df) -> (weakref, хэш), чтобы не хэшировать одну таблицу повторно
+        self._lock = threading.Lock()
+        self._local_lock = threading.Lock()  # pyplot не потокобезопасен
+        self._pool = None
+        self._pool_tasks = 0
+        atexit.register(self.shutdown)
+
+    def _executor(self):
+        if self._pool is not None and self._pool_tasks >= self.max_tasks_per_pool:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        if self._pool is None:
+            os.environ.setdefault("MPLBACKEND", "Agg")
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=worker_context(preload=["visualizations"]))
+            self._pool_tasks = 0
+        self._pool_tasks += 1
+        return self._pool
+
+    def _frame_hash(self, df: pd.DataFrame) -> str:
+        hit = self._hashes.get(id(df))
+        if hit is not None and hit[0]() is df:
+            return hit[1]
+        h = fingerprint_frame(df)
+        self._hashes = {k: v for k, v in self._hashes.items() if v[0]() is not None}
+        self._hashes[id(df)] = (weakref.ref(df), h)
+        return h
+
+    def key(self, func_name, data, kwargs):
+        return (func_name, self._frame_hash(data), tuple(sorted(kwargs.items())), self.dpi)
+
+    def submit(self, func_name, data, **kwargs) -> Future:
+        """PNG графика (Future): из кэша, из уже запущенной отрисовки или новая задача пула."""
+        key = self.key(func_name, data, kwargs)
+        with self._lock:
+            png = self.cache.get(key)
+            if png is not None:
+                future = Future()
+                future.set_result(png)
+                return future
+            if key in self._pending:
+                return self._pending[key]
+            if self.max_workers > 0:
+                future = self._executor().submit(render_png, func_name, data, kwargs, self.dpi)
+            else:
+                future = Future()
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._done(key, f))
+        if self.max_workers == 0:
+            try:
+                with self._local_lock:
+                    future.set_result(render_png(func_name, data, kwargs, self.dpi))
+            except Exception as e:
+                future.set_exception(e)
+        return future
+
+    def _done(self, key, future):
+        with self._lock:
+            self._pending.pop(key, None)
+            if not future.cancelled() and future.exception() is None:
+                self.cache.put(key, future.result())
+
+    def render(self, func_name, data, **kwargs) -> bytes:
+        return self.submit(func_name, data, **kwargs).result()
+
+    def submit_spec(self, spec) -> Future:
+        """spec — (функция, таблица, параметры), например из CallQualityAnalyzer.figure_spec."""
+        func_name, data, kwargs = spec
+        return self.submit(func_name, data, **kwargs)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        stats = self.cache.stats()
+        stats["pending"] = len(self._pending)
+        stats["workers"] = self.max_workers
+        return stats
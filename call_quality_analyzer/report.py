@@ -0,0 +1,349 @@
+import os, sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# без UI: фигуры рисуются только в файлы (наследуется процессами-работниками)
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import pandas as pd
+
+from analyzer import CallQualityAnalyzer
+from backends import BACKENDS
+from lazy_imports import lazy_module
+from file_cache import PreparedFileCache, load_exports, read_export
+from data_preparation import VALIDATION_COLUMNS, prepare_data
+
+plt = lazy_module("matplotlib.pyplot")
+
+BLOCK_BASE = "Распределение оценок/звонков, средние оценки"
+BLOCK_DATES = "Динамика оценок"
+BLOCK_CRITERIA = "Анализ критериев оценок"
+
+
+def _save_table(df, out_dir, name, fmt):
+    path = out_dir / f"{name}.{fmt}"
+    keep_index = not isinstance(df.index, pd.RangeIndex)
+    if fmt == "parquet":
+        df.to_parquet(path, index=keep_index)
+    else:
+        df.to_csv(path, index=keep_index)
+    return path
+
+
+def _save_figure(fig, out_dir, name, dpi):
+    path = out_dir / f"{name}.png"
+    fig.savefig(path, dpi=dpi, bbox_inches="tight")
+    plt.close(fig)
+    return path
+
+
+class _BlockRunner:
+    """Выполняет задачи блока, сохраняет результаты и замеряет время каждой задачи."""
+
+    def __init__(self, analyzer, out_dir, fmt, dpi, figures, facet_page_size=0):
+        self.analyzer = analyzer
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.dpi = dpi
+        self.figures = figures
+        self.facet_page_size = facet_page_size
+        self.timings = []
+
+    def table(self, name, method, *args, **kwargs):
+        start = time.perf_counter()
+        df = getattr(self.analyzer, method)(*args, **kwargs)
+        path = _save_table(df, self.out_dir, name, self.fmt)
+        self.timings.append((path.name, time.perf_counter() - start))
+        return df
+
+    def figure(self, name, method, *args, **kwargs):
+        if not self.figures:
+            return
+        start = time.perf_counter()
+        fig = getattr(self.analyzer, method)(*args, **kwargs)
+        path = _save_figure(fig, self.out_dir, name, self.dpi)
+        self.timings.append((path.name, time.perf_counter() - start))
+
+    def facet_figures(self, name, method, df_in, *args):
+        """Сетка графиков по филиалам: одна фигура или страницы по facet_page_size филиалов (name_p01, ...)."""
+        if not self.figures:
+            return
+        if not self.facet_page_size:
+            return self.figure(name, method, *args)
+        groups = self.analyzer.get_facet_groups(df_in)
+        for page in range(-(-len(groups) // self.facet_page_size)):
+            self.figure(f"{name}_p{page + 1:02d}", method, *args,
+                        self.analyzer.facet_page(groups, page, self.facet_page_size))
+
+
+def _block_distribution(run, options):
+    run.table("1_score_count_by_branch", "get_all_score_by_branch")
+    run.table("1_call_count_by_branch", "get_call_count")
+    a = run.analyzer
+    run.facet_figures("1_distribution_all", "plot_distributions_all", a.df)
+    run.facet_figures("1_distribution_call", "plot_distributions_call", a.df_call)
+    run.facet_figures("1_distribution_badge", "plot_distributions_badge", a.df_badge)
+
+
+def _block_averages(run, options):
+    run.table("2_avg_score_all", "get_avg_score_by_branch")
+    run.table("2_avg_score_call", "get_avg_score_by_branch_call")
+    run.table("2_avg_score_badge", "get_avg_score_by_branch_badge")
+    run.table("2_avg_score_full", "get_full_avg_score_by_branch")
+    run.table("2_avg_score_full_organization", "get_full_avg_score_by_branch", "organization_name")
+    run.table("2_avg_score_full_total", "get_full_avg_score_by_branch", "total")
+    a = run.analyzer
+    run.table("2_avg_score_ci_all", "get_avg_score_ci", a.df)
+    run.table("2_avg_score_ci_call", "get_avg_score_ci", a.df_call)
+    run.table("2_avg_score_ci_badge", "get_avg_score_ci", a.df_badge)
+    run.figure("2_avg_score_all", "plot_avg_score")
+    run.figure("2_avg_score_call", "plot_avg_score_call")
+    run.figure("2_avg_score_badge", "plot_avg_score_badge")
+
+
+# сигналы сдвига средней оценки по неделям: таблица -> параметры get_drift_alerts
+DRIFT_ALERTS = {
+    "3_drift_alerts": {},
+    "3_drift_alerts_criteria": {"by_criteria": True},
+}
+
+
+def _block_dynamics(run, options):
+    a = run.analyzer
+    run.table("3_weekly_all", "get_avg_score_by_week", a.df)
+    run.table("3_weekly_call", "get_avg_score_by_week", a.df_call)
+    run.table("3_weekly_badge", "get_avg_score_by_week", a.df_badge)
+    run.table("3_monthly_all", "get_avg_score_by_month", a.df)
+    run.table("3_monthly_call", "get_avg_score_by_month", a.df_call)
+    run.table("3_monthly_badge", "get_avg_score_by_month", a.df_badge)
+    run.table("3_weekly_organization", "get_avg_score_by_week", a.df, "organization_name")
+    run.table("3_monthly_organization", "get_avg_score_by_month", a.df, "organization_name")
+    run.figure("3_weekly_trends_all", "plot_weekly_all")
+    run.figure("3_weekly_trends_call", "plot_weekly_call")
+    run.figure("3_weekly_trends_badge", "plot_weekly_badge")
+    run.facet_figures("3_weekly_grid_all", "plot_weekly_grid_all", a.df, "W")
+    run.facet_figures("3_weekly_grid_call", "plot_weekly_grid_call", a.df_call, "W")
+    run.facet_figures("3_weekly_grid_badge", "plot_weekly_grid_badge", a.df_badge, "W")
+    run.figure("3_monthly_trends_all", "plot_weekly_all", "M")
+    for name, kwargs in DRIFT_ALERTS.items():
+        run.table(name, "get_drift_alerts", **kwargs)
+
+
+def _block_criteria(run, options):
+    a = run.analyzer
+    for suffix, df_in, avg_method, count_col in [
+        ("call", a.df_call, "get_avg_score_by_branch_call", "count_call"),
+        ("badge", a.df_badge, "get_avg_score_by_branch_badge", "count_audio_badge"),
+    ]:
+        avg_criteria = run.table(f"4_avg_score_criteria_{suffix}", "get_avg_score_criteria", df_in)
+        run.table(f"4_avg_score_criteria_ci_{suffix}", "get_avg_score_ci", df_in, by_criteria=True)
+        impact = run.table(
+            f"4_criteria_impact_{suffix}", "get_criteria_impact", df_in,
+            avg_score_criteria=avg_criteria, avg_score_by_branch=getattr(a, avg_method)(), count_col=count_col,
+        )
+        if not impact.empty:
+            run.figure(f"4_criteria_heatmap_{suffix}", "plot_criteria_heatmap", impact)
+    if a.streamed:
+        # по сохранённому состоянию (только агрегаты) тесты не считаются
+        return
+    test_args = {"min_pairs": options["min_pairs"], "alpha": options["alpha"]}
+    run.table("4_test1_ethics_vs_listening", "test_professional_vs_active_listening", **test_args)
+    run.table("4_test2_ethics_vs_objections_impact", "test_impact_ethics_vs_objections", **test_args)
+    run.table("4_test3_presentation_vs_objections", "test_presentation_vs_objections", **test_args)
+    run.table("4_criteria_correlation", "get_criteria_correlation", min_pairs=options["min_pairs"])
+
+
+# блоки отчёта: (флаг из available_blocks, функция блока)
+REPORT_BLOCKS = {
+    "1_distribution": (BLOCK_BASE, _block_distribution),
+    "2_averages": (BLOCK_BASE, _block_averages),
+    "3_dynamics": (BLOCK_DATES, _block_dynamics),
+    "4_criteria": (BLOCK_CRITERIA, _block_criteria),
+}
+
+# анализатор в процессе-работнике (передаётся один раз на процесс)
+_WORKER_ANALYZER = None
+
+
+def _init_worker(analyzer):
+    global _WORKER_ANALYZER
+    _WORKER_ANALYZER = analyzer
+
+
+def _run_block(block, out_dir, options, analyzer=None):
+    run = _BlockRunner(analyzer or _WORKER_ANALYZER, out_dir, options["format"], options["dpi"], options["figures"],
+                       options.get("facet_page_size", 0))
+    REPORT_BLOCKS[block][1](run, options)
+    return [(f"{block}/{name}", seconds) for name, seconds in run.timings]
+
+
+def _load_prepared(path, file_cache=None):
+    """Подготовленная выгрузка и отчёт проверки данных (из метаданных кэша, если файл уже в нём)."""
+    data = Path(path).read_bytes()
+    if file_cache is not None and file_cache.available():
+        prepared, meta = file_cache.get_or_prepare(data, str(path), compact=True)
+        return prepared, pd.DataFrame(meta.get("validation", []), columns=VALIDATION_COLUMNS)
+    return prepare_data(read_export(data, str(path)), compact=True, return_report=True)
+
+
+def render_report(analyzer, out_dir, options, timings=None):
+    """
+    Все доступные блоки анализатора (available_blocks): таблицы — CSV/Parquet, фигуры — PNG.
+    Независимые блоки выполняются параллельно. Возвращает список (этап, секунды).
+    """
+    timings = [] if timings is None else timings
+    out_dir.mkdir(parents=True, exist_ok=True)
+    blocks = [b for b, (flag, _) in REPORT_BLOCKS.items() if analyzer.available_blocks.get(flag)]
+    start = time.perf_counter()
+    if options["jobs"] > 1 and len(blocks) > 1:
+        with ProcessPoolExecutor(max_workers=min(options["jobs"], len(blocks)),
+                                 initializer=_init_worker, initargs=(analyzer,)) as pool:
+            futures = [pool.submit(_run_block, b, out_dir, options) for b in blocks]
+            for future in futures:
+                timings.extend(future.result())
+    else:
+        for b in blocks:
+            timings.extend(_run_block(b, out_dir, options, analyzer))
+    timings.append(("blocks (wall)", time.perf_counter() - start))
+
+    pd.DataFrame(timings, columns=["stage", "seconds"]).to_csv(out_dir / "timings.csv", index=False)
+    with open(out_dir / "available_blocks.json", "w", encoding="utf-8") as f:
+        json.dump(analyzer.available_blocks, f, ensure_ascii=False, indent=2)
+    return timings
+
+
+def build_report(path, out_dir, options, file_cache=None):
+    """Отчёт по одному файлу выгрузки. Возвращает список (этап, секунды)."""
+    timings = []
+    start = time.perf_counter()
+    prepared, validation = _load_prepared(path, file_cache)
+    timings.append(("load+prepare", time.perf_counter() - start))
+    out_dir.mkdir(parents=True, exist_ok=True)
+    validation.to_csv(out_dir / "validation.csv", index=False)
+
+    start = time.perf_counter()
+    analyzer = CallQualityAnalyzer(prepared, prepared=True)
+    timings.append(("analyzer", time.perf_counter() - start))
+    return render_report(analyzer, out_dir, options, timings)
+
+
+def merge_report(paths, out_dir, options, file_cache=None):
+    """
+    Один отчёт по нескольким выгрузкам (например, недельным за квартал): файлы разбираются
+    параллельно, повторы оценок из пересекающихся периодов удаляются (load_exports).
+    Отчёт по файлам сохраняется в files.csv.
+    """
+    start = time.perf_counter()
+    files = [(str(path), Path(path).read_bytes()) for path in paths]
+    prepared, files_report = load_exports(files, compact=True, required=CallQualityAnalyzer.REQUIRED_BASE,
+                                          max_workers=options["jobs"], file_cache=file_cache)
+    timings = [(f"parse {Path(row.file).name} ({row.status})", row.seconds) for row in files_report.itertuples()]
+    timings.append(("load+merge (wall)", time.perf_counter() - start))
+    out_dir.mkdir(parents=True, exist_ok=True)
+    files_report.to_csv(out_dir / "files.csv", index=False)
+
+    start = time.perf_counter()
+    analyzer = CallQualityAnalyzer(prepared, compact=True, prepared=True)
+    timings.append(("analyzer", time.perf_counter() - start))
+    return render_report(analyzer, out_dir, options, timings)
+
+
+def update_state_report(paths, state_path, out_dir, options):
+    """
+    Инкрементальное обновление: новые выгрузки добавляются к сохранённому состоянию
+    (CallQualityAnalyzer.append), состояние сохраняется обратно, отчёт строится по всей истории.
+    Оценки, уже учтённые в состоянии (пересекающиеся периоды), пропускаются: остаётся ранее
+    добавленная, как при --merge (берётся первый файл).
+    Стоимость обновления зависит от размера новых выгрузок, а не истории.
+    """
+    timings = []
+    start = time.perf_counter()
+    state_path = Path(state_path)
+    if state_path.exists():
+        analyzer = CallQualityAnalyzer.load_state(state_path)
+    else:
+        analyzer = CallQualityAnalyzer(pd.DataFrame(), compact=True)
+    timings.append(("load state", time.perf_counter() - start))
+    for path in paths:
+        start = time.perf_counter()
+        analyzer.append(read_export(Path(path).read_bytes(), str(path)))
+        timings.append((f"append {Path(path).name} (повторов: {analyzer.appended_duplicates})", time.perf_counter() - start))
+    start = time.perf_counter()
+    # детекторы сдвигов обновляются новыми периодами и сохраняются вместе с агрегатами
+    for kwargs in DRIFT_ALERTS.values():
+        analyzer.get_drift_monitor(**kwargs)
+    analyzer.save_state(state_path)
+    timings.append(("save state", time.perf_counter() - start))
+    return render_report(analyzer, out_dir, options, timings)
+
+
+def backend_report(paths, out_dir, options):
+    """
+    Один отчёт по всем Parquet-файлам: агрегаты считает движок (DuckDB/Polars) прямо по файлам,
+    строки в память не загружаются. Статистические тесты в этом режиме не считаются.
+    """
+    start = time.perf_counter()
+    analyzer = CallQualityAnalyzer.from_parquet(paths, backend=options["backend"])
+    timings = [(f"analyzer ({options['backend']})", time.perf_counter() - start)]
+    return render_report(analyzer, out_dir, options, timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетный отчёт по выгрузкам звонков без UI")
+    parser.add_argument("files", nargs="+", help="файлы выгрузок .csv / .xlsx / .parquet")
+    parser.add_argument("-o", "--out", default="reports", help="каталог для результатов (по подкаталогу на файл)")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv", help="формат таблиц")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="число процессов для блоков")
+    parser.add_argument("--no-figures", dest="figures", action="store_false", help="только таблицы")
+    parser.add_argument("--dpi", type=int, default=100)
+    parser.add_argument("--facet-page-size", type=int, default=0,
+                        help="сетки графиков по филиалам — страницами по N филиалов (0 — одна фигура на все филиалы)")
+    parser.add_argument("--min-pairs", type=int, default=10, help="порог для статистических тестов")
+    parser.add_argument("--alpha", type=float, default=0.05, help="уровень значимости тестов")
+    parser.add_argument("--cache-dir", default=None, help="каталог кэша подготовленных выгрузок (Arrow)")
+    parser.add_argument("--merge", default=None, metavar="NAME",
+                        help="один отчёт по всем файлам в подкаталоге NAME (повторы оценок из пересекающихся периодов удаляются)")
+    parser.add_argument("--state", default=None,
+                        help="файл агрегатного состояния: выгрузки добавляются к нему, отчёт — по всей истории; "
+                             "оценки из пересекающихся периодов (call_id + criteria_name) учитываются один раз")
+    parser.add_argument("--backend", choices=["pandas", *BACKENDS], default="pandas",
+                        help="движок агрегатов: pandas (в памяти) или duckdb/polars (по Parquet-файлам на диске, "
+                             "один отчёт по всем файлам)")
+    args = parser.parse_args(argv)
+    if args.backend != "pandas" and args.state:
+        parser.error("--backend и --state не используются вместе")
+    if args.merge and (args.state or args.backend != "pandas"):
+        parser.error("--merge не используется вместе с --state и --backend")
+
+    options = {
+        "format": args.format, "jobs": max(args.jobs, 1), "figures": args.figures, "dpi": args.dpi,
+        "min_pairs": args.min_pairs, "alpha": args.alpha, "backend": args.backend,
+        "facet_page_size": max(args.facet_page_size, 0),
+    }
+    file_cache = PreparedFileCache(args.cache_dir) if args.cache_dir else None
+    if args.backend != "pandas":
+        out_dir = Path(args.out) / args.backend
+        runs = [(", ".join(map(str, args.files)), out_dir, lambda out_dir: backend_report(args.files, out_dir, options))]
+    elif args.merge:
+        runs = [(", ".join(map(str, args.files)), Path(args.out) / args.merge,
+                 lambda out_dir: merge_report(args.files, out_dir, options, file_cache))]
+    elif args.state:
+        runs = [(Path(args.state).name, Path(args.out) / Path(args.state).stem,
+                 lambda out_dir: update_state_report(args.files, args.state, out_dir, options))]
+    else:
+        runs = [(path, Path(args.out) / Path(path).stem,
+                 lambda out_dir, path=path: build_report(path, out_dir, options, file_cache)) for path in args.files]
+    for name, out_dir, run in runs:
+        timings = run(out_dir)
+        print(f"\n{name} -> {out_dir}")
+        for stage, seconds in timings:
+            print(f"  {stage:<55} {seconds:8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
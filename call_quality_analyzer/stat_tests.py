@@ -0,0 +1,317 @@
+import numpy as np
+import pandas as pd
+
+from lazy_imports import lazy_module
+
+# scipy нужен только для p-value нормальной аппроксимации
+special = lazy_module("scipy.special")
+
+
+def _group_ranks(groups: np.ndarray, values: np.ndarray):
+    """
+    Средние ранги values внутри каждой группы (одна сортировка на все группы).
+    Возвращает ранги (в исходном порядке), а также для каждой серии одинаковых значений
+    её группу и размер (нужно для поправки на связки).
+    """
+    n = len(values)
+    if n == 0:
+        return np.empty(0), np.empty(0, dtype="int64"), np.empty(0, dtype="int64")
+    order = np.lexsort((values, groups))
+    g, v = groups[order], values[order]
+    new_group = np.r_[True, g[1:] != g[:-1]]
+    new_block = new_group | np.r_[True, v[1:] != v[:-1]]
+    block_start = np.flatnonzero(new_block)
+    block_size = np.diff(np.r_[block_start, n])
+    block_id = np.cumsum(new_block) - 1
+    group_start = np.maximum.accumulate(np.where(new_group, np.arange(n), 0))
+    ranks_sorted = (2 * block_start + block_size - 1)[block_id] / 2 - group_start + 1
+    ranks = np.empty(n)
+    ranks[order] = ranks_sorted
+    return ranks, g[block_start], block_size
+
+
+def _null_counts(doubled_ranks: np.ndarray, active: np.ndarray, max_sum: int) -> np.ndarray:
+    """
+    Точное нулевое распределение суммы положительных рангов для всех групп сразу:
+    произведение (1 + x^r) по рангам группы, ранги удвоены (средние ранги — полуцелые).
+    doubled_ranks, active — матрицы (группы × позиция), неактивные позиции не меняют распределение.
+    """
+    counts = np.zeros((doubled_ranks.shape[0], max_sum + 1))
+    counts[:, 0] = 1
+    sums = np.arange(max_sum + 1)
+    for j in range(doubled_ranks.shape[1]):
+        src = sums[None, :] - doubled_ranks[:, [j]]
+        shifted = np.take_along_axis(counts, np.clip(src, 0, None), axis=1)
+        counts = counts + np.where((src >= 0) & active[:, [j]], shifted, 0)
+    return counts
+
+
+def wilcoxon_batched(groups, x, y=None, alternative="two-sided"):
+    """
+    Знаковый ранговый критерий Вилкоксона сразу для всех групп (филиалов).
+    Повторяет scipy.stats.wilcoxon с параметрами по умолчанию
+    (zero_method="wilcox", correction=False, method="auto"):
+    - n <= 50 без нулей и связок — точное распределение;
+    - n <= 13 с нулями/связками — точный перебор знаков (как permutation_test в scipy);
+    - иначе — нормальная аппроксимация с поправкой на связки.
+
+    groups — метка группы для каждой пары, x/y — значения пары (или готовые разности в x).
+    Возвращает DataFrame с индексом-группой и столбцами n_pairs, statistic, p_value.
+    """
+    if alternative not in {"two-sided", "less", "greater"}:
+        raise ValueError(f"Неизвестная альтернатива: {alternative}")
+    d = np.asarray(x, dtype="float64")
+    if y is not None:
+        d = d - np.asarray(y, dtype="float64")
+    codes, labels = pd.factorize(pd.Series(groups), sort=True)
+    # пары без группы (NaN) не участвуют
+    d, codes = d[codes >= 0], codes[codes >= 0]
+    n_groups = len(labels)
+    if n_groups == 0:
+        return pd.DataFrame(columns=["n_pairs", "statistic", "p_value"])
+
+    n_total = np.bincount(codes, minlength=n_groups)
+    nonzero = d != 0
+    n_zero = n_total - np.bincount(codes[nonzero], minlength=n_groups)
+    g, dz = codes[nonzero], d[nonzero]
+
+    # ранги |d| внутри группы (нули исключены, как в zero_method="wilcox")
+    ranks, tie_group, tie_size = _group_ranks(g, np.abs(dz))
+    count = np.bincount(g, minlength=n_groups).astype("float64")
+    r_plus = np.bincount(g, weights=ranks * (dz > 0), minlength=n_groups)
+    r_minus = np.bincount(g, weights=ranks * (dz < 0), minlength=n_groups)
+    tie_correct = np.bincount(tie_group, weights=tie_size.astype("float64") ** 3 - tie_size, minlength=n_groups)
+    has_ties = np.bincount(tie_group, weights=tie_size > 1, minlength=n_groups) > 0
+
+    # нормальная аппроксимация
+    mn = count * (count + 1) / 4
+    with np.errstate(divide="ignore", invalid="ignore"):
+        se = np.sqrt((count * (count + 1) * (2 * count + 1) - tie_correct / 2) / 24)
+        z = (r_plus - mn) / se
+    if alternative == "greater":
+        p = special.ndtr(-z)
+    elif alternative == "less":
+        p = special.ndtr(z)
+    else:
+        p = 2 * special.ndtr(-np.abs(z))
+
+    # точный расчёт (распределение без связок или полный перебор знаков)
+    exact = (n_total <= 50) & ~has_ties & (n_zero == 0)
+    exact |= (n_total <= 13) & (has_ties | (n_zero > 0))
+    if exact.any():
+        sel = np.flatnonzero(exact)
+        pos = np.flatnonzero(np.isin(g, sel))
+        # матрица рангов (группа × позиция пары внутри группы)
+        order = np.argsort(g[pos], kind="stable")
+        row = np.searchsorted(sel, g[pos][order])
+        col = np.arange(len(pos)) - np.searchsorted(row, row, side="left")
+        doubled_ranks = np.zeros((len(sel), max(int(count[sel].max()), 1)), dtype="int64")
+        active = np.zeros(doubled_ranks.shape, dtype=bool)
+        doubled_ranks[row, col] = np.rint(2 * ranks[pos][order]).astype("int64")
+        active[row, col] = True
+        null = _null_counts(doubled_ranks, active, int(doubled_ranks.sum(axis=1).max()))
+        total = null.sum(axis=1)
+        observed = np.rint(2 * r_plus[sel]).astype("int64")[:, None]
+        p_less = np.take_along_axis(np.cumsum(null, axis=1), observed, axis=1)[:, 0] / total
+        p_greater = np.take_along_axis(np.cumsum(null[:, ::-1], axis=1)[:, ::-1], observed, axis=1)[:, 0] / total
+        if alternative == "greater":
+            p[sel] = p_greater
+        elif alternative == "less":
+            p[sel] = p_less
+        else:
+            p[sel] = np.clip(2 * np.minimum(p_less, p_greater), 0, 1)
+
+    statistic = np.minimum(r_plus, r_minus) if alternative == "two-sided" else r_plus
+    return pd.DataFrame(
+        {"n_pairs": n_total, "statistic": statistic, "p_value": p},
+        index=pd.Index(labels, name="group"),
+    )
+
+
+def adjust_pvalues(p, method="holm"):
+    """
+    Поправка на множественные сравнения:
+    - "holm" — Холм (контроль FWER);
+    - "bh" — Бенджамини–Хохберг (контроль FDR);
+    - None — без поправки.
+    NaN не участвуют и остаются NaN.
+    """
+    p = np.asarray(p, dtype="float64")
+    if method is None:
+        return p.copy()
+    out = np.full_like(p, np.nan)
+    mask = ~np.isnan(p)
+    m = int(mask.sum())
+    if m == 0:
+        return out
+    order = np.argsort(p[mask], kind="stable")
+    sorted_p = p[mask][order]
+    if method == "holm":
+        adj = np.maximum.accumulate((m - np.arange(m)) * sorted_p)
+    elif method == "bh":
+        adj = np.minimum.accumulate((sorted_p * m / np.arange(1, m + 1))[::-1])[::-1]
+    else:
+        raise ValueError(f"Неизвестный метод поправки: {method}")
+    adjusted = np.empty(m)
+    adjusted[order] = np.minimum(adj, 1)
+    out[mask] = adjusted
+    return out
+
+
+
+def bootstrap_mean_ci(counts, values, n_boot=1000, level=0.95, seed=0, max_draws=4_000_000):
+    """
+    Перцентильные бутстреп-интервалы среднего сразу для многих ячеек (филиал / тип / критерий)
+    по их гистограммам оценок, без построчных данных и цикла по ячейкам.
+
+    counts — матрица частот (ячейки × значения оценки), values — значения оценки (столбцы counts).
+    Повторная выборка ячейки с n оценками — вектор частот из Multinomial(n, доли значений),
+    поэтому стоимость не зависит от числа оценок: n_boot выборок всех ячеек пачки — один вызов
+    Generator.multinomial. max_draws ограничивает размер пачки (ячейки × n_boot × значения).
+    Возвращает (mean, low, high); у ячеек без оценок — NaN.
+    """
+    counts = np.asarray(counts, dtype="int64")
+    values = np.asarray(values, dtype="float64")
+    n = counts.sum(axis=1)
+    mean = np.full(len(n), np.nan)
+    low, high = mean.copy(), mean.copy()
+    filled = np.flatnonzero(n > 0)
+    if len(filled) == 0:
+        return mean, low, high
+    mean[filled] = counts[filled] @ values / n[filled]
+    rng = np.random.default_rng(seed)
+    tail = (1 - level) / 2
+    step = max(1, max_draws // (n_boot * len(values)))
+    for start in range(0, len(filled), step):
+        cells = filled[start:start + step]
+        size = n[cells, None]
+        draws = rng.multinomial(size, (counts[cells] / size)[:, None, :], size=(len(cells), n_boot))
+        boot = draws @ values / size
+        low[cells], high[cells] = np.quantile(boot, [tail, 1 - tail], axis=1)
+    return mean, low, high
+
+
+def ci_ranks(low, high):
+    """
+    Границы места в рейтинге по доверительным интервалам (1 — лучшее).
+    Лучшее возможное место — 1 + число ячеек, чей интервал целиком выше;
+    худшее — число ячеек минус те, чей интервал целиком ниже.
+    Ячейки с пересекающимися интервалами статистически не различимы: их диапазоны мест перекрываются.
+    """
+    low = np.asarray(low, dtype="float64")
+    high = np.asarray(high, dtype="float64")
+    sorted_low, sorted_high = np.sort(low), np.sort(high)
+    above = len(low) - np.searchsorted(sorted_low, high, side="right")
+    below = np.searchsorted(sorted_high, low, side="left")
+    return above + 1, len(low) - below
+
+def correlation_stats(values, branch, n_branches):
+    """
+    Достаточные статистики попарных корреляций критериев по филиалам.
+    values — матрица звонок × критерий (NaN — нет оценки), строки упорядочены по branch (код филиала).
+    Возвращает массив филиалы × 4 × критерии × критерии: для пары (i, j) по звонкам, где есть обе оценки, —
+    число пар, сумма x_i, сумма x_i² и сумма x_i·x_j. Каждый филиал — четыре матричных произведения
+    по своему диапазону строк; статистики аддитивны, поэтому организации и итог — их суммы.
+    """
+    n_criteria = values.shape[1]
+    out = np.zeros((n_branches, 4, n_criteria, n_criteria))
+    bounds = np.searchsorted(branch, np.arange(n_branches + 1))
+    for b in range(n_branches):
+        block = values[bounds[b]:bounds[b + 1]]
+        if len(block) == 0:
+            continue
+        mask = (~np.isnan(block)).astype("float64")
+        x = np.where(mask > 0, block, 0).astype("float64")
+        out[b] = mask.T @ mask, x.T @ mask, (x * x).T @ mask, x.T @ x
+    return out
+
+
+def correlation_from_stats(stats):
+    """Коэффициент корреляции Пирсона (попарно полные звонки) из correlation_stats: (n_pairs, r)."""
+    n, sx, sxx, sxy = np.moveaxis(stats, -3, 0)
+    sy, syy = np.swapaxes(sx, -1, -2), np.swapaxes(sxx, -1, -2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = sxy - sx * sy / n
+        var_x = sxx - sx * sx / n
+        var_y = syy - sy * sy / n
+        r = cov / np.sqrt(var_x * var_y)
+    # вырожденные пары (нет пар или нулевой разброс с точностью до округления) — NaN
+    r[(n < 2) | (var_x <= 1e-12 * sxx) | (var_y <= 1e-12 * syy)] = np.nan
+    return n.astype("int64"), np.clip(r, -1, 1)
+
+
+def _compare_pairs(data, pairs, variant, alternative, min_pairs):
+    """
+    Сравнение списка пар критериев (индексы столбцов матрицы звонок × критерий) по всем филиалам.
+    variant="paired" — разность оценок пары внутри звонка;
+    variant="contribution" — разность |оценка − средняя филиала| (по всем критериям звонков, где есть оба).
+    """
+    values, branch = data["values"], data["branch"]
+    n_branches = len(data["branch_labels"])
+    out = []
+    for i, j in pairs:
+        x, y = values[:, i], values[:, j]
+        valid = ~np.isnan(x) & ~np.isnan(y)
+        b, x, y = branch[valid], x[valid], y[valid]
+        if variant == "contribution":
+            sums = np.bincount(b, weights=data["row_sum"][valid], minlength=n_branches)
+            cnts = np.bincount(b, weights=data["row_count"][valid], minlength=n_branches)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                mean = (sums / cnts)[b]
+            x, y = np.abs(x - mean), np.abs(y - mean)
+        n = np.bincount(b, minlength=n_branches)
+        ok = (n >= min_pairs) & (data["counts"][:, i] >= min_pairs) & (data["counts"][:, j] >= min_pairs)
+        keep = ok[b]
+        if not keep.any():
+            continue
+        res = wilcoxon_batched(b[keep], x[keep], y[keep], alternative=alternative)
+        res.index = data["branch_labels"][res.index.to_numpy()]
+        out.append(res.assign(criterion_1=data["criteria"][i], criterion_2=data["criteria"][j]))
+    return out
+
+
+# данные движка в процессе-работнике (передаются один раз через initializer)
+_WORKER_DATA = None
+
+
+def _init_worker(data):
+    global _WORKER_DATA
+    _WORKER_DATA = data
+
+
+def _compare_pairs_worker(args):
+    return _compare_pairs(_WORKER_DATA, *args)
+
+
+def compare_criteria_pairs(data, pairs, variant="paired", alternative="two-sided", min_pairs=10, n_jobs=None):
+    """
+    Движок сравнения критериев: каждая пара — независимая единица работы
+    (батч-тест Вилкоксона сразу по всем филиалам).
+    n_jobs > 1 — пары распределяются по пулу процессов, матрица передаётся каждому процессу один раз.
+    Процессы запускаются через workers.worker_context (forkserver/spawn, без fork и без повторного
+    выполнения главного модуля), поэтому пул безопасен и в многопоточном процессе Streamlit.
+
+    data — словарь: values (звонки × критерии, NaN — нет оценки), branch (код филиала звонка),
+    branch_labels, criteria, row_sum/row_count (сумма и число оценок звонка),
+    counts (филиалы × критерии, число оценок).
+    Возвращает длинную таблицу: group, criterion_1, criterion_2, n_pairs, statistic, p_value.
+    """
+    if variant not in {"paired", "contribution"}:
+        raise ValueError(f"Неизвестный вариант сравнения: {variant}")
+    pairs = list(pairs)
+    if n_jobs and n_jobs > 1 and len(pairs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        from workers import worker_context
+
+        n_chunks = min(len(pairs), n_jobs * 4)
+        chunks = [(pairs[k::n_chunks], variant, alternative, min_pairs) for k in range(n_chunks)]
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=worker_context(),
+                                 initializer=_init_worker, initargs=(data,)) as pool:
+            parts = [res for chunk in pool.map(_compare_pairs_worker, chunks) for res in chunk]
+    else:
+        parts = _compare_pairs(data, pairs, variant, alternative, min_pairs)
+    columns = ["group", "criterion_1", "criterion_2", "n_pairs", "statistic", "p_value"]
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(parts).rename_axis("group").reset_index()[columns]
@@ -1,44 +1,121 @@
 import matplotlib.pyplot as plt
+import numpy as np
 import seaborn as sns
 import pandas as pd
 
+from instrumentation import instrumented
+
 sns.set_style("whitegrid")
 
 
+def _weighted_median(values: np.ndarray, counts: np.ndarray) -> float:
+    """Медиана по частотам (для чётного числа оценок — среднее двух центральных, как Series.median)."""
+    cum = np.cumsum(counts)
+    total = cum[-1]
+    lo = values[np.searchsorted(cum, (total - 1) // 2, side="right")]
+    hi = values[np.searchsorted(cum, total // 2, side="right")]
+    return (lo + hi) / 2
+
+
+def _binned_kde(values: np.ndarray, counts: np.ndarray, gridsize=200):
+    """
+    Гауссовская KDE по частотам значений (ширина окна по правилу Скотта, как в seaborn)
+    на сетке от минимума до максимума. Стоимость — O(gridsize × число различных значений).
+    """
+    n = counts.sum()
+    if n < 2 or len(values) < 2:
+        return None
+    mean = (values * counts).sum() / n
+    var = (counts * (values - mean) ** 2).sum() / (n - 1)
+    if var <= 0:
+        return None
+    bw = np.sqrt(var) * n ** (-1 / 5)
+    grid = np.linspace(values.min(), values.max(), gridsize)
+    z = (grid[:, None] - values[None, :]) / bw
+    density = (counts * np.exp(-0.5 * z * z)).sum(axis=1) / (n * bw * np.sqrt(2 * np.pi))
+    return grid, density
+
+
+@instrumented("visualizations.plot_score_distributions", kind="figure")
 def plot_score_distributions(df: pd.DataFrame,
                              group_col="organization_branch_name",
                              score_col="score",
                              title="Распределение оценок по филиалам",
                              bins=10, col_wrap=2, height=4, aspect=1.2,
-                             fontsize_title=16, fontsize_labels=12):
+                             fontsize_title=16, fontsize_labels=12,
+                             count_col="count", groups=None, xlim=None):
     """
-    FacetGrid гистограмм по колонке group_col. Возвращает matplotlib.figure.
+    Сетка гистограмм по колонке group_col. Возвращает matplotlib.figure.
+    df — гистограмма (group_col, score_col, count_col), см. CallQualityAnalyzer.get_score_histogram;
+    построчные данные без count_col сначала сворачиваются в частоты.
+    Гистограмма, среднее, медиана и KDE считаются по частотам, поэтому стоимость
+    не зависит от числа строк.
+    groups — состав и порядок фасетов (страница сетки), xlim — общие для всех страниц пределы оси оценок.
     """
     if df is None or df.empty:
         return plt.figure()
+    if count_col not in df.columns:
+        df = df.groupby([group_col, score_col], observed=True, sort=False).size().reset_index(name=count_col)
+
+    # только встречающиеся значения (у category-столбца подвыборки могут быть лишние категории)
+    present = list(df[group_col].dropna().unique())
+    groups = present if groups is None else [g for g in groups if g in set(present)]
+    if not groups:
+        return plt.figure()
+    ncols = min(col_wrap, len(groups))
+    nrows = -(-len(groups) // ncols)
+    # общие пределы осей задаются в конце: sharex/sharey на сотнях осей работает за O(n²)
+    fig, axes = plt.subplots(nrows, ncols, figsize=(ncols * height * aspect, nrows * height), squeeze=False)
+    axes = axes.ravel()
+    for ax in axes[len(groups):]:
+        ax.set_visible(False)
 
-    g = sns.FacetGrid(df, col=group_col, col_wrap=col_wrap, height=height, aspect=aspect)
-    g.map(sns.histplot, score_col, bins=bins, stat="probability", kde=True)
+    hists = dict(list(df.groupby(group_col, observed=True, sort=False)))
+    if xlim is None:
+        xlim = (df[score_col].min(), df[score_col].max())
+    ymax = 0
+    for branch_name, ax in zip(groups, axes):
+        sub = hists[branch_name].sort_values(score_col)
+        values = sub[score_col].to_numpy(dtype="float64")
+        counts = sub[count_col].to_numpy(dtype="float64")
+        total = counts.sum()
+        heights, edges, _ = ax.hist(values, bins=bins, weights=counts / total, color="C0", alpha=0.75, edgecolor="white")
+        ymax = max(ymax, heights.max())
+        kde = _binned_kde(values, counts)
+        if kde is not None:
+            # масштаб как у seaborn при stat="probability": плотность × ширина корзины
+            line = kde[1] * np.diff(edges).mean()
+            ax.plot(kde[0], line, color="C0")
+            ymax = max(ymax, line.max())
 
-    # добавляем mean/median lines
-    for branch_name, ax in g.axes_dict.items():
-        subset = df.loc[df[group_col] == branch_name, score_col].dropna()
-        if subset.empty:
-            continue
-        mean_val = subset.mean()
-        median_val = subset.median()
+        # добавляем mean/median lines
+        mean_val = (values * counts).sum() / total
+        median_val = _weighted_median(values, counts)
         ax.axvline(mean_val, color="red", linestyle="--", linewidth=2, label=f"Mean={mean_val:.2f}")
         ax.axvline(median_val, color="green", linestyle="-.", linewidth=2, label=f"Median={median_val:.2f}")
         ax.legend(fontsize=8)
+        ax.set_title(str(branch_name), size=fontsize_labels)
 
-    g.set_titles(col_template="{col_name}", size=fontsize_labels)
-    g.fig.subplots_adjust(top=0.92, hspace=0.3)
-    g.fig.suptitle(title, fontsize=fontsize_title)
-    return g.fig
+    pad = (xlim[1] - xlim[0]) * 0.05 or 0.5
+    for i, ax in enumerate(axes[:len(groups)]):
+        ax.set_xlim(xlim[0] - pad, xlim[1] + pad)
+        ax.set_ylim(0, ymax * 1.05)
+        if i % ncols == 0:
+            ax.set_ylabel("Probability")
+        else:
+            ax.tick_params(labelleft=False)
+        if i + ncols >= len(groups):
+            ax.set_xlabel(score_col)
+        else:
+            ax.tick_params(labelbottom=False)
+    fig.subplots_adjust(top=0.92, hspace=0.3)
+    fig.suptitle(title, fontsize=fontsize_title)
+    return fig
 
 
+@instrumented("visualizations.plot_avg_bar", kind="figure")
 def plot_avg_bar(df_avg: pd.DataFrame, x="organization_branch_name", y="avg_score",
-                 title="Средняя оценка филиалов", figsize=(10, 6)):
+                 title="Средняя оценка филиалов", figsize=(10, 6), xlabel="Филиал"):
     if df_avg is None or df_avg.empty:
         return plt.figure()
     fig, ax = plt.subplots(figsize=figsize)
@@ -47,23 +124,26 @@ def plot_avg_bar(df_avg: pd.DataFrame, x="organization_branch_name", y="avg_scor
     for container in ax.containers:
         ax.bar_label(container, fmt="%.1f", fontsize=9)
     ax.set_title(title)
-    ax.set_xlabel("Филиал")
+    ax.set_xlabel(xlabel)
     ax.set_ylabel("Средняя оценка")
     plt.xticks(rotation=45, ha="right")
     plt.tight_layout()
     return fig
 
 
-def plot_weekly_trends(df_weekly: pd.DataFrame, title="Недельная динамика средней оценки по филиалам"):
+@instrumented("visualizations.plot_weekly_trends", kind="figure")
+def plot_weekly_trends(df_weekly: pd.DataFrame, title="Недельная динамика средней оценки по филиалам",
+                       xlabel="Неделя", group_col="organization_branch_name"):
+    """Динамика по периодам: df_weekly — филиалы (group_col) × периоды (столбцы в хронологическом порядке)."""
     if df_weekly is None or df_weekly.empty:
         return plt.figure()
     # melt
-    melted = df_weekly.melt(id_vars="organization_branch_name", var_name="week", value_name="average_score")
+    melted = df_weekly.melt(id_vars=group_col, var_name="period", value_name="average_score")
     fig, ax = plt.subplots(figsize=(9, 6))
-    sns.lineplot(data=melted, x="week", y="average_score", hue="organization_branch_name", marker="o", ax=ax)
+    sns.lineplot(data=melted, x="period", y="average_score", hue=group_col, marker="o", ax=ax)
     ax.legend(loc="upper center", bbox_to_anchor=(0.5, -0.15), ncol=3, fontsize=8)
     plt.tight_layout(rect=[0, 0.05, 1, 1])
-    ax.set_xlabel("Неделя")
+    ax.set_xlabel(xlabel)
     ax.set_ylabel("Средняя оценка")
     ax.set_title(title)
     plt.xticks(rotation=45)
@@ -72,20 +152,30 @@ def plot_weekly_trends(df_weekly: pd.DataFrame, title="Недельная дин
     return fig
 
 
+@instrumented("visualizations.plot_weekly_grid", kind="figure")
 def plot_weekly_grid(df_weekly: pd.DataFrame, group_col="organization_branch_name",
-                     col_wrap=2, height=3.5, aspect=1.5, title="Графики недельной динамики по филиалам"):
+                     col_wrap=2, height=3.5, aspect=1.5, title="Графики недельной динамики по филиалам",
+                     xlabel="Неделя", groups=None):
+    """groups — состав и порядок фасетов (страница сетки), по умолчанию — все строки df_weekly."""
     if df_weekly is None or df_weekly.empty:
         return plt.figure()
-    melted = df_weekly.melt(id_vars="organization_branch_name", var_name="week", value_name="average_score")
-    g = sns.FacetGrid(melted, col=group_col, col_wrap=col_wrap, height=height, aspect=aspect)
-    g.map_dataframe(sns.lineplot, x="week", y="average_score", marker="o")
+    if groups is not None:
+        df_weekly = df_weekly[df_weekly[group_col].isin(groups)]
+        present = set(df_weekly[group_col])
+        groups = [g for g in groups if g in present]
+        if not groups:
+            return plt.figure()
+    melted = df_weekly.melt(id_vars=group_col, var_name="period", value_name="average_score")
+    g = sns.FacetGrid(melted, col=group_col, col_order=groups, col_wrap=col_wrap, height=height, aspect=aspect)
+    g.map_dataframe(sns.lineplot, x="period", y="average_score", marker="o")
     g.set_titles(col_template="{col_name}")
-    g.set_axis_labels("Неделя", "Средняя оценка")
+    g.set_axis_labels(xlabel, "Средняя оценка")
     g.fig.subplots_adjust(top=0.92, hspace=0.3)
     g.fig.suptitle(title, fontsize=14)
     return g.fig
 
 
+@instrumented("visualizations.plot_heatmap", kind="figure")
 def plot_heatmap(df_heat: pd.DataFrame, title="Тепловая карта по критериям (средние)"):
     if df_heat is None or df_heat.empty:
         return plt.figure()
@@ -0,0 +1,69 @@
+import multiprocessing
+import multiprocessing.spawn
+import threading
+
+# флаг запуска процесса-работника в текущем потоке (другие потоки и их процессы не затрагиваются)
+_LOCAL = threading.local()
+_get_preparation_data = multiprocessing.spawn.get_preparation_data
+
+
+def _preparation_data(name):
+    """
+    Данные родителя для запуска процесса spawn/forkserver. Для процесса-работника — без главного
+    модуля: иначе работник при старте выполняет главный модуль родителя, а в Streamlit это скрипт
+    приложения (__main__ с __file__ = app.py). Работникам нужны только модули пакета из sys.path
+    родителя, sys.modules["__main__"] при этом не меняется.
+    """
+    data = _get_preparation_data(name)
+    if getattr(_LOCAL, "hide_main", False):
+        data.pop("init_main_from_path", None)
+        data.pop("init_main_from_name", None)
+    return data
+
+
+multiprocessing.spawn.get_preparation_data = _preparation_data
+
+
+class _WorkerProcess:
+    """Процесс-работник: главный модуль родителя скрыт только на время запуска и только в этом потоке."""
+
+    def start(self):
+        _LOCAL.hide_main = True
+        try:
+            super().start()
+        finally:
+            _LOCAL.hide_main = False
+
+
+class _SpawnWorkerProcess(_WorkerProcess, multiprocessing.context.SpawnProcess):
+    pass
+
+
+class _SpawnWorkerContext(multiprocessing.context.SpawnContext):
+    Process = _SpawnWorkerProcess
+
+
+if hasattr(multiprocessing.context, "ForkServerProcess"):
+    class _ForkServerWorkerProcess(_WorkerProcess, multiprocessing.context.ForkServerProcess):
+        pass
+
+    class _ForkServerWorkerContext(multiprocessing.context.ForkServerContext):
+        Process = _ForkServerWorkerProcess
+
+
+def worker_context(preload=()):
+    """
+    Контекст запуска процессов-работников для ProcessPoolExecutor(mp_context=...): способ задаётся
+    явно, а не берётся по умолчанию платформы. fork не используется: пулы создаются и из потоков
+    многопоточного процесса Streamlit, а fork такого процесса может зависнуть. На Linux/macOS —
+    forkserver (работники ответвляются от чистого процесса-сервера), где его нет (Windows) — spawn.
+
+    preload — модули, которые сервер импортирует один раз до ответвления работников (например,
+    matplotlib через visualizations). Сервер один на процесс, список берётся при его первом запуске.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = _ForkServerWorkerContext()
+        if preload:
+            context.set_forkserver_preload(list(preload))
+        return context
+    return _SpawnWorkerContext()
@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+# модули пакета и бенчмарков импортируются плоско, как в app.py и report.py
+sys.path[:0] = [str(ROOT / "call_quality_analyzer"), str(ROOT / "benchmarks")]
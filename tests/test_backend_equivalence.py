@@ -0,0 +1,40 @@
+"""
+Совпадение сводных таблиц CallQualityAnalyzer.from_parquet на движках DuckDB и Polars с pandas
+(набор таблиц — backend_equivalence.tables). Данные — синтетическая выгрузка с фиксированным seed,
+разбитая на несколько Parquet-файлов. Движок, пакет которого не установлен, пропускается.
+"""
+import pytest
+
+from analyzer import CallQualityAnalyzer
+from backend_equivalence import compare, tables
+from synthetic import generate_export
+
+PARTS = 3
+
+
+@pytest.fixture(scope="module")
+def parquet_files(tmp_path_factory):
+    pytest.importorskip("pyarrow")
+    df = generate_export(20_000, branches=12, organizations=3, criteria=6, seed=11)
+    out_dir = tmp_path_factory.mktemp("parquet")
+    step = -(-len(df) // PARTS)
+    files = []
+    for i in range(PARTS):
+        path = out_dir / f"export-{i}.parquet"
+        df.iloc[i * step:(i + 1) * step].to_parquet(path, index=False)
+        files.append(path)
+    return files
+
+
+@pytest.fixture(scope="module")
+def expected(parquet_files):
+    return tables(CallQualityAnalyzer.from_parquet(parquet_files, backend="pandas"))
+
+
+@pytest.mark.parametrize("backend", ["duckdb", "polars"])
+def test_backend_matches_pandas(backend, parquet_files, expected):
+    pytest.importorskip(backend)
+    actual = tables(CallQualityAnalyzer.from_parquet(parquet_files, backend=backend))
+    assert set(actual) == set(expected)
+    assert all(not df.empty for df in expected.values())
+    assert compare(expected, actual) == []